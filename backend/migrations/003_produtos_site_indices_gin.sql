@@ -0,0 +1,15 @@
+-- Índices GIN em produtos_site
+-- Consultas de contenção (@>) em imagens_adicionais e tags passam de
+-- seq scan (parse do JSON linha a linha) para busca no índice
+
+-- jsonb_path_ops: índice menor e mais rápido, suporta apenas @> (contenção)
+CREATE INDEX IF NOT EXISTS idx_produtos_site_imagens_gin
+    ON produtos_site USING GIN (imagens_adicionais jsonb_path_ops);
+
+-- tags: GIN com a classe de operadores padrão do tipo (array ou jsonb)
+CREATE INDEX IF NOT EXISTS idx_produtos_site_tags_gin
+    ON produtos_site USING GIN (tags);
+
+-- Exemplos de consultas atendidas:
+--   SELECT id FROM produtos_site WHERE imagens_adicionais @> '["https://.../foto.jpg"]';
+--   SELECT id FROM produtos_site WHERE tags @> ARRAY['queijo'];
@@ -0,0 +1,9 @@
+-- Índice único em produtos_site.tiny_id
+-- Necessário para o upsert da sincronização (INSERT ... ON CONFLICT (tiny_id)),
+-- que substituiu o SELECT de existência feito por produto
+
+-- Antes de aplicar, confira se não há duplicados (o índice falha se houver):
+--   SELECT tiny_id, COUNT(*) FROM produtos_site GROUP BY tiny_id HAVING COUNT(*) > 1;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_produtos_site_tiny_id_unico
+    ON produtos_site(tiny_id);
@@ -0,0 +1,9 @@
+-- Hash do conteúdo sincronizado do Tiny em produtos_site
+-- A sincronização grava md5 das colunas vindas do Tiny e o upsert só
+-- reescreve a linha quando o hash muda:
+--   ON CONFLICT (tiny_id) DO UPDATE SET ...
+--   WHERE produtos_site.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+-- Produtos inalterados não geram UPDATE (nem WAL) e mantêm updated_at.
+-- Linhas antigas ficam com NULL e são regravadas na próxima sincronização.
+
+ALTER TABLE produtos_site ADD COLUMN IF NOT EXISTS content_hash TEXT;
@@ -0,0 +1,13 @@
+-- Cache dos detalhes de produto do Tiny (produto.obter.php) entre sincronizações
+-- Usado por scripts/sync_produtos_completo.py --cache-detalhes: se o item da
+-- listagem (produtos.pesquisa.php) não mudou desde a última execução
+-- (mesma assinatura), os detalhes vêm daqui e só o estoque é consultado no Tiny.
+-- A listagem da API v2 não traz data de alteração; a assinatura é um md5 do item.
+-- Para forçar nova busca de tudo: TRUNCATE produtos_tiny_cache;
+
+CREATE TABLE IF NOT EXISTS produtos_tiny_cache (
+    tiny_id TEXT PRIMARY KEY,
+    assinatura TEXT NOT NULL,
+    payload JSONB NOT NULL,
+    atualizado_em TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
@@ -0,0 +1,44 @@
+-- Busca de produtos sem acento com índices trigram (pg_trgm)
+-- As buscas usam LIKE '%termo%' sobre unaccent(lower(coluna)), o que
+-- nenhum índice B-tree atende (seq scan em todo o catálogo). Os índices
+-- GIN gin_trgm_ops aceitam LIKE/ILIKE com curinga dos dois lados.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
+-- unaccent() é STABLE (depende do dicionário/search_path) e não pode ir em
+-- índice. Wrapper IMMUTABLE com dicionário fixo; o search_path inclui
+-- "extensions", onde o Supabase instala as extensões ativadas pelo painel.
+CREATE OR REPLACE FUNCTION f_unaccent(text)
+    RETURNS text
+    LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE
+    SET search_path = public, extensions
+AS $$
+    SELECT unaccent('unaccent'::regdictionary, $1)
+$$;
+
+-- tags::text (array ou jsonb) também não é imutável; o texto gerado só
+-- depende do valor, então a conversão pode ser declarada IMMUTABLE
+CREATE OR REPLACE FUNCTION f_tags_texto(anyelement)
+    RETURNS text
+    LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE
+AS $$
+    SELECT $1::text
+$$;
+
+-- Um índice por coluna buscada: o OR da busca vira BitmapOr dos quatro
+CREATE INDEX IF NOT EXISTS idx_produtos_site_nome_trgm
+    ON produtos_site USING GIN (f_unaccent(lower(nome)) gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_produtos_site_categoria_trgm
+    ON produtos_site USING GIN (f_unaccent(lower(categoria)) gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_produtos_site_descricao_trgm
+    ON produtos_site USING GIN (f_unaccent(lower(descricao)) gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_produtos_site_tags_trgm
+    ON produtos_site USING GIN (f_unaccent(lower(f_tags_texto(tags))) gin_trgm_ops);
+
+-- Consultas atendidas (mesma expressão do índice):
+--   SELECT nome FROM produtos_site
+--   WHERE f_unaccent(lower(nome)) LIKE f_unaccent(lower('%cafe%'));
@@ -0,0 +1,27 @@
+-- Índice de cobertura para as listagens do catálogo em produtos_site
+-- Listagens sem termo de busca filtram por disponibilidade e ordenam por nome:
+--   SELECT ... FROM produtos_site
+--   WHERE ativo = TRUE AND estoque_disponivel = TRUE
+--   ORDER BY nome LIMIT %s
+-- Com (ativo, estoque_disponivel, nome) o LIMIT lê só as primeiras entradas
+-- do índice, já ordenadas, sem sort. INCLUDE (categoria) permite Index Only
+-- Scan nas consultas que projetam só nome/categoria (listar_categorias,
+-- contar_por_categoria, scripts de diagnóstico). Busca por termo continua
+-- nos índices trigram da migração 007.
+--
+-- CONCURRENTLY não bloqueia escritas (a sincronização com o Tiny pode estar
+-- rodando), mas não roda dentro de transação: execute este arquivo fora de
+-- BEGIN/COMMIT (psql sem --single-transaction; no SQL Editor do Supabase,
+-- sozinho). Se falhar no meio, o índice fica INVALID: DROP INDEX e rode de novo.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_produtos_site_ativo_estoque_nome
+    ON produtos_site (ativo, estoque_disponivel, nome)
+    INCLUDE (categoria);
+
+-- Atualiza estatísticas e o visibility map (Index Only Scan depende dele)
+VACUUM ANALYZE produtos_site;
+
+-- Verificação:
+--   EXPLAIN SELECT nome, categoria FROM produtos_site
+--   WHERE ativo = TRUE AND estoque_disponivel = TRUE ORDER BY nome LIMIT 50;
+--   -> Index Only Scan using idx_produtos_site_ativo_estoque_nome
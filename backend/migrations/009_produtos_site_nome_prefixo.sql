@@ -0,0 +1,22 @@
+-- Índice B-tree para busca por prefixo do nome em produtos_site
+-- Complementa os índices trigram da migração 007 (requer f_unaccent dela):
+--   - substring ('%cafe%')  -> GIN gin_trgm_ops (007)
+--   - prefixo   ('cafe%')   -> este índice, com range scan e já ordenado
+-- text_pattern_ops compara byte a byte, então LIKE 'prefixo%' vira
+-- >= 'prefixo' AND < 'prefixp' independentemente da collation do banco.
+-- O padrão precisa ser constante na consulta (psycopg2 interpola os
+-- parâmetros no cliente, então f_unaccent(lower('cafe%')) é dobrado pelo
+-- planejador) e a expressão do lado esquerdo idêntica à do índice.
+--
+-- Rode fora de transação (CONCURRENTLY), como a migração 008.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_produtos_site_nome_prefixo
+    ON produtos_site (f_unaccent(lower(nome)) text_pattern_ops);
+
+ANALYZE produtos_site;
+
+-- Consulta atendida (autocomplete / "nome começa com"):
+--   EXPLAIN SELECT nome FROM produtos_site
+--   WHERE f_unaccent(lower(nome)) LIKE f_unaccent(lower('cafe%'))
+--   ORDER BY f_unaccent(lower(nome)) LIMIT 10;
+--   -> Index Scan using idx_produtos_site_nome_prefixo
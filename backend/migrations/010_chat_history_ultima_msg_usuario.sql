@@ -0,0 +1,31 @@
+-- Índice parcial para a última mensagem do usuário em chat_history
+-- get_last_message_time (detecção de nova conversa) consulta:
+--   SELECT created_at FROM chat_history
+--   WHERE telefone = %s AND role = 'user'
+--   ORDER BY created_at DESC LIMIT 1
+-- Em idx_chat_history_phone_time (telefone, created_at DESC) o Postgres
+-- percorre as respostas do assistant/tools até achar a primeira 'user'.
+-- O índice parcial só tem mensagens do usuário: a consulta vira uma única
+-- leitura de índice (Index Only Scan, created_at já está na chave).
+--
+-- load_history continua em idx_chat_history_phone_time. De propósito não há
+-- INCLUDE (content, tool_calls): entradas de B-tree têm limite de ~2,7 kB e
+-- resultados grandes de tools fariam o INSERT falhar; o LIMIT 30 já restringe
+-- a leitura da tabela a 30 tuplas.
+--
+-- CONCURRENTLY não bloqueia escritas, mas não roda dentro de transação nem
+-- em tabela particionada (migrate_chat_history.py --particionado): nesse caso
+-- remova CONCURRENTLY. Se falhar no meio, o índice fica INVALID: DROP INDEX e
+-- rode de novo.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_chat_history_phone_time_user
+    ON chat_history (telefone, created_at DESC)
+    WHERE role = 'user';
+
+ANALYZE chat_history;
+
+-- Verificação:
+--   EXPLAIN SELECT created_at FROM chat_history
+--   WHERE telefone = '5531999999999' AND role = 'user'
+--   ORDER BY created_at DESC LIMIT 1;
+--   -> Index Only Scan using idx_chat_history_phone_time_user
@@ -0,0 +1,256 @@
+"""
+Utilitários de banco compartilhados pelos scripts
+"""
+import io
+import json
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+from psycopg2.extras import Json, execute_values
+
+# Reexportados: a mesma configuração de conexão dos serviços da aplicação
+from src.utils.db import (  # noqa: F401
+    DROP_QS_KEYS, PORTA_POOLER_TRANSACAO, sanitize_pg_dsn, usa_pooler_transacao
+)
+
+
+def bulk_insert(
+    conn,
+    table: str,
+    cols: Sequence[str],
+    rows: Iterable[Sequence],
+    on_conflict: str = "ON CONFLICT DO NOTHING",
+    page_size: int = 1000
+) -> None:
+    """
+    Insere várias linhas com INSERT multi-VALUES (execute_values),
+    em vez de um INSERT por linha.
+
+    `table`, `cols` e `on_conflict` são interpolados no SQL: use apenas
+    valores fixos do próprio script, nunca dados externos.
+    """
+    query = (
+        f"INSERT INTO {table} ({', '.join(cols)}) VALUES %s {on_conflict}"
+    )
+    with conn.cursor() as cursor:
+        execute_values(cursor, query, rows, page_size=page_size)
+
+
+def _copy_text(valor) -> str:
+    """Formata um valor para o formato texto do COPY (NULL = \\N)"""
+    if valor is None:
+        return "\\N"
+    if isinstance(valor, bool):
+        return "t" if valor else "f"
+    if isinstance(valor, (list, dict)):
+        valor = json.dumps(valor, ensure_ascii=False)
+    return (
+        str(valor)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def copy_upsert(
+    conn,
+    table: str,
+    cols: Sequence[str],
+    rows: Iterable[Sequence],
+    conflict_col: str,
+    insert_extras: Optional[Dict[str, str]] = None,
+    update_extras: Optional[Dict[str, str]] = None,
+    hash_col: Optional[str] = None
+) -> Tuple[int, int]:
+    """
+    Upsert em massa: COPY das linhas para uma tabela temporária e um único
+    INSERT ... SELECT ... ON CONFLICT para mesclar na tabela final.
+
+    Substitui o SELECT + INSERT/UPDATE por linha (N round-trips) por
+    três comandos. Exige índice único em `conflict_col`. Não faz commit.
+
+    Args:
+        conn: Conexão psycopg2 (dentro de uma transação)
+        table: Tabela de destino
+        cols: Colunas na mesma ordem das tuplas de `rows`
+        rows: Linhas (listas/dicts viram JSON)
+        conflict_col: Coluna da chave única (ex: tiny_id)
+        insert_extras: Colunas extras só no INSERT, coluna -> expressão SQL
+        update_extras: Colunas extras só no UPDATE, coluna -> expressão SQL
+        hash_col: Coluna com hash do conteúdo; se informada, linhas com o
+            mesmo hash não são reescritas (nem contadas como atualizadas)
+
+    Returns:
+        Tupla (novos, atualizados)
+    """
+    insert_extras = insert_extras or {}
+    update_extras = update_extras or {}
+    stage = f"{table}_stage"
+    lista_cols = ", ".join(cols)
+
+    buf = io.StringIO()
+    for row in rows:
+        buf.write("\t".join(_copy_text(v) for v in row))
+        buf.write("\n")
+    buf.seek(0)
+
+    insert_cols = list(cols) + list(insert_extras)
+    select_exprs = list(cols) + list(insert_extras.values())
+
+    with conn.cursor() as cursor:
+        # Stage só com as colunas gravadas (sem constraints da tabela final)
+        cursor.execute(
+            f"DROP TABLE IF EXISTS {stage}; "
+            f"CREATE TEMP TABLE {stage} ON COMMIT DROP AS "
+            f"SELECT {lista_cols} FROM {table} WITH NO DATA"
+        )
+        cursor.copy_expert(f"COPY {stage} ({lista_cols}) FROM STDIN", buf)
+
+        # DISTINCT ON: um mesmo produto repetido no lote não pode ser
+        # atualizado duas vezes no mesmo comando
+        cursor.execute(f"""
+            INSERT INTO {table} ({', '.join(insert_cols)})
+            SELECT DISTINCT ON ({conflict_col}) {', '.join(select_exprs)}
+            FROM {stage}
+            {_on_conflict_update(table, cols, conflict_col, update_extras, hash_col)}
+            RETURNING (xmax = 0) AS inserido
+        """)
+        resultado = cursor.fetchall()
+
+    novos = sum(1 for (inserido,) in resultado if inserido)
+    return novos, len(resultado) - novos
+
+
+def values_upsert(
+    conn,
+    table: str,
+    cols: Sequence[str],
+    rows: Iterable[Sequence],
+    conflict_col: str,
+    insert_extras: Optional[Dict[str, str]] = None,
+    update_extras: Optional[Dict[str, str]] = None,
+    hash_col: Optional[str] = None,
+    page_size: int = 500
+) -> Tuple[int, int]:
+    """
+    Mesmo upsert de copy_upsert, via INSERT multi-VALUES (execute_values).
+
+    Alternativa para quando COPY não é desejável (ex: triggers por linha,
+    pooler sem suporte a COPY). Mesmos argumentos e retorno de
+    copy_upsert; não faz commit.
+    """
+    insert_extras = insert_extras or {}
+    update_extras = update_extras or {}
+
+    # Um mesmo produto repetido na página não pode ser atualizado
+    # duas vezes no mesmo comando: mantém a última ocorrência
+    idx = list(cols).index(conflict_col)
+    unicos = list({row[idx]: row for row in rows}.values())
+
+    insert_cols = list(cols) + list(insert_extras)
+    template = "(" + ", ".join(["%s"] * len(cols) + list(insert_extras.values())) + ")"
+    query = f"""
+        INSERT INTO {table} ({', '.join(insert_cols)}) VALUES %s
+        {_on_conflict_update(table, cols, conflict_col, update_extras, hash_col)}
+        RETURNING (xmax = 0) AS inserido
+    """
+
+    linhas = [
+        tuple(Json(v) if isinstance(v, (list, dict)) else v for v in row)
+        for row in unicos
+    ]
+
+    with conn.cursor() as cursor:
+        resultado = execute_values(
+            cursor, query, linhas, template=template, page_size=page_size, fetch=True
+        )
+
+    novos = sum(1 for (inserido,) in resultado if inserido)
+    return novos, len(resultado) - novos
+
+
+def _on_conflict_update(
+    table: str,
+    cols: Sequence[str],
+    conflict_col: str,
+    update_extras: Dict[str, str],
+    hash_col: Optional[str] = None
+) -> str:
+    """
+    Monta ON CONFLICT ... DO UPDATE SET com todas as colunas exceto a chave
+
+    Com `hash_col`, o UPDATE só acontece se o hash mudou: linhas idênticas
+    não geram nova versão da tupla (nem WAL) e não aparecem no RETURNING.
+    """
+    sets = [f"{c} = EXCLUDED.{c}" for c in cols if c != conflict_col]
+    sets += [f"{c} = {expr}" for c, expr in update_extras.items()]
+    sql = f"ON CONFLICT ({conflict_col}) DO UPDATE SET {', '.join(sets)}"
+    if hash_col:
+        sql += f" WHERE {table}.{hash_col} IS DISTINCT FROM EXCLUDED.{hash_col}"
+    return sql
+
+
+class UpsertPreparado:
+    """
+    Upsert linha a linha com prepared statement no servidor (PREPARE uma
+    vez, EXECUTE por linha): o SQL é analisado e planejado uma única vez.
+
+    Prepared statements não são transacionais, então sobrevivem aos
+    commit/rollback de cada linha. Não use atrás do pooler em modo
+    transação (veja usa_pooler_transacao).
+
+    Uso:
+        with UpsertPreparado(conn, "produtos_site", COLUNAS, "tiny_id") as up:
+            for linha in linhas:
+                inserido = up.executar(linha)
+    """
+
+    def __init__(
+        self,
+        conn,
+        table: str,
+        cols: Sequence[str],
+        conflict_col: str,
+        insert_extras: Optional[Dict[str, str]] = None,
+        update_extras: Optional[Dict[str, str]] = None,
+        hash_col: Optional[str] = None,
+        nome: str = "upsert_linha"
+    ):
+        insert_extras = insert_extras or {}
+        self.conn = conn
+        self.nome = nome
+
+        insert_cols = list(cols) + list(insert_extras)
+        valores = [f"${i}" for i in range(1, len(cols) + 1)] + list(insert_extras.values())
+        self._prepare = f"""
+            PREPARE {nome} AS
+            INSERT INTO {table} ({', '.join(insert_cols)}) VALUES ({', '.join(valores)})
+            {_on_conflict_update(table, cols, conflict_col, update_extras or {}, hash_col)}
+            RETURNING (xmax = 0) AS inserido
+        """
+        self._execute = f"EXECUTE {nome} ({', '.join(['%s'] * len(cols))})"
+
+    def __enter__(self) -> "UpsertPreparado":
+        with self.conn.cursor() as cursor:
+            cursor.execute(self._prepare)
+        return self
+
+    def executar(self, linha: Sequence) -> Optional[bool]:
+        """
+        Grava uma linha (sem commit)
+
+        Returns:
+            True se inserida, False se atualizada, None se inalterada (hash_col)
+        """
+        valores = tuple(Json(v) if isinstance(v, (list, dict)) else v for v in linha)
+        with self.conn.cursor() as cursor:
+            cursor.execute(self._execute, valores)
+            resultado = cursor.fetchone()
+        return resultado[0] if resultado else None
+
+    def __exit__(self, *exc) -> None:
+        # Sai da transação abortada (se houver) antes de liberar o statement
+        self.conn.rollback()
+        with self.conn.cursor() as cursor:
+            cursor.execute(f"DEALLOCATE {self.nome}")
+        self.conn.commit()
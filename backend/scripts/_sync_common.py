@@ -0,0 +1,350 @@
+"""
+Código compartilhado pelos scripts de sincronização Tiny → Supabase
+(sync_produtos_tiny.py e sync_produtos_completo.py)
+"""
+import asyncio
+import hashlib
+import os
+from collections import Counter
+from contextlib import closing
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+import psycopg2
+from loguru import logger
+
+from scripts._pg_utils import (
+    UpsertPreparado, copy_upsert, sanitize_pg_dsn, usa_pooler_transacao,
+    values_upsert
+)
+
+# Colunas gravadas em produtos_site (mesma ordem de linha_produto)
+COLUNAS = (
+    "tiny_id", "nome", "descricao", "observacoes",
+    "preco", "preco_promocional", "peso", "unidade",
+    "imagem_url", "imagens_adicionais", "link_produto", "categoria",
+    "estoque_disponivel", "quantidade_estoque", "ativo", "content_hash",
+)
+
+# Colunas preenchidas pelo banco: só no INSERT / só no UPDATE
+INSERT_EXTRAS = {
+    "destaque": "FALSE",
+    "sincronizado_em": "NOW()",
+    "created_at": "NOW()",
+    "updated_at": "NOW()",
+}
+UPDATE_EXTRAS = {
+    "sincronizado_em": "NOW()",
+    "updated_at": "NOW()",
+}
+
+# Marca o fim da fila produtor → consumidor
+_FIM = object()
+
+
+def linha_produto(produto: dict) -> tuple:
+    """
+    Converte produto normalizado do Tiny em linha de produtos_site
+
+    Chamada lote a lote (na thread de gravação), então só o lote atual
+    fica em memória como tuplas.
+    """
+    get = produto.get
+    imagens = get("imagens") or None  # lista vazia vira NULL
+    estoque = produto["estoque"]
+
+    linha = (
+        str(produto["tiny_id"]),  # tiny_id é TEXT
+        produto["nome"],
+        produto["descricao"],
+        get("observacoes") or "",
+        produto["preco"],
+        produto["preco_promocional"],
+        str(get("peso_bruto") or get("peso_liquido") or 0),  # peso é TEXT
+        get("unidade", "UN"),
+        imagens[0] if isinstance(imagens, list) else None,  # primeira imagem
+        imagens,
+        get("url_produto") or get("link_produto", ""),
+        produto["categoria"],
+        estoque > 0,
+        int(estoque),
+        produto["ativo"],
+    )
+
+    # Hash do conteúdo: produto inalterado no Tiny não é reescrito no banco
+    return linha + (hashlib.md5(repr(linha).encode()).hexdigest(),)
+
+
+def get_db_connection():
+    """
+    Cria conexão com Supabase (PostgreSQL) para gravação em massa
+
+    Prefere DIRECT_URL (conexão direta / pooler em modo sessão): o pooler
+    em modo transação (DATABASE_URL, porta 6543) não aceita COPY nem
+    prepared statements. Nesse caso a gravação cai para execute_values
+    (veja sincronizar_produtos_site).
+    """
+    database_url = os.getenv("DIRECT_URL") or os.getenv("DATABASE_URL")
+
+    if not database_url:
+        raise ValueError("DATABASE_URL ou DIRECT_URL não configurado")
+
+    # Sanitizar URL removendo parâmetros incompatíveis
+    database_url = sanitize_pg_dsn(database_url)
+
+    # Supabase geralmente requer SSL
+    conn = psycopg2.connect(database_url, sslmode="require")
+
+    if usa_pooler_transacao(conn):
+        logger.warning(
+            "⚠️ Conectado ao pooler em modo transação (porta 6543): "
+            "sem COPY/PREPARE, gravando via execute_values. Configure DIRECT_URL."
+        )
+    else:
+        logger.info(f"🔌 Conexão de sessão (porta {conn.get_dsn_parameters().get('port')})")
+
+    return conn
+
+
+def carregar_cache_detalhes() -> Dict[str, Tuple[str, Dict]]:
+    """
+    Lê o cache de detalhes do Tiny (produtos_tiny_cache)
+
+    Returns:
+        {tiny_id: (assinatura, detalhes)} para TinyProductsClient.iter_produtos
+    """
+    with closing(get_db_connection()) as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT tiny_id, assinatura, payload FROM produtos_tiny_cache")
+        return {tiny_id: (assinatura, payload) for tiny_id, assinatura, payload in cursor}
+
+
+def salvar_cache_detalhes(
+    cache: Dict[str, Tuple[str, Dict]],
+    assinaturas_anteriores: Dict[str, str]
+) -> int:
+    """
+    Grava no cache só as entradas novas ou alteradas nesta execução
+
+    Returns:
+        Quantidade de entradas gravadas
+    """
+    linhas = [
+        (tiny_id, assinatura, payload)
+        for tiny_id, (assinatura, payload) in cache.items()
+        if assinaturas_anteriores.get(tiny_id) != assinatura
+    ]
+    if not linhas:
+        return 0
+
+    with closing(get_db_connection()) as conn:
+        with conn:
+            values_upsert(
+                conn, "produtos_tiny_cache", ("tiny_id", "assinatura", "payload"),
+                linhas, "tiny_id", update_extras={"atualizado_em": "NOW()"}
+            )
+    return len(linhas)
+
+
+async def sincronizar_produtos_site(
+    produtos: AsyncIterator[Dict],
+    batch_size: int = 100,
+    upsert: Callable = copy_upsert,
+    dry_run: bool = False
+) -> Counter:
+    """
+    Grava em produtos_site os produtos vindos do Tiny, em lotes
+
+    Args:
+        produtos: Iterador assíncrono (TinyProductsClient.iter_produtos)
+        batch_size: Produtos por lote/transação
+        upsert: copy_upsert ou values_upsert (scripts._pg_utils); COPY vira
+            values_upsert se a conexão for do pooler em modo transação
+        dry_run: Se True, não conecta nem grava no banco
+
+    Returns:
+        Contadores: total, novos, atualizados, inalterados, pulados, erros
+    """
+    def gravar_lote(conn, lote):
+        """Grava um lote em uma transação (roda em thread)"""
+        # Preparar linhas (erro em um produto não derruba o lote)
+        linhas = []
+        erros = 0
+        for produto in lote:
+            try:
+                linhas.append(linha_produto(produto))
+            except Exception as e:
+                logger.error(f"❌ Erro ao processar {produto.get('nome')}: {e}")
+                erros += 1
+
+        if dry_run:
+            for produto in lote:
+                logger.debug(f"🧪 [DRY-RUN] {produto['nome']} (ID: {produto['tiny_id']})")
+            return {"pulados": len(linhas), "erros": erros}
+
+        # Pooler em modo transação não suporta COPY
+        metodo = upsert
+        if upsert is copy_upsert and usa_pooler_transacao(conn):
+            metodo = values_upsert
+
+        # Um commit por lote; se o lote falhar, regrava linha a linha
+        totais = upsert_lote(
+            conn, metodo, linhas,
+            table="produtos_site", cols=COLUNAS, conflict_col="tiny_id",
+            insert_extras=INSERT_EXTRAS, update_extras=UPDATE_EXTRAS,
+            hash_col="content_hash"
+        )
+        totais["erros"] = totais.get("erros", 0) + erros
+        return totais
+
+    # Conexão aberta numa thread, em paralelo com a primeira busca no Tiny
+    return await sincronizar_em_lotes(
+        produtos, gravar_lote, batch_size=batch_size,
+        conectar=None if dry_run else get_db_connection
+    )
+
+
+async def sincronizar_em_lotes(
+    produtos: AsyncIterator[Dict],
+    gravar_lote: Callable[[Any, List[Dict]], Dict[str, int]],
+    batch_size: int = 100,
+    max_fila: int = 1000,
+    conectar: Optional[Callable[[], Any]] = None
+) -> Counter:
+    """
+    Pipeline produtor/consumidor: grava no banco enquanto o Tiny ainda
+    está sendo consultado, em vez de buscar tudo e só então gravar.
+
+    O produtor coloca cada produto numa asyncio.Queue; o consumidor junta
+    lotes de `batch_size` e chama `gravar_lote` (psycopg2, síncrono) numa
+    thread, sem travar o event loop das chamadas HTTP.
+
+    A conexão também é aberta (e fechada) numa thread: o handshake TLS com
+    o Supabase acontece enquanto a primeira página do Tiny é buscada.
+
+    Args:
+        produtos: Iterador assíncrono de produtos normalizados
+        gravar_lote: Função síncrona gravar_lote(conn, lote) que grava um
+            lote e retorna contadores (ex: {"novos": 3, "atualizados": 7})
+        batch_size: Produtos por lote
+        max_fila: Tamanho máximo da fila (limita a memória)
+        conectar: Função que abre a conexão (None = sem banco, ex: dry-run)
+
+    Returns:
+        Soma dos contadores retornados por `gravar_lote`, mais "total"
+    """
+    fila: asyncio.Queue = asyncio.Queue(maxsize=max_fila)
+    loop = asyncio.get_running_loop()
+    totais: Counter = Counter()
+    conexao = loop.run_in_executor(None, conectar) if conectar else None
+
+    async def produtor():
+        try:
+            async for produto in produtos:
+                await fila.put(produto)
+        finally:
+            await fila.put(_FIM)
+
+    async def gravar(lote: List[Dict]):
+        conn = await conexao if conexao else None
+        logger.info(f"💾 Gravando lote de {len(lote)} produtos...")
+        totais.update(await loop.run_in_executor(None, gravar_lote, conn, lote))
+        totais["total"] += len(lote)
+
+    async def consumidor():
+        lote: List[Dict] = []
+        while True:
+            produto = await fila.get()
+            if produto is _FIM:
+                break
+            lote.append(produto)
+            if len(lote) >= batch_size:
+                await gravar(lote)
+                lote = []
+        if lote:
+            await gravar(lote)
+
+    tarefa_produtor = asyncio.create_task(produtor())
+    try:
+        await consumidor()
+    finally:
+        # Se o consumidor falhar, o produtor não pode ficar preso na fila cheia
+        if not tarefa_produtor.done():
+            tarefa_produtor.cancel()
+        if conexao:
+            await _fechar(loop, conexao)
+
+    await tarefa_produtor
+    return totais
+
+
+def upsert_lote(conn, upsert: Callable, linhas: List[tuple], **kwargs) -> Dict[str, int]:
+    """
+    Grava um lote numa única transação (um commit por lote, não por linha).
+
+    Se o lote falhar, desfaz a transação e regrava linha a linha, para que
+    um produto inválido não descarte os outros do mesmo lote (com prepared
+    statement, exceto atrás do pooler em modo transação).
+
+    Args:
+        conn: Conexão psycopg2
+        upsert: copy_upsert ou values_upsert (scripts._pg_utils)
+        linhas: Linhas já convertidas para a tabela
+        **kwargs: Repassados para `upsert` (table, cols, conflict_col, ...)
+
+    Returns:
+        Contadores {"novos", "atualizados", "inalterados", "erros"}
+        (inalterados: linhas puladas pelo hash_col, se informado)
+    """
+    try:
+        novos, atualizados = upsert(conn, rows=linhas, **kwargs)
+        conn.commit()
+        return {
+            "novos": novos,
+            "atualizados": atualizados,
+            "inalterados": len(linhas) - novos - atualizados,
+        }
+    except Exception as e:
+        conn.rollback()
+        logger.warning(f"⚠️ Lote falhou ({e}); regravando {len(linhas)} linhas uma a uma")
+
+    totais: Counter = Counter()
+
+    # Com conexão direta, o SQL da regravação é preparado uma única vez
+    if not usa_pooler_transacao(conn):
+        with UpsertPreparado(conn, **kwargs) as preparado:
+            for linha in linhas:
+                try:
+                    inserido = preparado.executar(linha)
+                    conn.commit()
+                    if inserido is None:
+                        totais["inalterados"] += 1
+                    else:
+                        totais["novos" if inserido else "atualizados"] += 1
+                except Exception as e:
+                    conn.rollback()
+                    logger.error(f"❌ Erro ao gravar {linha[0]}: {e}")
+                    totais["erros"] += 1
+        return totais
+
+    for linha in linhas:
+        try:
+            novos, atualizados = upsert(conn, rows=[linha], **kwargs)
+            conn.commit()
+            totais.update(
+                novos=novos, atualizados=atualizados,
+                inalterados=1 - novos - atualizados
+            )
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"❌ Erro ao gravar {linha[0]}: {e}")
+            totais["erros"] += 1
+    return totais
+
+
+async def _fechar(loop: asyncio.AbstractEventLoop, conexao: asyncio.Future):
+    """Fecha a conexão (se chegou a abrir) sem bloquear o event loop"""
+    try:
+        conn = await conexao
+    except Exception as e:
+        logger.error(f"❌ Erro ao conectar no banco: {e}")
+        raise
+    await loop.run_in_executor(None, conn.close)
@@ -0,0 +1,55 @@
+"""
+Cache em disco para respostas da API Tiny nos scripts de debug
+
+Evita gastar a cota da API (e segundos de espera) a cada execução
+durante a investigação de um problema. Para forçar nova consulta,
+apague o diretório .tiny_cache ou defina TINY_DEBUG_CACHE=0.
+"""
+import os
+import json
+import hashlib
+from functools import wraps
+from pathlib import Path
+
+CACHE_DIR = Path(__file__).parent.parent / ".tiny_cache"
+
+
+def disk_cache(fn):
+    """
+    Decora um método assíncrono do cliente Tiny, salvando a resposta
+    em JSON chaveada por (método, argumentos).
+
+    O argumento `client` (httpx) é ignorado na chave. Respostas vazias
+    não são gravadas para não mascarar falhas da API.
+    """
+    if os.getenv("TINY_DEBUG_CACHE", "1") == "0":
+        return fn
+
+    @wraps(fn)
+    async def wrap(*args, **kwargs):
+        kwargs_chave = {k: v for k, v in kwargs.items() if k != "client"}
+        chave = hashlib.sha1(
+            repr((fn.__name__, args, sorted(kwargs_chave.items()))).encode()
+        ).hexdigest()
+        arquivo = CACHE_DIR / f"{chave}.json"
+
+        if arquivo.exists():
+            return json.loads(arquivo.read_text(encoding="utf-8"))
+
+        resultado = await fn(*args, **kwargs)
+        if resultado:
+            CACHE_DIR.mkdir(exist_ok=True)
+            arquivo.write_text(
+                json.dumps(resultado, ensure_ascii=False),
+                encoding="utf-8"
+            )
+        return resultado
+
+    return wrap
+
+
+def aplicar_cache(client):
+    """Aplica o cache em disco aos métodos de leitura do cliente Tiny"""
+    client.listar_produtos = disk_cache(client.listar_produtos)
+    client.obter_produto = disk_cache(client.obter_produto)
+    return client
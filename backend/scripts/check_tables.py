@@ -3,22 +3,15 @@
 Script para verificar quais tabelas existem no Supabase
 """
 import os
+import sys
 import psycopg2
-from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
+from contextlib import closing
+from pathlib import Path
 
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT_DIR))
 
-DROP_QS_KEYS = {"pgbouncer", "connection_limit"}
-
-
-def sanitize_pg_dsn(database_url: str) -> str:
-    """Remove parâmetros incompatíveis com psycopg2"""
-    u = urlparse(database_url)
-    qs = dict(parse_qsl(u.query, keep_blank_values=True))
-    for k in list(qs.keys()):
-        if k in DROP_QS_KEYS:
-            qs.pop(k, None)
-    new_query = urlencode(qs, doseq=True)
-    return urlunparse((u.scheme, u.netloc, u.path, u.params, new_query, u.fragment))
+from scripts._pg_utils import sanitize_pg_dsn
 
 
 def main():
@@ -32,62 +25,73 @@ def main():
     database_url = sanitize_pg_dsn(database_url)
 
     try:
-        # Conectar
-        conn = psycopg2.connect(database_url, sslmode="require")
-        cursor = conn.cursor()
-
-        # Listar tabelas
-        cursor.execute("""
-            SELECT table_schema, table_name,
-                   (SELECT COUNT(*) FROM information_schema.columns c
-                    WHERE c.table_schema = t.table_schema
-                    AND c.table_name = t.table_name) as num_colunas
-            FROM information_schema.tables t
-            WHERE table_type = 'BASE TABLE'
-            AND table_schema NOT IN ('pg_catalog', 'information_schema')
-            ORDER BY table_schema, table_name
-        """)
-
-        tables = cursor.fetchall()
-
-        print("=" * 70)
-        print("📊 TABELAS NO SUPABASE")
-        print("=" * 70)
-
-        if not tables:
-            print("⚠️ Nenhuma tabela encontrada!")
-        else:
-            for schema, table, num_cols in tables:
-                print(f"  {schema}.{table:<30} ({num_cols} colunas)")
-
-        print("=" * 70)
-        print(f"Total: {len(tables)} tabelas")
-        print("=" * 70)
-
-        # Verificar especificamente a tabela produtos_site
-        cursor.execute("""
-            SELECT column_name, data_type, is_nullable
-            FROM information_schema.columns
-            WHERE table_schema = 'public'
-            AND table_name = 'produtos_site'
-            ORDER BY ordinal_position
-        """)
-
-        produtos_cols = cursor.fetchall()
-
-        if produtos_cols:
-            print("\n✅ Tabela 'produtos_site' existe!")
+        # Conectar (conexão fechada mesmo em caso de erro). Os cursores
+        # nomeados (server-side) fazem streaming das linhas conforme são
+        # impressas, sem materializar o resultado inteiro no cliente.
+        with closing(psycopg2.connect(database_url, sslmode="require")) as conn:
+            print("=" * 70)
+            print("📊 TABELAS NO SUPABASE")
+            print("=" * 70)
+
+            # Listar tabelas. O número de colunas vem direto de
+            # pg_class.relnatts (aproximado: inclui colunas já removidas),
+            # sem recalcular nada nas views do information_schema.
+            total_tabelas = 0
+            with conn.cursor(name="tbl_stream") as cursor:
+                cursor.itersize = 100
+                cursor.execute("""
+                    SELECT n.nspname, c.relname, c.relnatts
+                    FROM pg_class c
+                    JOIN pg_namespace n ON n.oid = c.relnamespace
+                    WHERE c.relkind IN ('r', 'p')
+                    AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+                    AND n.nspname NOT LIKE 'pg_toast%'
+                    ORDER BY 1, 2
+                """)
+
+                for schema, table, num_cols in cursor:
+                    print(f"  {schema}.{table:<30} ({num_cols} colunas)")
+                    total_tabelas += 1
+
+            if not total_tabelas:
+                print("⚠️ Nenhuma tabela encontrada!")
+
             print("=" * 70)
-            print("Colunas:")
-            for col_name, data_type, nullable in produtos_cols:
-                null_str = "NULL" if nullable == "YES" else "NOT NULL"
-                print(f"  - {col_name:<30} {data_type:<20} {null_str}")
+            print(f"Total: {total_tabelas} tabelas")
             print("=" * 70)
-        else:
-            print("\n❌ Tabela 'produtos_site' NÃO existe no schema 'public'")
 
-        cursor.close()
-        conn.close()
+            # Verificar especificamente a tabela produtos_site
+            total_colunas = 0
+            with conn.cursor(name="cols_stream") as cursor:
+                cursor.itersize = 100
+                # pg_attribute direto: a view information_schema.columns
+                # calcula privilégios, defaults etc. que não são usados aqui
+                cursor.execute("""
+                    SELECT a.attname, t.typname, NOT a.attnotnull
+                    FROM pg_attribute a
+                    JOIN pg_class c ON c.oid = a.attrelid
+                    JOIN pg_namespace n ON n.oid = c.relnamespace
+                    JOIN pg_type t ON t.oid = a.atttypid
+                    WHERE n.nspname = 'public'
+                    AND c.relname = 'produtos_site'
+                    AND a.attnum > 0
+                    AND NOT a.attisdropped
+                    ORDER BY a.attnum
+                """)
+
+                for col_name, data_type, nullable in cursor:
+                    if not total_colunas:
+                        print("\n✅ Tabela 'produtos_site' existe!")
+                        print("=" * 70)
+                        print("Colunas:")
+                    null_str = "NULL" if nullable else "NOT NULL"
+                    print(f"  - {col_name:<30} {data_type:<20} {null_str}")
+                    total_colunas += 1
+
+            if total_colunas:
+                print("=" * 70)
+            else:
+                print("\n❌ Tabela 'produtos_site' NÃO existe no schema 'public'")
 
     except Exception as e:
         print(f"❌ Erro: {e}")
@@ -11,6 +11,8 @@ sys.path.insert(0, str(ROOT_DIR))
 
 from dotenv import load_dotenv
 from src.services.tiny_products_client import get_tiny_products_client
+from src.utils.conversao import para_float
+from scripts._tiny_cache import aplicar_cache
 from loguru import logger
 
 load_dotenv()
@@ -20,7 +22,7 @@ async def main():
     print("🔍 DEBUG: ESTOQUE DA API TINY")
     print("="*70)
 
-    client = get_tiny_products_client()
+    client = aplicar_cache(get_tiny_products_client())
 
     # 1. Listar produtos do site
     print("\n1️⃣ Listando produtos com 'site' nas observações...")
@@ -42,14 +44,28 @@ async def main():
     print("📊 ANÁLISE DE ESTOQUE")
     print("="*70)
 
-    for produto in produtos_cafe[:10]:  # Primeiros 10
+    # Buscar detalhes dos primeiros 10 em paralelo (limitado pelo rate limit do Tiny)
+    amostra = produtos_cafe[:10]
+    semaforo = asyncio.Semaphore(5)
+
+    async def obter_detalhes(tiny_id):
+        async with semaforo:
+            return await client.obter_produto(tiny_id)
+
+    print(f"\n📥 Buscando detalhes completos de {len(amostra)} produtos...")
+    detalhes = await asyncio.gather(
+        *(obter_detalhes(p['tiny_id']) for p in amostra),
+        return_exceptions=True
+    )
+
+    for produto, produto_completo in zip(amostra, detalhes):
         print(f"\n🔸 {produto['nome']}")
         print(f"   Tiny ID: {produto['tiny_id']}")
         print(f"   Código: {produto['codigo']}")
 
-        # Obter detalhes completos do produto
-        print(f"\n   📥 Buscando detalhes completos do produto {produto['tiny_id']}...")
-        produto_completo = await client.obter_produto(produto['tiny_id'])
+        if isinstance(produto_completo, Exception):
+            print(f"   ❌ Erro ao obter detalhes do produto: {produto_completo}")
+            continue
 
         if not produto_completo:
             print(f"   ❌ Não foi possível obter detalhes do produto")
@@ -91,11 +107,11 @@ async def main():
             print(f"   ⚠️ ATENÇÃO: Estoque veio como STRING: '{estoque_raw}'")
             if "," in estoque_raw:
                 print(f"   🔴 PROBLEMA: Vírgula detectada! Precisa converter para ponto")
-                try:
-                    estoque_corrigido = float(estoque_raw.replace(",", "."))
+                estoque_corrigido = para_float(estoque_raw, padrao=None)
+                if estoque_corrigido is not None:
                     print(f"   ✅ Estoque corrigido: {estoque_corrigido}")
-                except ValueError as e:
-                    print(f"   ❌ Erro ao converter: {e}")
+                else:
+                    print(f"   ❌ Erro ao converter: '{estoque_raw}'")
 
         print("\n" + "-"*70)
 
@@ -12,14 +12,33 @@ sys.path.insert(0, str(ROOT_DIR))
 from loguru import logger
 from dotenv import load_dotenv
 from src.services.tiny_products_client import get_tiny_products_client
+from scripts._tiny_cache import aplicar_cache
 import json
 
+try:
+    import orjson
+except ImportError:  # orjson é opcional nos scripts de debug
+    orjson = None
+
 load_dotenv()
 
 
+def dump_json(dados) -> None:
+    """Escreve o JSON indentado no stdout (com orjson, monta os bytes de uma vez e grava direto no buffer)"""
+    sys.stdout.flush()
+    if orjson is not None:
+        sys.stdout.buffer.write(
+            orjson.dumps(dados, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+        )
+        sys.stdout.buffer.flush()
+    else:
+        json.dump(dados, sys.stdout, indent=2, ensure_ascii=False)
+    print()
+
+
 async def main():
     """Busca 1 produto e mostra TODOS os campos"""
-    client = get_tiny_products_client()
+    client = aplicar_cache(get_tiny_products_client())
 
     # Buscar lista de produtos
     print("🔍 Buscando lista de produtos...")
@@ -45,14 +64,13 @@ async def main():
     # Mostrar TODOS os campos retornados
     print(f"\n✅ RESPOSTA COMPLETA DA API (produto.obter.php):")
     print("=" * 80)
-    print(json.dumps(produto_completo, indent=2, ensure_ascii=False))
+    dump_json(produto_completo)
     print("=" * 80)
 
     # Listar TODOS os campos disponíveis
     print(f"\n📋 CAMPOS DISPONÍVEIS ({len(produto_completo)} total):")
     print("=" * 80)
-    for key in sorted(produto_completo.keys()):
-        value = produto_completo[key]
+    for key, value in sorted(produto_completo.items()):
         if isinstance(value, str):
             if len(value) > 100:
                 print(f"   {key:<30} = {value[:100]}... (texto longo)")
@@ -94,15 +112,6 @@ async def main():
         print(f"   - Imagens: VAZIO ou não é array")
     print("=" * 80)
 
-    # Listar TODOS os campos disponíveis
-    print(f"\n📋 TODOS OS CAMPOS ({len(produto_completo)} total):")
-    for key in sorted(produto_completo.keys()):
-        value = produto_completo[key]
-        if isinstance(value, str) and len(value) > 50:
-            print(f"   - {key}: {value[:50]}... (truncado)")
-        else:
-            print(f"   - {key}: {value}")
-
 
 if __name__ == "__main__":
     asyncio.run(main())
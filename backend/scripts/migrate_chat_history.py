@@ -2,30 +2,112 @@
 Migração: Cria tabela chat_history para memória conversacional persistente.
 Armazena mensagens em formato OpenAI para replay exato no agente.
 
-Uso: python -m scripts.migrate_chat_history
+Uso: python -m scripts.migrate_chat_history [--particionado] [--meses 3]
+
+Com --particionado a tabela é criada com PARTITION BY RANGE (created_at),
+uma partição por mês (expurgo = DROP da partição antiga). Rode novamente
+com --particionado para criar as partições dos próximos meses; linhas fora
+das partições criadas caem em chat_history_default. Se um mês já tem linhas
+no default, o script as move para a partição nova ao criá-la (o Postgres
+recusa a partição enquanto o default tiver linhas no intervalo dela).
 """
 import os
 import sys
+import argparse
 import psycopg2
-from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
+from contextlib import closing
+from datetime import date
 
 # Adicionar path do projeto
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
 
-DROP_QS_KEYS = {"pgbouncer", "connection_limit"}
+from scripts._pg_utils import sanitize_pg_dsn
 
+# Colunas da tabela. created_at usa clock_timestamp() (e não NOW()) para que
+# várias mensagens gravadas na mesma transação tenham horários distintos e
+# crescentes, preservando a ordem de replay.
+COLUNAS = """
+        id BIGSERIAL,
+        telefone TEXT NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT,
+        tool_calls JSONB,
+        tool_call_id TEXT,
+        name TEXT,
+        media_type TEXT DEFAULT 'text',
+        media_url TEXT,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp()
+"""
 
-def sanitize_pg_dsn(database_url: str) -> str:
-    u = urlparse(database_url)
-    qs = dict(parse_qsl(u.query, keep_blank_values=True))
-    for k in list(qs.keys()):
-        if k in DROP_QS_KEYS:
-            qs.pop(k, None)
-    new_query = urlencode(qs, doseq=True)
-    return urlunparse((u.scheme, u.netloc, u.path, u.params, new_query, u.fragment))
+TABELA_SIMPLES = f"""
+    CREATE TABLE IF NOT EXISTS chat_history (
+        {COLUNAS.strip()},
+        PRIMARY KEY (id)
+    );
+"""
 
+# Particionada por mês: a PK precisa conter a chave de partição
+TABELA_PARTICIONADA = f"""
+    CREATE TABLE IF NOT EXISTS chat_history (
+        {COLUNAS.strip()},
+        PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at);
+
+    CREATE TABLE IF NOT EXISTS chat_history_default
+    PARTITION OF chat_history DEFAULT;
+"""
 
-def run_migration():
+# Índices + ajuste do default em tabelas criadas antes desta versão
+INDICES = """
+    ALTER TABLE chat_history ALTER COLUMN created_at SET DEFAULT clock_timestamp();
+
+    CREATE INDEX IF NOT EXISTS idx_chat_history_phone_time
+    ON chat_history(telefone, created_at DESC);
+
+    -- Parcial: última mensagem do usuário (get_last_message_time)
+    CREATE INDEX IF NOT EXISTS idx_chat_history_phone_time_user
+    ON chat_history(telefone, created_at DESC) WHERE role = 'user';
+
+    -- BRIN: índice minúsculo para expurgos por janela de tempo
+    -- (DELETE ... WHERE created_at < ...), já que a tabela é append-only
+    CREATE INDEX IF NOT EXISTS idx_chat_history_created_brin
+    ON chat_history USING BRIN (created_at);
+"""
+
+
+def ddl_particoes(inicio: date, meses: int) -> str:
+    """
+    Gera as partições mensais a partir do mês de `inicio`.
+
+    Cada partição ainda inexistente é criada num bloco DO: as linhas do mês
+    que já estão em chat_history_default saem dele (tabela temporária) antes
+    do CREATE e voltam pela tabela-mãe depois, caindo na partição nova.
+    """
+    partes = []
+    ano, mes = inicio.year, inicio.month
+    for _ in range(meses):
+        prox_ano, prox_mes = (ano + 1, 1) if mes == 12 else (ano, mes + 1)
+        particao = f"chat_history_{ano}_{mes:02d}"
+        de, ate = f"{ano}-{mes:02d}-01", f"{prox_ano}-{prox_mes:02d}-01"
+        faixa = f"created_at >= '{de}' AND created_at < '{ate}'"
+        partes.append(f"""
+    DO $$
+    BEGIN
+        IF to_regclass('{particao}') IS NULL THEN
+            CREATE TEMP TABLE _chat_history_mover AS
+                SELECT * FROM chat_history_default WHERE {faixa};
+            DELETE FROM chat_history_default WHERE {faixa};
+            CREATE TABLE {particao} PARTITION OF chat_history
+                FOR VALUES FROM ('{de}') TO ('{ate}');
+            INSERT INTO chat_history SELECT * FROM _chat_history_mover;
+            DROP TABLE _chat_history_mover;
+        END IF;
+    END $$;""")
+        ano, mes = prox_ano, prox_mes
+    return "\n".join(partes) + "\n"
+
+
+def run_migration(particionado: bool = False, meses: int = 3):
     db_url = os.getenv("DIRECT_URL") or os.getenv("DATABASE_URL")
     if not db_url:
         print("Erro: DIRECT_URL ou DATABASE_URL nao configurado")
@@ -34,34 +116,27 @@ def run_migration():
     db_url = sanitize_pg_dsn(db_url)
 
     print(f"Conectando ao banco...")
-    conn = psycopg2.connect(db_url, sslmode="require")
-    cursor = conn.cursor()
-
-    print("Criando tabela chat_history...")
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS chat_history (
-            id BIGSERIAL PRIMARY KEY,
-            telefone TEXT NOT NULL,
-            role TEXT NOT NULL,
-            content TEXT,
-            tool_calls JSONB,
-            tool_call_id TEXT,
-            name TEXT,
-            media_type TEXT DEFAULT 'text',
-            media_url TEXT,
-            created_at TIMESTAMPTZ DEFAULT NOW()
-        );
-    """)
-
-    print("Criando indices...")
-    cursor.execute("""
-        CREATE INDEX IF NOT EXISTS idx_chat_history_phone_time
-        ON chat_history(telefone, created_at DESC);
-    """)
-
-    conn.commit()
-    cursor.close()
-    conn.close()
+    # closing() fecha a conexão; o `with conn` faz commit/rollback
+    with closing(psycopg2.connect(db_url, sslmode="require")) as conn:
+        with conn, conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT relkind FROM pg_class WHERE oid = to_regclass('chat_history')"
+            )
+            existente = cursor.fetchone()
+
+            # Tabela + índices em um único round-trip, aplicados atomicamente
+            if particionado and existente and existente[0] != "p":
+                print("Aviso: chat_history ja existe sem particionamento; "
+                      "mantendo a tabela atual")
+                ddl = TABELA_SIMPLES + INDICES
+            elif particionado:
+                print(f"Criando chat_history particionada ({meses} meses)...")
+                ddl = TABELA_PARTICIONADA + ddl_particoes(date.today(), meses) + INDICES
+            else:
+                print("Criando tabela chat_history e indices...")
+                ddl = TABELA_SIMPLES + INDICES
+
+            cursor.execute(ddl)
 
     print("Migracao concluida com sucesso!")
 
@@ -69,4 +144,11 @@ def run_migration():
 if __name__ == "__main__":
     from dotenv import load_dotenv
     load_dotenv(os.path.join(os.path.dirname(__file__), "..", ".env"))
-    run_migration()
+    parser = argparse.ArgumentParser(description="Cria a tabela chat_history")
+    parser.add_argument("--particionado", action="store_true",
+                        help="Cria a tabela particionada por mes (apenas em bancos novos)")
+    parser.add_argument("--meses", type=int, default=3,
+                        help="Quantidade de particoes mensais a criar (padrao: 3)")
+    args = parser.parse_args()
+
+    run_migration(particionado=args.particionado, meses=args.meses)
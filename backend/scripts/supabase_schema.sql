@@ -77,12 +77,12 @@ CREATE TABLE produtos (
 
     -- Sincronização
     fonte VARCHAR(20),                -- 'tiny', 'site'
-    ultima_sync_tiny TIMESTAMP,
-    ultima_sync_site TIMESTAMP,
+    ultima_sync_tiny TIMESTAMPTZ,
+    ultima_sync_site TIMESTAMPTZ,
 
     -- Timestamps
-    criado_em TIMESTAMP DEFAULT NOW(),
-    atualizado_em TIMESTAMP DEFAULT NOW(),
+    criado_em TIMESTAMPTZ DEFAULT NOW(),
+    atualizado_em TIMESTAMPTZ DEFAULT NOW(),
 
     -- Índices para busca rápida
     CONSTRAINT produtos_sku_unique UNIQUE (sku)
@@ -142,8 +142,8 @@ CREATE TABLE clientes (
     -- Histórico e estatísticas
     total_pedidos INTEGER DEFAULT 0,
     total_gasto DECIMAL(10,2) DEFAULT 0,
-    ultimo_pedido_em TIMESTAMP,
-    primeira_compra_em TIMESTAMP,
+    ultimo_pedido_em TIMESTAMPTZ,
+    primeira_compra_em TIMESTAMPTZ,
 
     -- Preferências
     produtos_favoritos UUID[],        -- IDs de produtos
@@ -154,8 +154,8 @@ CREATE TABLE clientes (
     tags TEXT[],                      -- Segmentação
 
     -- Timestamps
-    criado_em TIMESTAMP DEFAULT NOW(),
-    atualizado_em TIMESTAMP DEFAULT NOW()
+    criado_em TIMESTAMPTZ DEFAULT NOW(),
+    atualizado_em TIMESTAMPTZ DEFAULT NOW()
 );
 
 -- Índices
@@ -207,9 +207,9 @@ CREATE TABLE carrinhos (
     ativo BOOLEAN DEFAULT TRUE,
 
     -- Timestamps
-    criado_em TIMESTAMP DEFAULT NOW(),
-    atualizado_em TIMESTAMP DEFAULT NOW(),
-    expira_em TIMESTAMP DEFAULT NOW() + INTERVAL '24 hours'  -- Limpa após 24h
+    criado_em TIMESTAMPTZ DEFAULT NOW(),
+    atualizado_em TIMESTAMPTZ DEFAULT NOW(),
+    expira_em TIMESTAMPTZ DEFAULT NOW() + INTERVAL '24 hours'  -- Limpa após 24h
 );
 
 -- Índices
@@ -265,13 +265,13 @@ CREATE TABLE pedidos (
     ]
     */
 
-    -- Valores
-    total_produtos DECIMAL(10,2) NOT NULL,
-    frete_valor DECIMAL(10,2) DEFAULT 0,
+    -- Valores (NUMERIC(12,2): evita estouro do limite de 99.999.999,99)
+    total_produtos NUMERIC(12,2) NOT NULL CHECK (total_produtos >= 0),
+    frete_valor NUMERIC(12,2) DEFAULT 0 CHECK (frete_valor >= 0),
     frete_tipo VARCHAR(50),
-    desconto DECIMAL(10,2) DEFAULT 0,
-    outras_despesas DECIMAL(10,2) DEFAULT 0,
-    total DECIMAL(10,2) NOT NULL,
+    desconto NUMERIC(12,2) DEFAULT 0 CHECK (desconto >= 0),
+    outras_despesas NUMERIC(12,2) DEFAULT 0 CHECK (outras_despesas >= 0),
+    total NUMERIC(12,2) NOT NULL CHECK (total >= 0),
 
     -- Status do pedido
     status VARCHAR(50) NOT NULL DEFAULT 'aguardando_pagamento',
@@ -303,18 +303,18 @@ CREATE TABLE pedidos (
 
     -- Sincronização com Tiny
     tiny_sincronizado BOOLEAN DEFAULT FALSE,
-    tiny_sincronizado_em TIMESTAMP,
+    tiny_sincronizado_em TIMESTAMPTZ,
     tiny_situacao INTEGER,                 -- Situação no Tiny (0-9)
     tiny_erro TEXT,                        -- Erro de sincronização (se houver)
 
     -- Timestamps
-    criado_em TIMESTAMP DEFAULT NOW(),
-    atualizado_em TIMESTAMP DEFAULT NOW(),
-    pago_em TIMESTAMP,
-    confirmado_em TIMESTAMP,
-    enviado_em TIMESTAMP,
-    entregue_em TIMESTAMP,
-    cancelado_em TIMESTAMP
+    criado_em TIMESTAMPTZ DEFAULT NOW(),
+    atualizado_em TIMESTAMPTZ DEFAULT NOW(),
+    pago_em TIMESTAMPTZ,
+    confirmado_em TIMESTAMPTZ,
+    enviado_em TIMESTAMPTZ,
+    entregue_em TIMESTAMPTZ,
+    cancelado_em TIMESTAMPTZ
 );
 
 -- Índices
@@ -323,7 +323,9 @@ CREATE INDEX idx_pedidos_telefone ON pedidos(telefone);
 CREATE INDEX idx_pedidos_cpf ON pedidos(cliente_cpf);
 CREATE INDEX idx_pedidos_tiny_id ON pedidos(tiny_pedido_id);
 CREATE INDEX idx_pedidos_canal ON pedidos(canal);
-CREATE INDEX idx_pedidos_status ON pedidos(status);
+-- Parcial: só pedidos em andamento (entregues/cancelados não incham o índice)
+CREATE INDEX idx_pedidos_em_andamento ON pedidos(telefone, atualizado_em DESC)
+    WHERE status NOT IN ('entregue', 'cancelado');
 CREATE INDEX idx_pedidos_criado_em ON pedidos(criado_em DESC);
 CREATE INDEX idx_pedidos_cliente_id ON pedidos(cliente_id);
 CREATE INDEX idx_pedidos_tiny_sync ON pedidos(tiny_sincronizado) WHERE tiny_sincronizado = FALSE;
@@ -345,23 +347,23 @@ CREATE TABLE sessoes (
 
     -- Atendente humano
     atendente_humano VARCHAR(255),
-    atendente_assumiu_em TIMESTAMP,
+    atendente_assumiu_em TIMESTAMPTZ,
 
     -- Timestamps de mensagens
-    ultima_msg_cliente TIMESTAMP,
-    ultima_msg_agente TIMESTAMP,
-    ultima_msg_humano TIMESTAMP,
+    ultima_msg_cliente TIMESTAMPTZ,
+    ultima_msg_agente TIMESTAMPTZ,
+    ultima_msg_humano TIMESTAMPTZ,
 
     -- Pausado
-    pausado_em TIMESTAMP,
+    pausado_em TIMESTAMPTZ,
     pausado_por VARCHAR(255),
 
     -- Metadata
     metadata JSONB DEFAULT '{}',
 
     -- Timestamps
-    criado_em TIMESTAMP DEFAULT NOW(),
-    atualizado_em TIMESTAMP DEFAULT NOW()
+    criado_em TIMESTAMPTZ DEFAULT NOW(),
+    atualizado_em TIMESTAMPTZ DEFAULT NOW()
 );
 
 -- Índices
@@ -389,7 +391,7 @@ CREATE TABLE mensagens (
     metadata JSONB DEFAULT '{}',
 
     -- Timestamp
-    criado_em TIMESTAMP DEFAULT NOW()
+    criado_em TIMESTAMPTZ DEFAULT NOW()
 );
 
 -- Índices
@@ -425,11 +427,11 @@ CREATE TABLE sync_log (
 
     -- Tentativas
     tentativas INTEGER DEFAULT 1,
-    proxima_tentativa TIMESTAMP,
+    proxima_tentativa TIMESTAMPTZ,
 
     -- Timestamp
-    criado_em TIMESTAMP DEFAULT NOW(),
-    atualizado_em TIMESTAMP DEFAULT NOW()
+    criado_em TIMESTAMPTZ DEFAULT NOW(),
+    atualizado_em TIMESTAMPTZ DEFAULT NOW()
 );
 
 -- Índices
@@ -11,15 +11,18 @@ Opções:
     --delay SECS    Delay entre chamadas API (padrão: 0.5s)
     --batch SIZE    Tamanho do lote (padrão: 100)
     --dry-run       Simula sem gravar no banco
+    --sem-copy      Grava via INSERT multi-VALUES em vez de COPY
+    --concurrency N Buscas de detalhe simultâneas no Tiny (padrão: 8)
+    --cache-detalhes Reaproveita detalhes de produtos que não mudaram na
+                    listagem do Tiny (tabela produtos_tiny_cache, migração 006)
 
 Ambiente:
-    - DATABASE_URL
+    - DIRECT_URL (preferida: COPY exige conexão de sessão) ou DATABASE_URL
     - TINY_API_TOKEN
 """
 
 import asyncio
 import argparse
-import os
 import sys
 from pathlib import Path
 from datetime import datetime
@@ -31,48 +34,25 @@ sys.path.insert(0, str(ROOT_DIR))
 
 from loguru import logger
 from dotenv import load_dotenv
-import psycopg2
-from psycopg2.extras import RealDictCursor, Json
-from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
 
 from src.services.tiny_products_client import get_tiny_products_client
+from scripts._pg_utils import copy_upsert, values_upsert
+from scripts._sync_common import (
+    carregar_cache_detalhes, salvar_cache_detalhes, sincronizar_produtos_site
+)
 
 # Carregar variáveis de ambiente
 load_dotenv()
 
-# Parâmetros que psycopg2 não entende (Supabase específicos)
-DROP_QS_KEYS = {"pgbouncer", "connection_limit"}
-
-
-def sanitize_pg_dsn(database_url: str) -> str:
-    """Remove query params que psycopg2 não aceita"""
-    u = urlparse(database_url)
-    qs = dict(parse_qsl(u.query, keep_blank_values=True))
-
-    for k in list(qs.keys()):
-        if k in DROP_QS_KEYS:
-            qs.pop(k, None)
-
-    new_query = urlencode(qs, doseq=True)
-    return urlunparse((u.scheme, u.netloc, u.path, u.params, new_query, u.fragment))
-
-
-def get_db_connection():
-    """Cria conexão com Supabase (PostgreSQL)"""
-    database_url = os.getenv("DATABASE_URL") or os.getenv("DIRECT_URL")
-
-    if not database_url:
-        raise ValueError("DATABASE_URL ou DIRECT_URL não configurado")
-
-    database_url = sanitize_pg_dsn(database_url)
-    return psycopg2.connect(database_url, sslmode="require")
-
 
 async def sincronizar_produtos(
     sync_all: bool = False,
     delay: float = 0.5,
     batch_size: int = 100,
-    dry_run: bool = False
+    dry_run: bool = False,
+    usar_copy: bool = True,
+    concorrencia: int = 8,
+    cache_detalhes: bool = False
 ):
     """
     Sincroniza produtos do Tiny para Supabase
@@ -82,6 +62,9 @@ async def sincronizar_produtos(
         delay: Segundos de delay entre chamadas API
         batch_size: Tamanho do lote
         dry_run: Se True, não grava no banco
+        usar_copy: Se False, grava via execute_values (sem COPY)
+        concorrencia: Buscas de detalhe simultâneas no Tiny
+        cache_detalhes: Se True, usa produtos_tiny_cache (ignorado em dry-run)
     """
     inicio = datetime.now()
     logger.info("=" * 80)
@@ -89,187 +72,73 @@ async def sincronizar_produtos(
     logger.info("=" * 80)
     logger.info(f"📅 Início: {inicio.strftime('%Y-%m-%d %H:%M:%S')}")
     logger.info(f"🎯 Modo: {'TODOS OS PRODUTOS' if sync_all else 'APENAS PRODUTOS COM SITE'}")
-    logger.info(f"⏱️ Delay: {delay}s entre produtos")
+    logger.info(f"⏱️ Delay: {delay}s entre chamadas API (~{1/delay if delay else 0:.1f} req/s)")
+    logger.info(f"🔀 Concorrência: {concorrencia} buscas simultâneas")
     logger.info(f"📦 Batch: {batch_size} produtos por lote")
     logger.info(f"🧪 Dry Run: {'SIM (não grava)' if dry_run else 'NÃO (grava no banco)'}")
     logger.info("=" * 80)
 
-    # Buscar produtos do Tiny
+    # Buscar produtos do Tiny (em fluxo) e gravar em lotes conforme chegam
     tiny_client = get_tiny_products_client()
 
     # Configurar cliente para buscar TODOS ou filtrar
     if sync_all:
         logger.info("🔍 Buscando TODOS os produtos do Tiny (sem filtro, com paginacao)...")
-        produtos = await tiny_client.listar_produtos(
-            limite=0, filtrar_site=False, delay_entre_detalhes=delay
-        )
     else:
         logger.info("🔍 Buscando apenas produtos com 'site' nas observações...")
-        produtos = await tiny_client.listar_produtos(
-            limite=0, filtrar_site=True, delay_entre_detalhes=delay
-        )
 
-    if not produtos:
-        logger.warning("⚠️ Nenhum produto encontrado no Tiny")
-        return
-
-    logger.info(f"📦 {len(produtos)} produtos encontrados")
-
-    # Conectar ao Supabase (só se não for dry-run)
-    conn = None
-    cursor = None
+    # Cache de detalhes: produtos iguais na listagem só consultam o estoque
+    cache = None
+    assinaturas_anteriores = {}
+    if cache_detalhes and not dry_run:
+        cache = await asyncio.to_thread(carregar_cache_detalhes)
+        assinaturas_anteriores = {k: v[0] for k, v in cache.items()}
+        logger.info(f"🗃️ Cache de detalhes: {len(cache)} produtos")
+
+    produtos = tiny_client.iter_produtos(
+        limite=0, filtrar_site=not sync_all, delay_entre_detalhes=delay,
+        concorrencia=concorrencia, cache_detalhes=cache
+    )
 
-    if not dry_run:
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
+    upsert = copy_upsert if usar_copy else values_upsert
+    metodo = "COPY" if usar_copy else "execute_values"
 
     try:
-        novos = 0
-        atualizados = 0
-        pulados = 0
-        erros = 0
-
-        for idx, produto in enumerate(produtos, 1):
-            try:
-                # Log de progresso
-                if idx % 10 == 0 or idx == 1:
-                    logger.info(f"⏳ Processando {idx}/{len(produtos)}...")
-
-                # Preparar dados
-                imagens = produto.get("imagens", [])
-                imagem_url = imagens[0] if isinstance(imagens, list) and len(imagens) > 0 else None
-
-                peso_bruto = produto.get("peso_bruto", 0)
-                peso_liquido = produto.get("peso_liquido", 0)
-                peso = str(peso_bruto or peso_liquido or 0)
-
-                if dry_run:
-                    logger.debug(f"🧪 [DRY-RUN] {produto['nome']} (ID: {produto['tiny_id']})")
-                    pulados += 1
-                else:
-                    # Verificar se existe
-                    cursor.execute(
-                        "SELECT id FROM produtos_site WHERE tiny_id = %s",
-                        (str(produto["tiny_id"]),)
-                    )
-
-                    existe = cursor.fetchone()
-
-                    # Extrair observacoes
-                    observacoes = produto.get("observacoes", "") or ""
-
-                    if existe:
-                        # Atualizar
-                        cursor.execute("""
-                            UPDATE produtos_site SET
-                                nome = %s,
-                                descricao = %s,
-                                observacoes = %s,
-                                preco = %s,
-                                preco_promocional = %s,
-                                peso = %s,
-                                unidade = %s,
-                                imagem_url = %s,
-                                imagens_adicionais = %s,
-                                categoria = %s,
-                                estoque_disponivel = %s,
-                                quantidade_estoque = %s,
-                                ativo = %s,
-                                sincronizado_em = NOW(),
-                                updated_at = NOW()
-                            WHERE tiny_id = %s
-                        """, (
-                            produto["nome"],
-                            produto["descricao"],
-                            observacoes,
-                            produto["preco"],
-                            produto["preco_promocional"],
-                            peso,
-                            produto.get("unidade", "UN"),
-                            imagem_url,
-                            Json(imagens) if imagens else None,
-                            produto["categoria"],
-                            produto["estoque"] > 0,
-                            int(produto["estoque"]),
-                            produto["ativo"],
-                            str(produto["tiny_id"])
-                        ))
-                        atualizados += 1
-                        logger.debug(f"✏️ Atualizado: {produto['nome']}")
-                    else:
-                        # Inserir
-                        cursor.execute("""
-                            INSERT INTO produtos_site (
-                                tiny_id, nome, descricao,
-                                observacoes,
-                                preco, preco_promocional,
-                                peso, unidade,
-                                imagem_url, imagens_adicionais,
-                                categoria,
-                                estoque_disponivel, quantidade_estoque,
-                                ativo, destaque,
-                                sincronizado_em, created_at, updated_at
-                            ) VALUES (
-                                %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-                                NOW(), NOW(), NOW()
-                            )
-                        """, (
-                            str(produto["tiny_id"]),
-                            produto["nome"],
-                            produto["descricao"],
-                            observacoes,
-                            produto["preco"],
-                            produto["preco_promocional"],
-                            peso,
-                            produto.get("unidade", "UN"),
-                            imagem_url,
-                            Json(imagens) if imagens else None,
-                            produto["categoria"],
-                            produto["estoque"] > 0,
-                            int(produto["estoque"]),
-                            produto["ativo"],
-                            False  # destaque
-                        ))
-                        novos += 1
-                        logger.debug(f"➕ Novo: {produto['nome']}")
-
-                    conn.commit()
-
-                # Rate limiting: aguardar antes do próximo
-                if delay > 0 and idx < len(produtos):
-                    await asyncio.sleep(delay)
-
-            except Exception as e:
-                logger.error(f"❌ Erro ao processar {produto.get('nome')}: {e}")
-                erros += 1
-                if conn:
-                    conn.rollback()
-
-        # Resumo final
-        fim = datetime.now()
-        duracao = (fim - inicio).total_seconds()
+        logger.info(f"💾 Gravação via {metodo} + upsert, em lotes de {batch_size}")
+        totais = await sincronizar_produtos_site(
+            produtos, batch_size=batch_size, upsert=upsert, dry_run=dry_run
+        )
 
-        logger.info("=" * 80)
-        logger.info("✅ SINCRONIZAÇÃO CONCLUÍDA!")
-        logger.info("=" * 80)
-        logger.info(f"📊 Total processado: {len(produtos)}")
-        logger.info(f"➕ Novos: {novos}")
-        logger.info(f"✏️ Atualizados: {atualizados}")
-        logger.info(f"⏭️ Pulados (dry-run): {pulados}")
-        logger.info(f"❌ Erros: {erros}")
-        logger.info(f"⏱️ Duração: {duracao:.2f}s ({duracao/60:.2f} min)")
-        logger.info(f"⚡ Velocidade: {len(produtos)/duracao:.2f} produtos/segundo")
-        logger.info("=" * 80)
+        if cache is not None:
+            gravados = await asyncio.to_thread(
+                salvar_cache_detalhes, cache, assinaturas_anteriores
+            )
+            logger.info(f"🗃️ Cache de detalhes: {gravados} produtos atualizados")
 
     except Exception as e:
         logger.error(f"❌ Erro na sincronização: {e}")
         raise
 
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+    if not totais["total"]:
+        logger.warning("⚠️ Nenhum produto encontrado no Tiny")
+        return
+
+    # Resumo final
+    fim = datetime.now()
+    duracao = (fim - inicio).total_seconds()
+
+    logger.info("=" * 80)
+    logger.info("✅ SINCRONIZAÇÃO CONCLUÍDA!")
+    logger.info("=" * 80)
+    logger.info(f"📊 Total processado: {totais['total']}")
+    logger.info(f"➕ Novos: {totais['novos']}")
+    logger.info(f"✏️ Atualizados: {totais['atualizados']}")
+    logger.info(f"💤 Inalterados: {totais['inalterados']}")
+    logger.info(f"⏭️ Pulados (dry-run): {totais['pulados']}")
+    logger.info(f"❌ Erros: {totais['erros']}")
+    logger.info(f"⏱️ Duração: {duracao:.2f}s ({duracao/60:.2f} min)")
+    logger.info(f"⚡ Velocidade: {totais['total']/duracao:.2f} produtos/segundo")
+    logger.info("=" * 80)
 
 
 async def main():
@@ -286,7 +155,7 @@ async def main():
         "--delay",
         type=float,
         default=0.5,
-        help="Delay em segundos entre produtos (padrão: 0.5)"
+        help="Intervalo médio em segundos entre chamadas API (padrão: 0.5)"
     )
     parser.add_argument(
         "--batch",
@@ -299,6 +168,22 @@ async def main():
         action="store_true",
         help="Simula sem gravar no banco"
     )
+    parser.add_argument(
+        "--sem-copy",
+        action="store_true",
+        help="Grava via INSERT multi-VALUES em vez de COPY"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=8,
+        help="Buscas de detalhe simultâneas no Tiny (padrão: 8)"
+    )
+    parser.add_argument(
+        "--cache-detalhes",
+        action="store_true",
+        help="Reaproveita detalhes de produtos inalterados (produtos_tiny_cache)"
+    )
 
     args = parser.parse_args()
 
@@ -306,7 +191,10 @@ async def main():
         sync_all=args.all,
         delay=args.delay,
         batch_size=args.batch,
-        dry_run=args.dry_run
+        dry_run=args.dry_run,
+        usar_copy=not args.sem_copy,
+        concorrencia=args.concurrency,
+        cache_detalhes=args.cache_detalhes
     )
 
 
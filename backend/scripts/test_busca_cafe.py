@@ -3,138 +3,64 @@
 Script para debugar busca de café especificamente
 """
 import sys
+from contextlib import closing
 from pathlib import Path
 
 ROOT_DIR = Path(__file__).parent.parent
-sys.path.insert(0, str(ROOT_DIR))
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
 
 from dotenv import load_dotenv
-import psycopg2
-from psycopg2.extras import RealDictCursor
 import os
-from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
+
+from src.utils.db import sanitize_pg_dsn
 
 load_dotenv()
 
-DROP_QS_KEYS = {"pgbouncer", "connection_limit"}
+# Consultas do diagnóstico (texto fixo: montado uma vez, no import)
+SQL_TOTAL_ATIVOS = "SELECT COUNT(*) FROM produtos_site WHERE ativo = TRUE"
 
-def sanitize_pg_dsn(database_url: str) -> str:
-    u = urlparse(database_url)
-    qs = dict(parse_qsl(u.query, keep_blank_values=True))
-    for k in list(qs.keys()):
-        if k in DROP_QS_KEYS:
-            qs.pop(k, None)
-    new_query = urlencode(qs, doseq=True)
-    return urlunparse((u.scheme, u.netloc, u.path, u.params, new_query, u.fragment))
+SQL_LISTAR_PRODUTOS = """
+    SELECT nome, categoria, estoque_disponivel, ativo
+    FROM produtos_site
+    ORDER BY nome
+    LIMIT 50
+"""
 
-def main():
+# Uma única varredura para os testes de busca: os filtros de cada teste
+# (acento, disponibilidade) são aplicados em Python sobre este resultado.
+# As consultas usam o cursor padrão (tuplas): a ordem das colunas do SELECT
+# é a ordem do desempacotamento abaixo.
+SQL_BUSCA_CAFE = """
+    SELECT nome, categoria, ativo, estoque_disponivel, quantidade_estoque
+    FROM produtos_site
+    WHERE f_unaccent(lower(nome)) LIKE f_unaccent(lower(%s))
+"""
+
+
+def get_db_connection():
+    """Abre conexão com o Supabase (None se não configurado)"""
     database_url = os.getenv("DATABASE_URL") or os.getenv("DIRECT_URL")
     if not database_url:
-        print("❌ DATABASE_URL não configurado")
-        return
+        return None
+    # Importado só quando há banco para conectar (psycopg2 carrega libpq/SSL)
+    import psycopg2
+    return psycopg2.connect(sanitize_pg_dsn(database_url), sslmode="require")
 
-    database_url = sanitize_pg_dsn(database_url)
 
+def main():
     try:
-        conn = psycopg2.connect(database_url, sslmode="require")
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-
-        # 1. Contar total de produtos
-        print("="*70)
-        print("📊 ESTATÍSTICAS")
-        print("="*70)
-        cursor.execute("SELECT COUNT(*) as total FROM produtos_site WHERE ativo = TRUE")
-        total = cursor.fetchone()["total"]
-        print(f"Total de produtos ativos: {total}")
+        conn = get_db_connection()
+        if conn is None:
+            print("❌ DATABASE_URL não configurado")
+            return
+    except Exception as e:
+        print(f"❌ Erro ao conectar: {e}")
+        return
 
-        # 2. Listar TODOS os produtos (apenas nomes)
-        print("\n" + "="*70)
-        print("📋 TODOS OS PRODUTOS NO BANCO")
-        print("="*70)
-        cursor.execute("""
-            SELECT nome, categoria, estoque_disponivel, ativo
-            FROM produtos_site
-            ORDER BY nome
-            LIMIT 50
-        """)
-        produtos = cursor.fetchall()
-        for p in produtos:
-            status = "✅" if p["estoque_disponivel"] else "❌"
-            ativo = "🟢" if p["ativo"] else "🔴"
-            print(f"{status} {ativo} {p['nome']} ({p['categoria']})")
-
-        # 3. Buscar produtos que contêm "cafe" (qualquer variação)
-        print("\n" + "="*70)
-        print("🔍 TESTE 1: Busca com 'cafe' (sem acento)")
-        print("="*70)
-        cursor.execute("""
-            SELECT nome, categoria, ativo, estoque_disponivel
-            FROM produtos_site
-            WHERE LOWER(nome) LIKE LOWER(%s)
-            AND ativo = TRUE
-            AND estoque_disponivel = TRUE
-        """, ("%cafe%",))
-        resultados = cursor.fetchall()
-        print(f"Encontrados: {len(resultados)} produtos")
-        for r in resultados:
-            print(f"  - {r['nome']}")
-
-        # 4. Buscar com "café" (com acento)
-        print("\n" + "="*70)
-        print("🔍 TESTE 2: Busca com 'café' (com acento)")
-        print("="*70)
-        cursor.execute("""
-            SELECT nome, categoria, ativo, estoque_disponivel
-            FROM produtos_site
-            WHERE LOWER(nome) LIKE LOWER(%s)
-            AND ativo = TRUE
-            AND estoque_disponivel = TRUE
-        """, ("%café%",))
-        resultados = cursor.fetchall()
-        print(f"Encontrados: {len(resultados)} produtos")
-        for r in resultados:
-            print(f"  - {r['nome']}")
-
-        # 5. Buscar com unaccent (se disponível)
-        print("\n" + "="*70)
-        print("🔍 TESTE 3: Busca com UNACCENT (ignora acentos)")
-        print("="*70)
-        try:
-            cursor.execute("""
-                SELECT nome, categoria
-                FROM produtos_site
-                WHERE unaccent(LOWER(nome)) LIKE unaccent(LOWER(%s))
-                AND ativo = TRUE
-                AND estoque_disponivel = TRUE
-            """, ("%cafe%",))
-            resultados = cursor.fetchall()
-            print(f"Encontrados: {len(resultados)} produtos")
-            for r in resultados:
-                print(f"  - {r['nome']}")
-        except Exception as e:
-            print(f"⚠️ UNACCENT não disponível: {e}")
-            print("Solução: Instalar extensão unaccent no PostgreSQL")
-
-        # 6. Verificar produtos inativos ou sem estoque
-        print("\n" + "="*70)
-        print("⚠️ PRODUTOS COM 'CAFÉ' INATIVOS OU SEM ESTOQUE")
-        print("="*70)
-        cursor.execute("""
-            SELECT nome, ativo, estoque_disponivel, quantidade_estoque
-            FROM produtos_site
-            WHERE LOWER(nome) LIKE LOWER(%s)
-            AND (ativo = FALSE OR estoque_disponivel = FALSE)
-        """, ("%café%",))
-        inativos = cursor.fetchall()
-        if inativos:
-            for p in inativos:
-                print(f"  - {p['nome']}")
-                print(f"    Ativo: {p['ativo']} | Estoque disponível: {p['estoque_disponivel']} | Qtd: {p['quantidade_estoque']}")
-        else:
-            print("  Nenhum produto inativo/sem estoque encontrado")
-
-        cursor.close()
-        conn.close()
+    try:
+        with closing(conn), conn.cursor() as cursor:
+            _diagnosticar(cursor)
 
         print("\n" + "="*70)
         print("✅ Testes concluídos")
@@ -145,5 +71,84 @@ def main():
         import traceback
         traceback.print_exc()
 
+
+def _imprimir_linhas(linhas):
+    """Imprime as linhas de uma listagem com uma única escrita no stdout"""
+    texto = "\n".join(linhas)
+    if texto:
+        sys.stdout.write(texto + "\n")
+
+
+def _imprimir_busca(titulo: str, resultados: list):
+    """Imprime o título e os nomes de um teste de busca"""
+    print("\n" + "="*70)
+    print(titulo)
+    print("="*70)
+    print(f"Encontrados: {len(resultados)} produtos")
+    _imprimir_linhas(f"  - {nome}" for nome, *_ in resultados)
+
+
+def _diagnosticar(cursor):
+    """Executa as consultas do diagnóstico e imprime os resultados"""
+    # 1. Contar total de produtos
+    print("="*70)
+    print("📊 ESTATÍSTICAS")
+    print("="*70)
+    cursor.execute(SQL_TOTAL_ATIVOS)
+    (total,) = cursor.fetchone()
+    print(f"Total de produtos ativos: {total}")
+
+    # 2. Listar TODOS os produtos (apenas nomes)
+    print("\n" + "="*70)
+    print("📋 TODOS OS PRODUTOS NO BANCO")
+    print("="*70)
+    cursor.execute(SQL_LISTAR_PRODUTOS)
+    _imprimir_linhas(
+        f"{'✅' if estoque_disponivel else '❌'} {'🟢' if ativo else '🔴'} {nome} ({categoria})"
+        for nome, categoria, estoque_disponivel, ativo in cursor.fetchall()
+    )
+
+    # Testes 1 a 4: uma consulta (sem acento) separada em Python
+    try:
+        cursor.execute(SQL_BUSCA_CAFE, ("%cafe%",))
+    except Exception as e:
+        print(f"⚠️ f_unaccent não disponível: {e}")
+        print("Solução: Aplicar migrations/007_produtos_site_busca_trgm.sql")
+        return
+
+    # (nome, categoria, ativo, estoque_disponivel, quantidade_estoque)
+    encontrados = cursor.fetchall()
+    disponiveis = [r for r in encontrados if r[2] and r[3]]
+    indisponiveis = [r for r in encontrados if not (r[2] and r[3])]
+
+    # 3. Nome contém "cafe" literalmente (sem acento)
+    _imprimir_busca(
+        "🔍 TESTE 1: Busca com 'cafe' (sem acento)",
+        [r for r in disponiveis if "cafe" in r[0].lower()]
+    )
+
+    # 4. Nome contém "café" literalmente (com acento)
+    _imprimir_busca(
+        "🔍 TESTE 2: Busca com 'café' (com acento)",
+        [r for r in disponiveis if "café" in r[0].lower()]
+    )
+
+    # 5. Ignorando acentos (f_unaccent)
+    _imprimir_busca("🔍 TESTE 3: Busca com f_unaccent (ignora acentos)", disponiveis)
+
+    # 6. Verificar produtos inativos ou sem estoque
+    print("\n" + "="*70)
+    print("⚠️ PRODUTOS COM 'CAFÉ' INATIVOS OU SEM ESTOQUE")
+    print("="*70)
+    if indisponiveis:
+        _imprimir_linhas(
+            f"  - {nome}\n"
+            f"    Ativo: {ativo} | Estoque disponível: {estoque_disponivel} | Qtd: {quantidade}"
+            for nome, _, ativo, estoque_disponivel, quantidade in indisponiveis
+        )
+    else:
+        print("  Nenhum produto inativo/sem estoque encontrado")
+
+
 if __name__ == "__main__":
     main()
@@ -21,14 +21,13 @@ from loguru import logger
 from src.services.frete_service import FreteService
 
 
-async def test_nominatim():
+async def test_nominatim(service: FreteService):
     """Testa geocoding com Nominatim."""
     logger.info("=" * 60)
     logger.info("TESTE 1: Nominatim Geocoding")
     logger.info("=" * 60)
 
-    from src.services.frete_service import NominatimClient
-    client = NominatimClient()
+    client = service.nominatim
 
     # Teste BH
     coords = await client.geocode("Savassi, Belo Horizonte, MG")
@@ -47,14 +46,13 @@ async def test_nominatim():
     return True
 
 
-async def test_lalamove():
+async def test_lalamove(service: FreteService):
     """Testa cotação Lalamove."""
     logger.info("=" * 60)
     logger.info("TESTE 2: Lalamove Quotation (Sandbox)")
     logger.info("=" * 60)
 
-    from src.services.frete_service import LalamoveClient
-    client = LalamoveClient()
+    client = service.lalamove
 
     if not client.api_key:
         logger.warning("⚠️ LALAMOVE_API_KEY não configurada, pulando teste")
@@ -76,14 +74,13 @@ async def test_lalamove():
     return result is not None
 
 
-async def test_correios():
+async def test_correios(service: FreteService):
     """Testa cálculo SEDEX Correios."""
     logger.info("=" * 60)
     logger.info("TESTE 3: Correios SEDEX")
     logger.info("=" * 60)
 
-    from src.services.frete_service import CorreiosClient
-    client = CorreiosClient()
+    client = service.correios
 
     if not client.token:
         logger.warning("⚠️ CORREIOS_TOKEN não configurado, pulando teste")
@@ -106,13 +103,12 @@ async def test_correios():
     return result is not None
 
 
-async def test_frete_service_bh():
+async def test_frete_service_bh(service: FreteService):
     """Testa FreteService com endereço em BH."""
     logger.info("=" * 60)
     logger.info("TESTE 4: FreteService - Endereço em BH com CEP")
     logger.info("=" * 60)
 
-    service = FreteService()
     result = await service.calcular(
         endereco="Rua da Bahia, 1000 - Savassi, BH - 30160-011",
         valor_pedido=150.0,
@@ -129,13 +125,12 @@ async def test_frete_service_bh():
     return len(result["opcoes_frete"]) > 0
 
 
-async def test_frete_service_fora():
+async def test_frete_service_fora(service: FreteService):
     """Testa FreteService com endereço fora de BH."""
     logger.info("=" * 60)
     logger.info("TESTE 5: FreteService - Endereço fora de BH (SP)")
     logger.info("=" * 60)
 
-    service = FreteService()
     result = await service.calcular(
         endereco="Rua Augusta, 500 - São Paulo - 01304-001",
         valor_pedido=200.0,
@@ -152,13 +147,12 @@ async def test_frete_service_fora():
     return len(result["opcoes_frete"]) > 0
 
 
-async def test_frete_service_sem_cep():
+async def test_frete_service_sem_cep(service: FreteService):
     """Testa FreteService com endereço sem CEP."""
     logger.info("=" * 60)
     logger.info("TESTE 6: FreteService - Endereço sem CEP (só nome)")
     logger.info("=" * 60)
 
-    service = FreteService()
     result = await service.calcular(
         endereco="Savassi, Belo Horizonte",
         valor_pedido=100.0,
@@ -180,49 +174,27 @@ async def main():
     logger.info("🚀 Testando FreteService (Lalamove + Correios + Nominatim)")
     logger.info("")
 
-    results = {}
+    # Um FreteService (e um AsyncClient) para todos os testes. Os testes são
+    # independentes e só esperam rede: rodam juntos, o tempo total é o do
+    # mais lento (os logs de testes diferentes podem se intercalar)
+    async with FreteService() as service:
+        testes = {
+            "nominatim": test_nominatim(service),
+            "lalamove": test_lalamove(service),
+            "correios": test_correios(service),
+            "frete_bh": test_frete_service_bh(service),
+            "frete_fora": test_frete_service_fora(service),
+            "frete_sem_cep": test_frete_service_sem_cep(service),
+        }
+        valores = await asyncio.gather(*testes.values(), return_exceptions=True)
 
-    # Teste Nominatim
-    try:
-        results["nominatim"] = await test_nominatim()
-    except Exception as e:
-        logger.error(f"❌ Erro no teste Nominatim: {e}")
-        results["nominatim"] = False
-
-    # Teste Lalamove
-    try:
-        results["lalamove"] = await test_lalamove()
-    except Exception as e:
-        logger.error(f"❌ Erro no teste Lalamove: {e}")
-        results["lalamove"] = False
-
-    # Teste Correios
-    try:
-        results["correios"] = await test_correios()
-    except Exception as e:
-        logger.error(f"❌ Erro no teste Correios: {e}")
-        results["correios"] = False
-
-    # Teste FreteService BH
-    try:
-        results["frete_bh"] = await test_frete_service_bh()
-    except Exception as e:
-        logger.error(f"❌ Erro no teste FreteService BH: {e}")
-        results["frete_bh"] = False
-
-    # Teste FreteService fora
-    try:
-        results["frete_fora"] = await test_frete_service_fora()
-    except Exception as e:
-        logger.error(f"❌ Erro no teste FreteService fora: {e}")
-        results["frete_fora"] = False
-
-    # Teste FreteService sem CEP
-    try:
-        results["frete_sem_cep"] = await test_frete_service_sem_cep()
-    except Exception as e:
-        logger.error(f"❌ Erro no teste FreteService sem CEP: {e}")
-        results["frete_sem_cep"] = False
+    results = {}
+    for nome, valor in zip(testes, valores):
+        if isinstance(valor, Exception):
+            logger.error(f"❌ Erro no teste {nome}: {valor}")
+            results[nome] = False
+        else:
+            results[nome] = valor
 
     # Resumo
     logger.info("")
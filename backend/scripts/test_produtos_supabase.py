@@ -19,6 +19,18 @@ from src.orchestrator.tools_helper import get_tools_helper
 load_dotenv()
 
 
+def _preco(produto) -> float:
+    """Preço exibido: promocional, se houver"""
+    return produto.get("preco_promocional") or produto.get("preco", 0)
+
+
+def _imprimir_linhas(linhas):
+    """Imprime as linhas de uma listagem com uma única escrita no stdout"""
+    texto = "\n".join(linhas)
+    if texto:
+        sys.stdout.write(texto + "\n")
+
+
 def test_busca_direta():
     """Teste 1: Busca direta no Supabase"""
     print("=" * 70)
@@ -31,25 +43,22 @@ def test_busca_direta():
     print("\n1.1. Buscar 'cafe':")
     produtos = service.buscar_produtos(termo="cafe", limite=5)
     print(f"   Encontrados: {len(produtos)} produtos")
-    for p in produtos:
-        preco = p.get("preco_promocional") or p.get("preco", 0)
-        print(f"   - {p['nome']} | R$ {preco:.2f} | Estoque: {p.get('quantidade_estoque', 0)}")
+    _imprimir_linhas(
+        f"   - {p['nome']} | R$ {_preco(p):.2f} | Estoque: {p.get('quantidade_estoque', 0)}"
+        for p in produtos
+    )
 
     # Teste 1.2: Buscar "queijo"
     print("\n1.2. Buscar 'queijo':")
     produtos = service.buscar_produtos(termo="queijo", limite=5)
     print(f"   Encontrados: {len(produtos)} produtos")
-    for p in produtos:
-        preco = p.get("preco_promocional") or p.get("preco", 0)
-        print(f"   - {p['nome']} | R$ {preco:.2f}")
+    _imprimir_linhas(f"   - {p['nome']} | R$ {_preco(p):.2f}" for p in produtos)
 
     # Teste 1.3: Buscar "azeite"
     print("\n1.3. Buscar 'azeite':")
     produtos = service.buscar_produtos(termo="azeite", limite=5)
     print(f"   Encontrados: {len(produtos)} produtos")
-    for p in produtos:
-        preco = p.get("preco_promocional") or p.get("preco", 0)
-        print(f"   - {p['nome']} | R$ {preco:.2f}")
+    _imprimir_linhas(f"   - {p['nome']} | R$ {_preco(p):.2f}" for p in produtos)
 
     # Teste 1.4: Listar categorias
     print("\n1.4. Listar categorias:")
@@ -76,9 +85,7 @@ def test_tools_helper():
     print(f"   Total: {result.get('total', 0)} produtos")
 
     if result['status'] == 'success' and result.get('produtos'):
-        for p in result['produtos']:
-            preco = p.get("preco_promocional") or p.get("preco", 0)
-            print(f"   - {p['nome']} | R$ {preco:.2f}")
+        _imprimir_linhas(f"   - {p['nome']} | R$ {_preco(p):.2f}" for p in result['produtos'])
 
     # Teste 2.2: Buscar "bacon"
     print("\n2.2. Buscar 'bacon':")
@@ -88,9 +95,7 @@ def test_tools_helper():
     print(f"   Total: {result.get('total', 0)} produtos")
 
     if result['status'] == 'success' and result.get('produtos'):
-        for p in result['produtos']:
-            preco = p.get("preco_promocional") or p.get("preco", 0)
-            print(f"   - {p['nome']} | R$ {preco:.2f}")
+        _imprimir_linhas(f"   - {p['nome']} | R$ {_preco(p):.2f}" for p in result['produtos'])
 
     # Teste 2.3: Adicionar ao carrinho
     print("\n2.3. Testar adicionar ao carrinho:")
@@ -115,25 +120,25 @@ def test_estatisticas():
 
     service = get_supabase_produtos()
 
+    # Total, destaques e categorias numa única consulta (CTEs)
+    estatisticas = service.estatisticas_catalogo(limite_destaques=5)
+    contagens = estatisticas["contagens"]
+
     # Total de produtos
     print("\n3.1. Total de produtos disponíveis:")
-    todos = service.buscar_produtos(termo="", limite=1000, apenas_disponiveis=True)
-    print(f"   Total: {len(todos)} produtos")
+    print(f"   Total: {sum(contagens.values())} produtos")
 
     # Produtos em destaque
     print("\n3.2. Produtos em destaque:")
-    destaques = service.buscar_produtos_em_destaque(limite=5)
+    destaques = estatisticas["destaques"]
     print(f"   Total: {len(destaques)} produtos")
-    for p in destaques:
-        print(f"   - {p['nome']}")
+    _imprimir_linhas(f"   - {nome}" for nome in destaques)
 
     # Categorias
     print("\n3.3. Categorias:")
-    categorias = service.listar_categorias()
+    categorias = estatisticas["categorias"]
     print(f"   Total: {len(categorias)} categorias")
-    for cat in categorias:
-        produtos_cat = service.buscar_produtos(categoria=cat, limite=1000)
-        print(f"   - {cat}: {len(produtos_cat)} produtos")
+    _imprimir_linhas(f"   - {cat}: {contagens.get(cat, 0)} produtos" for cat in categorias)
 
     print("\n" + "=" * 70)
 
@@ -2,17 +2,30 @@
 AI Agent: Loop principal do agente conversacional usando OpenAI Function Calling.
 Substitui intent_classifier + intent_handlers + response_evaluator + gotcha_engine.
 """
-import json
+import asyncio
 import os
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
+import orjson
 from loguru import logger
-from openai import AsyncOpenAI
 
 from .system_prompt import build_system_prompt
 from .tool_definitions import get_tool_definitions
 from .tool_executor import ToolExecutor
 from .chat_history import ChatHistoryManager
 
+# Orçamento de tokens do histórico enviado ao modelo (mensagens mais recentes)
+HISTORICO_MAX_TOKENS = int(os.getenv("HISTORICO_MAX_TOKENS", "6000"))
+
+# Tools só de leitura: chamadas consecutivas rodam em paralelo (asyncio.gather).
+# As demais alteram estado ou enviam mensagens e rodam na ordem pedida pelo modelo.
+FERRAMENTAS_LEITURA = frozenset({
+    "buscar_produtos",
+    "view_cart",
+    "calcular_frete",
+    "buscar_historico_compras",
+    "verificar_status_pedido",
+})
+
 
 class AIAgent:
     """
@@ -26,6 +39,10 @@ class AIAgent:
     """
 
     def __init__(self):
+        # Import tardio: o SDK da OpenAI tem um grafo de imports pesado e só
+        # é necessário quando o agente é de fato criado
+        from openai import AsyncOpenAI
+
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
             logger.warning("OPENAI_API_KEY nao configurada")
@@ -57,20 +74,30 @@ class AIAgent:
         Returns:
             Resposta final do agente
         """
+        # Respostas do modelo e das tools a gravar no histórico: acumuladas em
+        # memória e gravadas num único lote ao final (save_messages). A
+        # mensagem do usuário é gravada antes, no início do turno
+        turno: List[dict] = []
+        # Resultados de tools de leitura deste turno, por (nome, argumentos)
+        memo_tools: Dict[Tuple[str, bytes], asyncio.Future] = {}
         try:
-            # 1. Montar system prompt com telefone
-            system_prompt = build_system_prompt(telefone)
+            # 1. Carregar últimas 30 mensagens do Postgres (numa thread),
+            # limitadas ao orçamento de tokens
+            carregamento = asyncio.create_task(
+                asyncio.to_thread(
+                    self.history_manager.load_history, telefone, 30, HISTORICO_MAX_TOKENS
+                )
+            )
 
-            # 2. Carregar últimas 30 mensagens do Postgres
-            history = self.history_manager.load_history(telefone, limit=30)
+            # 2. Montar system prompt com telefone (enquanto o banco responde)
+            system_prompt = build_system_prompt(telefone)
+            history = await carregamento
 
-            # 3. Salvar mensagem do usuário no histórico
+            # 3. Mensagem do usuário vai para o histórico já (uma falha no
+            # modelo ou nas tools não perde o que o cliente disse), mas depois
+            # da leitura, então não aparece duplicada no carregado
             self.history_manager.save_message(
-                telefone=telefone,
-                role="user",
-                content=user_message,
-                media_type=media_type,
-                media_url=media_url,
+                telefone, "user", user_message, media_type=media_type, media_url=media_url
             )
 
             # 4. Montar array de mensagens
@@ -98,11 +125,7 @@ class AIAgent:
                     final_text = assistant_message.content or ""
 
                     # Salvar resposta no histórico
-                    self.history_manager.save_message(
-                        telefone=telefone,
-                        role="assistant",
-                        content=final_text,
-                    )
+                    turno.append({"role": "assistant", "content": final_text})
 
                     logger.info(
                         f"Agent respondeu em {iteration + 1} iteracao(es) para {telefone[:8]}"
@@ -113,7 +136,6 @@ class AIAgent:
                 # Adicionar mensagem do assistant (com tool_calls) ao array
                 assistant_dict = {
                     "role": "assistant",
-                    "content": assistant_message.content,
                     "tool_calls": [
                         {
                             "id": tc.id,
@@ -126,45 +148,31 @@ class AIAgent:
                         for tc in assistant_message.tool_calls
                     ],
                 }
+                if assistant_message.content:
+                    assistant_dict["content"] = assistant_message.content
                 messages.append(assistant_dict)
 
-                # Salvar mensagem de tool_calls no histórico
-                self.history_manager.save_message(
-                    telefone=telefone,
-                    role="assistant",
-                    content=assistant_message.content,
-                    tool_calls=assistant_dict["tool_calls"],
+                # Executar tool calls (leituras consecutivas em paralelo)
+                results = await self._executar_tool_calls(
+                    assistant_dict["tool_calls"], telefone, memo_tools
                 )
 
-                # Executar cada tool call
-                for tool_call in assistant_message.tool_calls:
-                    function_name = tool_call.function.name
-                    try:
-                        arguments = json.loads(tool_call.function.arguments)
-                    except json.JSONDecodeError:
-                        arguments = {}
-
-                    logger.info(f"Tool call: {function_name}({json.dumps(arguments, ensure_ascii=False)[:200]})")
-
-                    result = await self.tool_executor.execute(
-                        function_name, arguments, telefone
-                    )
-
+                # Mensagem de tool_calls + resultados vão para o histórico do turno.
+                # O histórico guarda o resultado resumido; o modelo recebe o completo
+                turno.append(dict(assistant_dict))
+                for tool_call, result in zip(assistant_dict["tool_calls"], results):
+                    nome = tool_call["function"]["name"]
                     tool_message = {
                         "role": "tool",
-                        "tool_call_id": tool_call.id,
+                        "tool_call_id": tool_call["id"],
                         "content": result,
                     }
                     messages.append(tool_message)
-
-                    # Salvar resultado da tool no histórico
-                    self.history_manager.save_message(
-                        telefone=telefone,
-                        role="tool",
-                        content=result,
-                        tool_call_id=tool_call.id,
-                        name=function_name,
-                    )
+                    turno.append({
+                        **tool_message,
+                        "content": self.tool_executor.resumir_para_historico(nome, result),
+                        "name": nome,
+                    })
 
             # Se atingiu max iterações
             logger.warning(f"Agent atingiu max iteracoes para {telefone[:8]}")
@@ -173,3 +181,69 @@ class AIAgent:
         except Exception as e:
             logger.error(f"Erro no agent para {telefone[:8]}: {e}")
             return "Ops, tive um problema tecnico. Pode tentar novamente em alguns segundos?"
+
+        finally:
+            # Respostas do turno num lote: vão para a fila do gravador em background
+            # (a resposta não espera o commit no Postgres)
+            if turno:
+                self.history_manager.save_messages(telefone, turno)
+
+    async def _executar_tool_calls(
+        self,
+        tool_calls: List[dict],
+        telefone: str,
+        memo: Optional[Dict[Tuple[str, bytes], asyncio.Future]] = None,
+    ) -> List[str]:
+        """
+        Executa as tool calls (formato OpenAI, dicts) de uma resposta do modelo.
+
+        Sequências de tools de leitura (FERRAMENTAS_LEITURA) rodam em paralelo;
+        uma tool que altera estado espera as anteriores e bloqueia as seguintes,
+        preservando a ordem (ex: add_to_cart antes de view_cart).
+
+        Leituras repetidas com os mesmos argumentos reaproveitam o resultado
+        guardado em `memo` (compartilhado entre as iterações do turno). Qualquer
+        tool que altera estado limpa o memo, pois pode mudar essas leituras.
+
+        Returns:
+            Resultados (JSON string) na mesma ordem de `tool_calls`
+        """
+        if memo is None:
+            memo = {}
+        results: List[str] = []
+        leituras: List[asyncio.Future] = []
+
+        for tool_call in tool_calls:
+            function_name = tool_call["function"]["name"]
+            try:
+                arguments = orjson.loads(tool_call["function"]["arguments"] or "{}")
+            except orjson.JSONDecodeError:
+                arguments = {}
+
+            logger.info(f"Tool call: {function_name}({orjson.dumps(arguments).decode()[:200]})")
+
+            if function_name in FERRAMENTAS_LEITURA:
+                chave = (function_name, orjson.dumps(arguments, option=orjson.OPT_SORT_KEYS))
+                leitura = memo.get(chave)
+                if leitura is None:
+                    leitura = asyncio.ensure_future(
+                        self.tool_executor.execute(function_name, arguments, telefone)
+                    )
+                    memo[chave] = leitura
+                else:
+                    logger.debug(f"Tool {function_name} repetida: reaproveitando resultado")
+                leituras.append(leitura)
+                continue
+
+            if leituras:
+                results.extend(await asyncio.gather(*leituras))
+                leituras = []
+            memo.clear()
+            results.append(
+                await self.tool_executor.execute(function_name, arguments, telefone)
+            )
+
+        if leituras:
+            results.extend(await asyncio.gather(*leituras))
+
+        return results
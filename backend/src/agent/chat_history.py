@@ -2,53 +2,277 @@
 Chat History Manager: Memória conversacional persistente no Postgres.
 Armazena mensagens em formato OpenAI para replay exato no agente.
 """
+import io
 import os
-import json
-from typing import List, Dict, Any, Optional
+import queue
+import struct
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Iterable, List, Dict, Any, Optional
 from datetime import datetime, timezone
+import orjson
 from loguru import logger
 import psycopg2
-from psycopg2 import pool
-from psycopg2.extras import RealDictCursor
-from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
-
+from psycopg2 import extensions, pool
+from psycopg2.extras import Json, execute_values, register_default_jsonb
+
+from ..utils.db import get_database_url, usa_pooler_transacao
+
+# Máximo de conexões do pool (gravações do histórico rodam em threads)
+PG_POOL_MAX = int(os.getenv("PG_POOL_MAX", "10"))
+
+# Cache do histórico carregado, por telefone (segundos; 0 desativa)
+HISTORICO_CACHE_TTL = float(os.getenv("HISTORICO_CACHE_TTL", "60"))
+HISTORICO_CACHE_MAX = 1024
+
+# Gravador em background: junta as mensagens que chegam em até
+# GRAVACAO_JANELA segundos (no máximo GRAVACAO_LOTE_MAX linhas) num INSERT
+GRAVACAO_JANELA = 0.05
+GRAVACAO_LOTE_MAX = 100
+GRAVACAO_FILA_MAX = 10_000
+
+# Conjunto em memória dos telefones com histórico (opcional,
+# HISTORICO_FILTRO_TELEFONES=1): para telefone fora do conjunto, só uma
+# verificação de existência no índice, sem a consulta do histórico. O
+# conjunto não vê gravações de outras instâncias (réplicas, redeploy), por
+# isso a ausência é sempre confirmada no banco. Acima de
+# FILTRO_TELEFONES_MAX telefones o filtro se desliga (memória limitada)
+FILTRO_TELEFONES = os.getenv("HISTORICO_FILTRO_TELEFONES", "0") == "1"
+FILTRO_TELEFONES_MAX = 200_000
+
+_SQL_TEM_HISTORICO = "SELECT 1 FROM chat_history WHERE telefone = %s LIMIT 1"
+
+# Telefones distintos via "loose index scan" em idx_chat_history_phone_time:
+# um salto no índice por telefone, em vez de ler a tabela toda (DISTINCT)
+_SQL_TELEFONES = """
+    WITH RECURSIVE t AS (
+        SELECT min(telefone) AS telefone FROM chat_history
+        UNION ALL
+        SELECT (SELECT min(telefone) FROM chat_history WHERE telefone > t.telefone)
+        FROM t WHERE t.telefone IS NOT NULL
+    )
+    SELECT telefone FROM t WHERE telefone IS NOT NULL
+"""
 
-DROP_QS_KEYS = {"pgbouncer", "connection_limit"}
+# Prepared statements por conexão (desligados automaticamente no pooler em
+# modo transação, que não os suporta; PG_PREPARE=0 desliga sempre)
+PG_PREPARE = os.getenv("PG_PREPARE", "1") != "0"
+
+# Desempate por id (BIGSERIAL): linhas do mesmo INSERT em lote têm o mesmo
+# created_at onde a coluna ainda usa DEFAULT NOW() (e clock_timestamp() pode
+# empatar no microssegundo); a ordem de replay tem de ser a de gravação
+_SQL_HISTORICO = """
+    SELECT role, content, tool_calls, tool_call_id, name, created_at
+    FROM chat_history
+    WHERE telefone = %s
+    ORDER BY created_at DESC, id DESC
+    LIMIT %s
+"""
 
+_SQL_ULTIMA_MSG_USUARIO = """
+    SELECT created_at
+    FROM chat_history
+    WHERE telefone = %s AND role = 'user'
+    ORDER BY created_at DESC, id DESC
+    LIMIT 1
+"""
 
-def _sanitize_dsn(database_url: str) -> str:
-    u = urlparse(database_url)
-    qs = dict(parse_qsl(u.query, keep_blank_values=True))
-    for k in list(qs.keys()):
-        if k in DROP_QS_KEYS:
-            qs.pop(k, None)
-    new_query = urlencode(qs, doseq=True)
-    return urlunparse((u.scheme, u.netloc, u.path, u.params, new_query, u.fragment))
+# nome -> (tipos dos parâmetros, SQL com %s)
+_CONSULTAS_PREPARADAS = {
+    "ch_load": ("text, integer", _SQL_HISTORICO),
+    "ch_last_user": ("text", _SQL_ULTIMA_MSG_USUARIO),
+}
+
+
+def _orjson_dumps(obj: Any) -> str:
+    """Serializador JSON (orjson) para psycopg2.extras.Json."""
+    return orjson.dumps(obj).decode()
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("o200k_base")  # tokenizer da família gpt-4.1/4o
+except Exception:  # tiktoken é opcional: sem ele, estimativa por caracteres
+    _ENCODING = None
+
+
+@dataclass
+class LoadResult:
+    """Histórico carregado + horário da última mensagem do usuário."""
+    messages: List[Dict[str, Any]] = field(default_factory=list)
+    # created_at da mensagem 'user' mais recente entre as linhas lidas
+    # (None se não houver nenhuma nelas)
+    last_user_ts: Optional[datetime] = None
+
+
+def contar_tokens(texto: Optional[str]) -> int:
+    """Conta tokens com tiktoken, ou estima ~4 caracteres por token sem ele."""
+    if not texto:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(texto))
+    return len(texto) // 4 + 1
+
+
+def _tokens_mensagem(msg: Dict[str, Any]) -> int:
+    """Tokens de uma mensagem no formato OpenAI (conteúdo + argumentos de tools)."""
+    total = 4  # overhead aproximado por mensagem (role, separadores)
+    total += contar_tokens(msg.get("content"))
+    for tc in msg.get("tool_calls") or ():
+        funcao = tc.get("function", {})
+        total += contar_tokens(funcao.get("name")) + contar_tokens(funcao.get("arguments"))
+    return total
+
+
+# Colunas gravadas por bulk_load (COPY binário), na ordem das tuplas
+_COLUNAS_COPY = (
+    "telefone", "role", "content", "tool_calls", "tool_call_id",
+    "name", "media_type", "media_url", "created_at",
+)
+
+# Formato binário do COPY: assinatura + flags + extensão do cabeçalho; -1 no fim
+_COPY_CABECALHO = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+_COPY_TRAILER = struct.pack(">h", -1)
+_EPOCH_PG = datetime(2000, 1, 1, tzinfo=timezone.utc)
+
+
+def _copy_binario(linhas: Iterable[tuple]) -> io.BytesIO:
+    """
+    Codifica linhas (na ordem de _COLUNAS_COPY) no formato binário do COPY.
+
+    Colunas de texto viram UTF-8; tool_calls (jsonb) é o JSON precedido do
+    byte de versão 1; created_at (timestamptz) são microssegundos desde
+    2000-01-01 UTC (datetime sem fuso é tratado como UTC).
+    """
+    buf = io.BytesIO()
+    buf.write(_COPY_CABECALHO)
+    pack_campo = struct.Struct(">i").pack
+    for linha in linhas:
+        buf.write(struct.pack(">h", len(_COLUNAS_COPY)))
+        *textos, created_at = linha
+        for i, valor in enumerate(textos):
+            if valor is None:
+                buf.write(pack_campo(-1))
+                continue
+            if i == 3:  # tool_calls (jsonb)
+                dados = b"\x01" + orjson.dumps(valor)
+            else:
+                dados = valor.encode()
+            buf.write(pack_campo(len(dados)))
+            buf.write(dados)
+        if created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        delta = created_at - _EPOCH_PG
+        micros = (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+        buf.write(struct.pack(">iq", 8, micros))
+    buf.write(_COPY_TRAILER)
+    buf.seek(0)
+    return buf
+
+
+class _ConexaoHistorico(extensions.connection):
+    """
+    Conexão do histórico: lembra se as consultas já foram preparadas nela e
+    decodifica jsonb (tool_calls) com orjson. O registro vale só para esta
+    conexão; as demais do processo seguem com o json da stdlib.
+    """
+    # None: ainda não verificada; False: sem prepared statements
+    preparada: Optional[bool] = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # A gravação usa Json(..., dumps=_orjson_dumps)
+        register_default_jsonb(conn_or_curs=self, loads=orjson.loads)
 
 
 class ChatHistoryManager:
     """Gerencia histórico de chat no Postgres."""
 
     def __init__(self):
-        db_url = os.getenv("DIRECT_URL") or os.getenv("DATABASE_URL")
-        if db_url:
-            self.db_url = _sanitize_dsn(db_url)
+        # telefone -> (expira_em, limit, mensagens, last_user_ts)
+        self._cache_historico: "OrderedDict[str, tuple]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+        # (telefone, linhas) a gravar pela thread do gravador
+        self._fila: "queue.Queue[Optional[tuple]]" = queue.Queue(maxsize=GRAVACAO_FILA_MAX)
+        self._gravador: Optional[threading.Thread] = None
+
+        # Telefones com histórico; só é usado depois de carregado do banco
+        self._telefones_conhecidos: set = set()
+        self._telefones_prontos = False
+
+        self.db_url = get_database_url()
+        if self.db_url:
             try:
                 self._pool = pool.ThreadedConnectionPool(
                     minconn=1,
-                    maxconn=5,
+                    maxconn=PG_POOL_MAX,
                     dsn=self.db_url,
                     sslmode="require",
+                    connection_factory=_ConexaoHistorico,
                 )
-                logger.info("Connection pool Postgres criado (1-5 conexoes)")
+                logger.info(f"Connection pool Postgres criado (1-{PG_POOL_MAX} conexoes)")
             except Exception as e:
                 logger.error(f"Erro ao criar pool: {e}")
                 self._pool = None
         else:
-            self.db_url = None
             self._pool = None
             logger.warning("Sem DATABASE_URL - historico desabilitado")
 
+        if self.db_url:
+            self._iniciar_gravador()
+            if FILTRO_TELEFONES:
+                threading.Thread(
+                    target=self._carregar_telefones, name="chat-history-phones", daemon=True
+                ).start()
+
+    def _carregar_telefones(self):
+        """Carrega (em background) os telefones que já têm histórico."""
+        try:
+            with self._conn() as conn:
+                if not conn:
+                    return
+                with conn.cursor() as cursor:
+                    cursor.execute(_SQL_TELEFONES)
+                    telefones = [row[0] for row in cursor.fetchall()]
+                conn.rollback()
+        except Exception as e:
+            logger.warning(f"Nao foi possivel carregar telefones do historico: {e}")
+            return
+        # Gravações feitas durante a carga já foram adicionadas ao conjunto
+        self._telefones_prontos = True
+        self._lembrar_telefones(telefones)
+        logger.info(f"Historico: {len(telefones)} telefones conhecidos")
+
+    def _lembrar_telefones(self, telefones: Iterable[str]):
+        """Acrescenta telefones ao filtro; desliga o filtro se passar do limite."""
+        if not FILTRO_TELEFONES:
+            return
+        self._telefones_conhecidos.update(telefones)
+        if len(self._telefones_conhecidos) > FILTRO_TELEFONES_MAX:
+            logger.warning("Historico: filtro de telefones desligado (limite de memoria)")
+            self._telefones_prontos = False
+            self._telefones_conhecidos = set()
+
+    def _tem_historico(self, telefone: str) -> bool:
+        """Confirma no banco se o telefone tem mensagens (erro conta como sim)."""
+        try:
+            with self._conn() as conn:
+                if not conn:
+                    return False
+                with conn.cursor() as cursor:
+                    cursor.execute(_SQL_TEM_HISTORICO, (telefone,))
+                    tem = cursor.fetchone() is not None
+                conn.rollback()
+        except Exception as e:
+            logger.warning(f"Erro ao verificar historico: {e}")
+            return True
+        if tem:
+            self._lembrar_telefones((telefone,))
+        return tem
+
     def _get_connection(self):
         if self._pool:
             try:
@@ -58,7 +282,9 @@ class ChatHistoryManager:
         # Fallback: conexão direta
         if self.db_url:
             try:
-                return psycopg2.connect(self.db_url, sslmode="require")
+                return psycopg2.connect(
+                    self.db_url, sslmode="require", connection_factory=_ConexaoHistorico
+                )
             except Exception as e:
                 logger.error(f"Erro ao conectar diretamente: {e}")
         return None
@@ -77,67 +303,237 @@ class ChatHistoryManager:
         except Exception:
             pass
 
-    def load_history(self, telefone: str, limit: int = 30) -> List[Dict[str, Any]]:
+    @contextmanager
+    def _conn(self):
         """
-        Carrega últimas N mensagens em formato OpenAI.
-        Reconstrói tool_calls e tool responses no formato correto.
+        Empresta uma conexão (None se indisponível) e sempre a devolve ao pool.
+        Em caso de erro, desfaz a transação antes de devolver.
         """
         conn = self._get_connection()
-        if not conn:
-            return []
-
+        if conn is not None and getattr(conn, "preparada", False) is None:
+            self._preparar(conn)
         try:
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute(
-                """
-                SELECT role, content, tool_calls, tool_call_id, name
-                FROM chat_history
-                WHERE telefone = %s
-                ORDER BY created_at DESC
-                LIMIT %s
-                """,
-                (telefone, limit),
-            )
-            rows = cursor.fetchall()
-            cursor.close()
+            yield conn
+        except Exception:
+            if conn:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+            raise
+        finally:
             self._put_connection(conn)
 
-            # Reverter ordem (DESC -> cronológica)
-            rows.reverse()
-
-            messages = []
-            for row in rows:
-                msg = {"role": row["role"]}
-
-                if row["role"] == "assistant" and row["tool_calls"]:
-                    # Mensagem de assistant com tool_calls
-                    if row["content"]:
-                        msg["content"] = row["content"]
-                    else:
-                        msg["content"] = None
-                    msg["tool_calls"] = row["tool_calls"]
-                elif row["role"] == "tool":
-                    # Resposta de tool
-                    msg["content"] = row["content"] or ""
-                    msg["tool_call_id"] = row["tool_call_id"] or ""
-                    if row["name"]:
-                        msg["name"] = row["name"]
-                else:
-                    # user ou assistant normal
-                    msg["content"] = row["content"] or ""
+    @staticmethod
+    def _preparar(conn):
+        """
+        Prepara as consultas quentes (PREPARE) na primeira vez que a conexão
+        é usada: o Postgres faz parse/plan uma vez por conexão e as chamadas
+        seguintes só enviam os parâmetros (EXECUTE).
+        """
+        conn.preparada = False
+        if not PG_PREPARE or usa_pooler_transacao(conn):
+            return
+        try:
+            with conn.cursor() as cursor:
+                for nome, (tipos, sql) in _CONSULTAS_PREPARADAS.items():
+                    partes = sql.split("%s")
+                    numerada = partes[0] + "".join(
+                        f"${i}{parte}" for i, parte in enumerate(partes[1:], 1)
+                    )
+                    cursor.execute(f"PREPARE {nome} ({tipos}) AS {numerada}")
+            conn.commit()
+            conn.preparada = True
+        except Exception as e:
+            logger.warning(f"Prepared statements indisponiveis: {e}")
+            try:
+                conn.rollback()
+            except Exception:
+                pass
 
-                messages.append(msg)
+    @staticmethod
+    def _executar(conn, cursor, nome: str, params: tuple):
+        """Executa uma consulta de _CONSULTAS_PREPARADAS (EXECUTE se preparada)."""
+        if getattr(conn, "preparada", False):
+            marcadores = ", ".join(["%s"] * len(params))
+            cursor.execute(f"EXECUTE {nome} ({marcadores})", params)
+        else:
+            cursor.execute(_CONSULTAS_PREPARADAS[nome][1], params)
 
-            # Sanitizar: garantir que toda msg 'tool' tenha um 'assistant' com tool_calls antes
-            messages = self._sanitize_messages(messages)
+    def close(self):
+        """
+        Grava o que restou na fila e fecha todas as conexões do pool
+        (shutdown da aplicação).
+        """
+        if self._gravador is not None:
+            self._fila.put(None)
+            self._gravador.join(timeout=10)
+            self._gravador = None
+        if self._pool:
+            self._pool.closeall()
+            self._pool = None
 
-            return messages
+    def load_history(
+        self, telefone: str, limit: int = 30, max_tokens: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Carrega últimas N mensagens em formato OpenAI.
+        Reconstrói tool_calls e tool responses no formato correto.
 
-        except Exception as e:
-            logger.error(f"Erro ao carregar historico: {e}")
-            if conn:
-                self._put_connection(conn)
-            return []
+        Com max_tokens, mantém só as mensagens mais recentes que cabem no
+        orçamento (resultados grandes de tools não estouram o contexto).
+        """
+        return self.load_history_with_meta(telefone, limit, max_tokens).messages
+
+    def load_history_with_meta(
+        self, telefone: str, limit: int = 30, max_tokens: Optional[int] = None
+    ) -> LoadResult:
+        """
+        Como load_history, mas também devolve o created_at da última mensagem
+        do usuário, lido na mesma consulta (dispensa get_last_message_time).
+
+        As linhas lidas ficam em cache por telefone (HISTORICO_CACHE_TTL);
+        save_messages acrescenta as mensagens gravadas ao cache (write-through),
+        então o turno seguinte do mesmo cliente normalmente não consulta o banco.
+        """
+        if (
+            self._telefones_prontos
+            and telefone not in self._telefones_conhecidos
+            and not self._tem_historico(telefone)
+        ):
+            # Cliente sem nenhuma mensagem gravada: nada a carregar
+            return LoadResult()
+
+        agora = time.monotonic()
+        messages = None
+        with self._cache_lock:
+            em_cache = self._cache_historico.get(telefone)
+            if em_cache and em_cache[0] > agora and em_cache[1] >= limit:
+                self._cache_historico.move_to_end(telefone)
+                messages = em_cache[2][-limit:]
+                last_user_ts = em_cache[3]
+
+        if messages is None:
+            try:
+                with self._conn() as conn:
+                    if not conn:
+                        return LoadResult()
+                    with conn.cursor() as cursor:
+                        self._executar(conn, cursor, "ch_load", (telefone, limit))
+                        rows = cursor.fetchmany(limit)
+            except Exception as e:
+                logger.error(f"Erro ao carregar historico: {e}")
+                return LoadResult()
+
+            # Linhas em ordem DESC: a primeira 'user' é a mais recente
+            last_user_ts = next((row[5] for row in rows if row[0] == "user"), None)
+
+            # Linhas DESC -> mensagens em ordem cronológica
+            messages = [
+                self._row_to_msg(role, content, tool_calls, tool_call_id, name)
+                for role, content, tool_calls, tool_call_id, name, _ in reversed(rows)
+            ]
+
+            with self._cache_lock:
+                self._cache_historico[telefone] = (
+                    agora + HISTORICO_CACHE_TTL, limit, list(messages), last_user_ts
+                )
+                self._cache_historico.move_to_end(telefone)
+                while len(self._cache_historico) > HISTORICO_CACHE_MAX:
+                    self._cache_historico.popitem(last=False)
+
+        if max_tokens is not None:
+            messages = self._limitar_tokens(messages, max_tokens)
+
+        # Sanitizar: garantir que toda msg 'tool' tenha um 'assistant' com tool_calls antes
+        messages = self._sanitize_messages(messages)
+
+        return LoadResult(messages=messages, last_user_ts=last_user_ts)
+
+    @staticmethod
+    def _row_to_msg(
+        role: str,
+        content: Optional[str],
+        tool_calls: Optional[List[Dict]],
+        tool_call_id: Optional[str],
+        name: Optional[str],
+    ) -> Dict[str, Any]:
+        """
+        Converte as colunas de uma linha de chat_history para o formato OpenAI.
+        Reconstrói tool_calls e tool responses.
+        """
+        msg = {"role": role}
+
+        if role == "assistant" and tool_calls:
+            # Mensagem de assistant com tool_calls: content é opcional na API
+            # e só vai quando houver texto
+            if content:
+                msg["content"] = content
+            msg["tool_calls"] = tool_calls
+        elif role == "tool":
+            # Resposta de tool (content e tool_call_id são obrigatórios na API)
+            msg["content"] = content or ""
+            msg["tool_call_id"] = tool_call_id or ""
+            if name:
+                msg["name"] = name
+        else:
+            # user ou assistant normal
+            msg["content"] = content or ""
+
+        return msg
+
+    def _atualizar_cache(self, telefone: str, mensagens: List[Dict[str, Any]]):
+        """Acrescenta mensagens recém-gravadas ao histórico em cache (se houver)."""
+        with self._cache_lock:
+            em_cache = self._cache_historico.get(telefone)
+            if not em_cache:
+                return
+            _, limite, cacheadas, last_user_ts = em_cache
+            novas = [
+                self._row_to_msg(
+                    m["role"], m.get("content"), m.get("tool_calls"),
+                    m.get("tool_call_id"), m.get("name"),
+                )
+                for m in mensagens
+            ]
+            cacheadas = (cacheadas + novas)[-limite:]
+            if any(m["role"] == "user" for m in mensagens):
+                last_user_ts = datetime.now(timezone.utc)
+            self._cache_historico[telefone] = (
+                time.monotonic() + HISTORICO_CACHE_TTL, limite, cacheadas, last_user_ts
+            )
+            self._cache_historico.move_to_end(telefone)
+
+    def limpar_cache(self, telefone: Optional[str] = None):
+        """Descarta o histórico em cache de um telefone (ou de todos)."""
+        with self._cache_lock:
+            if telefone is None:
+                self._cache_historico.clear()
+            else:
+                self._cache_historico.pop(telefone, None)
+
+    @staticmethod
+    def _limitar_tokens(
+        messages: List[Dict[str, Any]], max_tokens: int
+    ) -> List[Dict[str, Any]]:
+        """
+        Mantém as mensagens mais recentes cuja soma de tokens cabe em max_tokens.
+        Pares tool_calls/tool cortados ao meio são removidos pela sanitização.
+        """
+        total = 0
+        inicio = len(messages)
+        for i in range(len(messages) - 1, -1, -1):
+            total += _tokens_mensagem(messages[i])
+            if total > max_tokens:
+                break
+            inicio = i
+
+        if inicio:
+            logger.debug(
+                f"Historico limitado a {max_tokens} tokens: "
+                f"{len(messages)} -> {len(messages) - inicio} mensagens"
+            )
+        return messages[inicio:]
 
     @staticmethod
     def _sanitize_messages(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
@@ -148,52 +544,49 @@ class ChatHistoryManager:
         - Toda mensagem role='tool' DEVE ser precedida por um assistant com tool_calls
         - Se uma tool msg esta orfa (sem assistant+tool_calls antes), remove ela
         - Se um assistant com tool_calls nao tem tool responses depois, remove ele
+          (e as tool responses parciais dele)
         """
         if not messages:
             return messages
 
-        # Coletar IDs de tool_calls existentes nos assistants
-        valid_tool_call_ids = set()
-        for msg in messages:
-            if msg.get("role") == "assistant" and msg.get("tool_calls"):
-                for tc in msg["tool_calls"]:
-                    tc_id = tc.get("id", "")
-                    if tc_id:
-                        valid_tool_call_ids.add(tc_id)
-
-        # Primeira passada: remover tool messages orfas
-        cleaned = []
+        # Passada de trás para frente: um assistant com tool_calls é aceito se
+        # TODAS as suas tool_calls têm resposta depois dele
+        respondidos = set()
+        aceitos = set()
+        rejeitados = 0
+        for msg in reversed(messages):
+            role = msg.get("role")
+            if role == "tool":
+                respondidos.add(msg.get("tool_call_id", ""))
+            elif role == "assistant" and msg.get("tool_calls"):
+                ids = [tc.get("id", "") for tc in msg["tool_calls"]]
+                if all(tid in respondidos for tid in ids):
+                    aceitos.update(ids)
+                else:
+                    rejeitados += 1
+
+        # Caso comum: nada a remover, devolve a própria lista sem reconstruir
+        if not rejeitados and respondidos <= aceitos:
+            return messages
+
+        # Passada única de reconstrução: tools só de assistants aceitos
+        final = []
         for msg in messages:
-            if msg.get("role") == "tool":
+            role = msg.get("role")
+            if role == "tool":
                 tool_call_id = msg.get("tool_call_id", "")
-                if tool_call_id in valid_tool_call_ids:
-                    cleaned.append(msg)
+                if tool_call_id in aceitos:
+                    final.append(msg)
                 else:
                     logger.warning(
                         f"Removendo tool msg orfa (tool_call_id={tool_call_id})"
                     )
-            else:
-                cleaned.append(msg)
-
-        # Segunda passada: verificar que assistant+tool_calls tem tool responses
-        # Coletar IDs de tool responses presentes
-        present_tool_ids = set()
-        for msg in cleaned:
-            if msg.get("role") == "tool":
-                present_tool_ids.add(msg.get("tool_call_id", ""))
-
-        final = []
-        for msg in cleaned:
-            if msg.get("role") == "assistant" and msg.get("tool_calls"):
-                # Verificar se TODAS as tool_calls tem responses
-                all_ids = [tc.get("id", "") for tc in msg["tool_calls"]]
-                if all(tid in present_tool_ids for tid in all_ids):
+            elif role == "assistant" and msg.get("tool_calls"):
+                if all(tc.get("id", "") in aceitos for tc in msg["tool_calls"]):
                     final.append(msg)
                 else:
                     # Converter para assistant simples (sem tool_calls)
-                    logger.warning(
-                        f"Removendo tool_calls orfos de assistant msg"
-                    )
+                    logger.warning("Removendo tool_calls orfos de assistant msg")
                     if msg.get("content"):
                         final.append({"role": "assistant", "content": msg["content"]})
                     # Se nao tem content, simplesmente remove
@@ -219,62 +612,209 @@ class ChatHistoryManager:
         media_url: Optional[str] = None,
     ):
         """Salva uma mensagem no histórico."""
-        conn = self._get_connection()
-        if not conn:
+        self.save_messages(telefone, [{
+            "role": role,
+            "content": content,
+            "tool_calls": tool_calls,
+            "tool_call_id": tool_call_id,
+            "name": name,
+            "media_type": media_type,
+            "media_url": media_url,
+        }])
+
+    def save_messages(self, telefone: str, mensagens: List[Dict[str, Any]]):
+        """
+        Salva várias mensagens no histórico.
+
+        Cada item usa as mesmas chaves dos argumentos de save_message
+        (role obrigatório). A ordem da lista é a ordem de replay: as linhas
+        são inseridas nessa ordem e a leitura desempata created_at pelo id.
+
+        Com banco configurado, as linhas vão para a fila do gravador em
+        background (não espera o commit); o cache do histórico é atualizado
+        na hora, então a leitura seguinte já vê as mensagens.
+        """
+        if not mensagens:
             return
 
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                """
-                INSERT INTO chat_history
-                    (telefone, role, content, tool_calls, tool_call_id, name, media_type, media_url)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                """,
-                (
-                    telefone,
-                    role,
-                    content,
-                    json.dumps(tool_calls) if tool_calls else None,
-                    tool_call_id,
-                    name,
-                    media_type,
-                    media_url,
-                ),
+        linhas = [
+            (
+                telefone,
+                m["role"],
+                m.get("content"),
+                Json(m["tool_calls"], dumps=_orjson_dumps) if m.get("tool_calls") else None,
+                m.get("tool_call_id"),
+                m.get("name"),
+                m.get("media_type") or "text",
+                m.get("media_url"),
             )
-            conn.commit()
-            cursor.close()
-            self._put_connection(conn)
+            for m in mensagens
+        ]
+
+        self._lembrar_telefones((telefone,))
+
+        if self._gravador is not None:
+            self._atualizar_cache(telefone, mensagens)
+            try:
+                self._fila.put_nowait((telefone, linhas))
+                return
+            except queue.Full:
+                logger.warning("Fila de gravacao do historico cheia, gravando direto")
+            self._inserir_linhas(linhas)
+            return
+
+        if self._inserir_linhas(linhas):
+            self._atualizar_cache(telefone, mensagens)
+
+    def _inserir_linhas(self, linhas: List[tuple]) -> bool:
+        """
+        Grava as linhas num único INSERT multi-VALUES e um commit.
+        Em caso de erro, descarta o cache dos telefones envolvidos.
+        """
+        try:
+            with self._conn() as conn:
+                if not conn:
+                    return False
+                with conn.cursor() as cursor:
+                    execute_values(
+                        cursor,
+                        """
+                        INSERT INTO chat_history
+                            (telefone, role, content, tool_calls, tool_call_id, name, media_type, media_url)
+                        VALUES %s
+                        """,
+                        linhas,
+                        page_size=100,
+                    )
+                conn.commit()
+            return True
         except Exception as e:
-            logger.error(f"Erro ao salvar mensagem: {e}")
-            if conn:
+            logger.error(f"Erro ao salvar mensagens: {e}")
+            for telefone in {linha[0] for linha in linhas}:
+                self.limpar_cache(telefone)
+            return False
+
+    def _iniciar_gravador(self):
+        """Sobe a thread que grava a fila de mensagens em lotes."""
+        self._gravador = threading.Thread(
+            target=self._loop_gravacao, name="chat-history-writer", daemon=True
+        )
+        self._gravador.start()
+
+    def _loop_gravacao(self):
+        """
+        Espera mensagens na fila e grava em lotes: junta o que chegar em até
+        GRAVACAO_JANELA segundos (ou GRAVACAO_LOTE_MAX linhas) num só INSERT.
+        None na fila encerra a thread depois de gravar o lote atual.
+        """
+        parar = False
+        while not parar:
+            item = self._fila.get()
+            if item is None:
+                self._fila.task_done()
+                break
+
+            linhas = list(item[1])
+            lidos = 1
+            limite = time.monotonic() + GRAVACAO_JANELA
+            while len(linhas) < GRAVACAO_LOTE_MAX:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
                 try:
-                    conn.rollback()
-                    self._put_connection(conn)
-                except Exception:
-                    pass
+                    item = self._fila.get(timeout=restante)
+                except queue.Empty:
+                    break
+                lidos += 1
+                if item is None:
+                    parar = True
+                    break
+                linhas.extend(item[1])
+
+            try:
+                self._inserir_linhas(linhas)
+            finally:
+                for _ in range(lidos):
+                    self._fila.task_done()
+
+    def flush(self):
+        """Espera o gravador em background esvaziar a fila."""
+        if self._gravador is not None:
+            self._fila.join()
+
+    def bulk_load(self, mensagens: Iterable[Dict[str, Any]]) -> int:
+        """
+        Importação em massa de histórico (ex: conversas vindas do n8n) via
+        COPY binário, bem mais rápido que INSERT para milhares de linhas.
+
+        Cada item tem telefone, role e created_at (preserva a ordem original;
+        sem ele, usa o horário atual) e as demais chaves de save_message.
+        Se o COPY falhar (ex: pooler sem suporte), grava com execute_values.
+        Não passa pelo cache nem pela fila do gravador.
+
+        Returns:
+            Número de linhas gravadas
+        """
+        linhas = [
+            (
+                m["telefone"],
+                m["role"],
+                m.get("content"),
+                m.get("tool_calls") or None,
+                m.get("tool_call_id"),
+                m.get("name"),
+                m.get("media_type") or "text",
+                m.get("media_url"),
+                m.get("created_at") or datetime.now(timezone.utc),
+            )
+            for m in mensagens
+        ]
+        if not linhas:
+            return 0
+
+        colunas = ", ".join(_COLUNAS_COPY)
+        with self._conn() as conn:
+            if not conn:
+                return 0
+            try:
+                with conn.cursor() as cursor:
+                    cursor.copy_expert(
+                        f"COPY chat_history ({colunas}) FROM STDIN WITH (FORMAT BINARY)",
+                        _copy_binario(linhas),
+                    )
+            except Exception as e:
+                logger.warning(f"COPY binario falhou, gravando com INSERT: {e}")
+                conn.rollback()
+                with conn.cursor() as cursor:
+                    execute_values(
+                        cursor,
+                        f"INSERT INTO chat_history ({colunas}) VALUES %s",
+                        [
+                            (
+                                *linha[:3],
+                                Json(linha[3], dumps=_orjson_dumps) if linha[3] else None,
+                                *linha[4:],
+                            )
+                            for linha in linhas
+                        ],
+                        page_size=1000,
+                    )
+            conn.commit()
+
+        self.limpar_cache()
+        self._lembrar_telefones(linha[0] for linha in linhas)
+        logger.info(f"Historico importado: {len(linhas)} mensagens")
+        return len(linhas)
 
     def get_last_message_time(self, telefone: str) -> Optional[datetime]:
         """Retorna timestamp da última mensagem (para detecção de nova conversa)."""
-        conn = self._get_connection()
-        if not conn:
-            return None
-
         try:
-            cursor = conn.cursor()
-            cursor.execute(
-                """
-                SELECT created_at
-                FROM chat_history
-                WHERE telefone = %s AND role = 'user'
-                ORDER BY created_at DESC
-                LIMIT 1
-                """,
-                (telefone,),
-            )
-            row = cursor.fetchone()
-            cursor.close()
-            self._put_connection(conn)
+            with self._conn() as conn:
+                if not conn:
+                    return None
+                with conn.cursor() as cursor:
+                    self._executar(conn, cursor, "ch_last_user", (telefone,))
+                    row = cursor.fetchone()
 
             if row:
                 return row[0]
@@ -282,19 +822,26 @@ class ChatHistoryManager:
 
         except Exception as e:
             logger.error(f"Erro ao buscar ultima mensagem: {e}")
-            if conn:
-                self._put_connection(conn)
             return None
 
-    def is_new_conversation(self, telefone: str, timeout_minutes: int = 30) -> bool:
-        """Verifica se é uma nova conversa (>timeout_minutes sem mensagens)."""
-        last_time = self.get_last_message_time(telefone)
+    def is_new_conversation(
+        self,
+        telefone: str,
+        timeout_minutes: int = 30,
+        last_time: Optional[datetime] = None,
+    ) -> bool:
+        """
+        Verifica se é uma nova conversa (>timeout_minutes sem mensagens).
+
+        Quem já carregou o histórico passa last_time (LoadResult.last_user_ts)
+        e evita a consulta extra ao banco.
+        """
+        if last_time is None:
+            last_time = self.get_last_message_time(telefone)
         if not last_time:
             return True
 
-        now = datetime.now(timezone.utc)
         if last_time.tzinfo is None:
             last_time = last_time.replace(tzinfo=timezone.utc)
 
-        delta = (now - last_time).total_seconds()
-        return delta > (timeout_minutes * 60)
+        return time.time() - last_time.timestamp() > timeout_minutes * 60
@@ -2,32 +2,37 @@
 Definições de Tools para OpenAI Function Calling.
 Cada tool é um dict seguindo o schema OpenAI tools.
 """
-from typing import List, Dict
+from typing import Any, Dict, Tuple, TypedDict
 
 
-def get_tool_definitions() -> List[Dict]:
-    """Retorna lista de definições de tools OpenAI."""
-    return [
-        BUSCAR_PRODUTOS,
-        ADD_TO_CART,
-        REMOVER_DO_CARRINHO,
-        ALTERAR_QUANTIDADE,
-        VIEW_CART,
-        LIMPAR_CARRINHO,
-        GERAR_PIX,
-        GERAR_PAGAMENTO,
-        ENVIAR_QR_CODE_PIX,
-        ENVIAR_FOTO_PRODUTO,
-        CALCULAR_FRETE,
-        CONFIRMAR_FRETE,
-        SALVAR_ENDERECO,
-        BUSCAR_HISTORICO_COMPRAS,
-        VERIFICAR_STATUS_PEDIDO,
-        ESCALAR_ATENDIMENTO,
-    ]
+class FunctionDef(TypedDict):
+    """Função descrita para o modelo (nome, descrição e JSON Schema dos argumentos)."""
+    name: str
+    description: str
+    parameters: Dict[str, Any]
 
 
-BUSCAR_PRODUTOS = {
+class ToolDef(TypedDict):
+    """Definição de tool no formato OpenAI tools."""
+    type: str
+    function: FunctionDef
+
+# Parâmetros das tools sem argumentos (o telefone é injetado pelo executor).
+# Compartilhado entre as definições: não modifique
+_EMPTY_PARAMS: Dict = {"type": "object", "properties": {}}
+
+
+def get_tool_definitions() -> Tuple[ToolDef, ...]:
+    """
+    Retorna as definições de tools OpenAI.
+
+    A tupla é montada uma única vez no import e compartilhada: não modifique
+    os dicts retornados.
+    """
+    return _TOOL_DEFINITIONS
+
+
+BUSCAR_PRODUTOS: ToolDef = {
     "type": "function",
     "function": {
         "name": "buscar_produtos",
@@ -50,7 +55,7 @@ BUSCAR_PRODUTOS = {
     },
 }
 
-ADD_TO_CART = {
+ADD_TO_CART: ToolDef = {
     "type": "function",
     "function": {
         "name": "add_to_cart",
@@ -81,7 +86,7 @@ ADD_TO_CART = {
     },
 }
 
-REMOVER_DO_CARRINHO = {
+REMOVER_DO_CARRINHO: ToolDef = {
     "type": "function",
     "function": {
         "name": "remover_do_carrinho",
@@ -99,7 +104,7 @@ REMOVER_DO_CARRINHO = {
     },
 }
 
-ALTERAR_QUANTIDADE = {
+ALTERAR_QUANTIDADE: ToolDef = {
     "type": "function",
     "function": {
         "name": "alterar_quantidade",
@@ -121,67 +126,52 @@ ALTERAR_QUANTIDADE = {
     },
 }
 
-VIEW_CART = {
+VIEW_CART: ToolDef = {
     "type": "function",
     "function": {
         "name": "view_cart",
         "description": "Mostra o carrinho atual do cliente com todos os itens e total. SEMPRE use antes de gerar pagamento ou confirmar valores.",
-        "parameters": {
-            "type": "object",
-            "properties": {},
-        },
+        "parameters": _EMPTY_PARAMS,
     },
 }
 
-LIMPAR_CARRINHO = {
+LIMPAR_CARRINHO: ToolDef = {
     "type": "function",
     "function": {
         "name": "limpar_carrinho",
         "description": "Limpa todo o carrinho do cliente. Use APOS gerar pagamento (pix ou cartao).",
-        "parameters": {
-            "type": "object",
-            "properties": {},
-        },
+        "parameters": _EMPTY_PARAMS,
     },
 }
 
-GERAR_PIX = {
+GERAR_PIX: ToolDef = {
     "type": "function",
     "function": {
         "name": "gerar_pix",
         "description": "Gera pagamento PIX para o cliente. Use APENAS quando cliente escolher pagar com PIX.",
-        "parameters": {
-            "type": "object",
-            "properties": {},
-        },
+        "parameters": _EMPTY_PARAMS,
     },
 }
 
-GERAR_PAGAMENTO = {
+GERAR_PAGAMENTO: ToolDef = {
     "type": "function",
     "function": {
         "name": "gerar_pagamento",
         "description": "Gera link de pagamento para cartao de credito/debito. Use APENAS quando cliente escolher cartao. NUNCA use para PIX.",
-        "parameters": {
-            "type": "object",
-            "properties": {},
-        },
+        "parameters": _EMPTY_PARAMS,
     },
 }
 
-ENVIAR_QR_CODE_PIX = {
+ENVIAR_QR_CODE_PIX: ToolDef = {
     "type": "function",
     "function": {
         "name": "enviar_qr_code_pix",
         "description": "Envia imagem do QR Code PIX para o cliente. So use quando cliente pedir explicitamente o QR Code.",
-        "parameters": {
-            "type": "object",
-            "properties": {},
-        },
+        "parameters": _EMPTY_PARAMS,
     },
 }
 
-ENVIAR_FOTO_PRODUTO = {
+ENVIAR_FOTO_PRODUTO: ToolDef = {
     "type": "function",
     "function": {
         "name": "enviar_foto_produto",
@@ -199,7 +189,7 @@ ENVIAR_FOTO_PRODUTO = {
     },
 }
 
-CALCULAR_FRETE = {
+CALCULAR_FRETE: ToolDef = {
     "type": "function",
     "function": {
         "name": "calcular_frete",
@@ -230,7 +220,7 @@ CALCULAR_FRETE = {
     },
 }
 
-CONFIRMAR_FRETE = {
+CONFIRMAR_FRETE: ToolDef = {
     "type": "function",
     "function": {
         "name": "confirmar_frete",
@@ -256,7 +246,7 @@ CONFIRMAR_FRETE = {
     },
 }
 
-SALVAR_ENDERECO = {
+SALVAR_ENDERECO: ToolDef = {
     "type": "function",
     "function": {
         "name": "salvar_endereco",
@@ -274,19 +264,16 @@ SALVAR_ENDERECO = {
     },
 }
 
-BUSCAR_HISTORICO_COMPRAS = {
+BUSCAR_HISTORICO_COMPRAS: ToolDef = {
     "type": "function",
     "function": {
         "name": "buscar_historico_compras",
         "description": "Busca produtos que o cliente ja comprou anteriormente. Use para sugerir recompra ANTES de finalizar pedido.",
-        "parameters": {
-            "type": "object",
-            "properties": {},
-        },
+        "parameters": _EMPTY_PARAMS,
     },
 }
 
-VERIFICAR_STATUS_PEDIDO = {
+VERIFICAR_STATUS_PEDIDO: ToolDef = {
     "type": "function",
     "function": {
         "name": "verificar_status_pedido",
@@ -304,7 +291,7 @@ VERIFICAR_STATUS_PEDIDO = {
     },
 }
 
-ESCALAR_ATENDIMENTO = {
+ESCALAR_ATENDIMENTO: ToolDef = {
     "type": "function",
     "function": {
         "name": "escalar_atendimento",
@@ -334,3 +321,24 @@ ESCALAR_ATENDIMENTO = {
         },
     },
 }
+
+
+# Ordem em que as tools são enviadas ao modelo
+_TOOL_DEFINITIONS: Tuple[ToolDef, ...] = (
+    BUSCAR_PRODUTOS,
+    ADD_TO_CART,
+    REMOVER_DO_CARRINHO,
+    ALTERAR_QUANTIDADE,
+    VIEW_CART,
+    LIMPAR_CARRINHO,
+    GERAR_PIX,
+    GERAR_PAGAMENTO,
+    ENVIAR_QR_CODE_PIX,
+    ENVIAR_FOTO_PRODUTO,
+    CALCULAR_FRETE,
+    CONFIRMAR_FRETE,
+    SALVAR_ENDERECO,
+    BUSCAR_HISTORICO_COMPRAS,
+    VERIFICAR_STATUS_PEDIDO,
+    ESCALAR_ATENDIMENTO,
+)
@@ -2,18 +2,30 @@
 Tool Executor: Mapeia tool calls do OpenAI para funções Python reais.
 Conecta o agente aos serviços existentes (Supabase, ZAPI).
 """
-import json
-import os
+import asyncio
 import random
 import string
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 from decimal import Decimal
+import orjson
 from loguru import logger
+import psycopg2
+from psycopg2 import pool
+from psycopg2.extras import RealDictCursor
 
 from ..services.supabase_produtos import get_supabase_produtos
 from ..services.supabase_carrinho import get_supabase_carrinho
 from ..services.zapi_client import get_zapi_client
 from ..services.frete_service import get_frete_service
+from ..utils.db import get_database_url
+
+
+# Campos de cada produto de buscar_produtos mantidos no histórico salvo.
+# descricao e imagem_url ficam só na resposta do turno: enviar_foto_produto
+# busca a imagem pelo id.
+CAMPOS_PRODUTO_HISTORICO = (
+    "id", "nome", "preco", "preco_original", "categoria", "peso", "unidade", "estoque",
+)
 
 
 def _decimal_default(obj):
@@ -31,6 +43,21 @@ class ToolExecutor:
         self.zapi_client = get_zapi_client()
         self.frete_service = get_frete_service()
 
+        # Pool próprio para as tabelas fora dos serviços (clientes,
+        # historico_compras): evita abrir uma conexão TLS a cada tool call
+        self._pool = None
+        self.database_url = database_url = get_database_url()
+        if database_url:
+            try:
+                self._pool = pool.ThreadedConnectionPool(
+                    minconn=1,
+                    maxconn=4,
+                    dsn=database_url,
+                    sslmode="require",
+                )
+            except Exception as e:
+                logger.error(f"Erro ao criar pool do tool executor: {e}")
+
         self._handlers = {
             "buscar_produtos": self._buscar_produtos,
             "add_to_cart": self._add_to_cart,
@@ -64,14 +91,40 @@ class ToolExecutor:
         """
         handler = self._handlers.get(tool_name)
         if not handler:
-            return json.dumps({"erro": f"Tool desconhecida: {tool_name}"})
+            return orjson.dumps({"erro": f"Tool desconhecida: {tool_name}"}).decode()
 
         try:
             result = await handler(arguments, telefone)
-            return json.dumps(result, ensure_ascii=False, default=_decimal_default)
+            return orjson.dumps(result, default=_decimal_default).decode()
         except Exception as e:
             logger.error(f"Erro ao executar tool {tool_name}: {e}")
-            return json.dumps({"erro": f"Erro ao executar {tool_name}: {str(e)}"})
+            return orjson.dumps({"erro": f"Erro ao executar {tool_name}: {str(e)}"}).decode()
+
+    @staticmethod
+    def resumir_para_historico(tool_name: str, result: str) -> str:
+        """
+        Versão enxuta do resultado de uma tool para gravar no chat_history.
+
+        O modelo recebe o resultado completo no turno atual; nos turnos
+        seguintes o histórico só precisa identificar o que foi mostrado.
+        Para buscar_produtos mantém CAMPOS_PRODUTO_HISTORICO de cada produto;
+        as demais tools são gravadas como vieram.
+        """
+        if tool_name != "buscar_produtos":
+            return result
+        try:
+            data = orjson.loads(result)
+        except orjson.JSONDecodeError:
+            return result
+        produtos = data.get("produtos") if isinstance(data, dict) else None
+        if not produtos:
+            return result
+
+        data["produtos"] = [
+            {k: p[k] for k in CAMPOS_PRODUTO_HISTORICO if k in p}
+            for p in produtos
+        ]
+        return orjson.dumps(data).decode()
 
     # ==================== Handlers ====================
 
@@ -79,7 +132,9 @@ class ToolExecutor:
         termo = args.get("termo", "")
         limite = args.get("limite", 20)
 
-        produtos = self.produtos_service.buscar_produtos(termo=termo, limite=limite)
+        produtos = await asyncio.to_thread(
+            self.produtos_service.buscar_produtos, termo=termo, limite=limite
+        )
 
         logger.info(f"Busca '{termo}': {len(produtos)} produtos encontrados")
 
@@ -119,7 +174,9 @@ class ToolExecutor:
         if not produto_id or not produto_nome:
             return {"erro": "produto_id e produto_nome sao obrigatorios"}
 
-        result = self.carrinho_service.adicionar_item(
+        # Upsert do item e totais atualizados numa única ida ao banco
+        result = await asyncio.to_thread(
+            self.carrinho_service.adicionar_item_com_totais,
             telefone=telefone,
             produto_id=produto_id,
             produto_nome=produto_nome,
@@ -127,80 +184,60 @@ class ToolExecutor:
             quantidade=quantidade,
         )
 
-        # Calcular total atualizado
-        total = self.carrinho_service.calcular_total(telefone)
-        itens = self.carrinho_service.contar_itens(telefone)
-
         return {
             "sucesso": True,
             "mensagem": f"Adicionado ao carrinho: {produto_nome} x{quantidade}",
-            "total_carrinho": float(total),
-            "total_itens": itens,
+            "total_carrinho": result.get("total", 0.0),
+            "total_itens": result.get("total_itens", 0),
             "status": result.get("status", "added"),
         }
 
     async def _remover_do_carrinho(self, args: Dict, telefone: str) -> Dict:
         produto_nome = args.get("produto_nome", "")
 
-        # Buscar produto no carrinho pelo nome
-        carrinho = self.carrinho_service.obter_carrinho(telefone)
-        produto_id = None
-        for item in carrinho:
-            if item["nome"].lower() == produto_nome.lower():
-                produto_id = item["produto_id"]
-                break
-
-        if not produto_id:
-            # Tentar match parcial
-            for item in carrinho:
-                if produto_nome.lower() in item["nome"].lower():
-                    produto_id = item["produto_id"]
-                    produto_nome = item["nome"]
-                    break
-
-        if not produto_id:
+        # Busca pelo nome, remoção e novo total num único comando no banco
+        removido = await asyncio.to_thread(
+            self.carrinho_service.remover_item_por_nome, telefone, produto_nome
+        )
+        if not removido:
             return {"erro": f"Produto '{produto_nome}' nao encontrado no carrinho"}
 
-        self.carrinho_service.remover_item(telefone, produto_id)
-        total = self.carrinho_service.calcular_total(telefone)
-
         return {
             "sucesso": True,
-            "mensagem": f"Removido do carrinho: {produto_nome}",
-            "total_carrinho": float(total),
+            "mensagem": f"Removido do carrinho: {removido['produto_nome']}",
+            "total_carrinho": removido["total"],
         }
 
     async def _alterar_quantidade(self, args: Dict, telefone: str) -> Dict:
         produto_nome = args.get("produto_nome", "")
         quantidade = args.get("quantidade", 1)
 
-        carrinho = self.carrinho_service.obter_carrinho(telefone)
-        produto_id = None
-        for item in carrinho:
-            if produto_nome.lower() in item["nome"].lower():
-                produto_id = item["produto_id"]
-                produto_nome = item["nome"]
-                break
-
-        if not produto_id:
-            return {"erro": f"Produto '{produto_nome}' nao encontrado no carrinho"}
-
         if quantidade <= 0:
-            self.carrinho_service.remover_item(telefone, produto_id)
-            return {"sucesso": True, "mensagem": f"Removido: {produto_nome}"}
-
-        self.carrinho_service.atualizar_quantidade(telefone, produto_id, quantidade)
-        total = self.carrinho_service.calcular_total(telefone)
+            removido = await asyncio.to_thread(
+                self.carrinho_service.remover_item_por_nome, telefone, produto_nome
+            )
+            if not removido:
+                return {"erro": f"Produto '{produto_nome}' nao encontrado no carrinho"}
+            return {"sucesso": True, "mensagem": f"Removido: {removido['produto_nome']}"}
+
+        alterado = await asyncio.to_thread(
+            self.carrinho_service.atualizar_quantidade_por_nome,
+            telefone, produto_nome, quantidade,
+        )
+        if not alterado:
+            return {"erro": f"Produto '{produto_nome}' nao encontrado no carrinho"}
 
         return {
             "sucesso": True,
-            "mensagem": f"Quantidade atualizada: {produto_nome} -> {quantidade}",
-            "total_carrinho": float(total),
+            "mensagem": f"Quantidade atualizada: {alterado['produto_nome']} -> {quantidade}",
+            "total_carrinho": alterado["total"],
         }
 
     async def _view_cart(self, args: Dict, telefone: str) -> Dict:
-        itens = self.carrinho_service.obter_carrinho(telefone)
-        total = self.carrinho_service.calcular_total(telefone)
+        itens, total = await asyncio.gather(
+            asyncio.to_thread(self.carrinho_service.obter_carrinho, telefone),
+            asyncio.to_thread(self.carrinho_service.calcular_total, telefone),
+        )
 
         if not itens:
             return {"vazio": True, "itens": [], "total": 0.0, "mensagem": "Carrinho vazio"}
@@ -213,18 +250,22 @@ class ToolExecutor:
         }
 
     async def _limpar_carrinho(self, args: Dict, telefone: str) -> Dict:
-        self.carrinho_service.limpar_carrinho(telefone)
-        self.carrinho_service.limpar_frete(telefone)
+        await asyncio.gather(
+            asyncio.to_thread(self.carrinho_service.limpar_carrinho, telefone),
+            asyncio.to_thread(self.carrinho_service.limpar_frete, telefone),
+        )
         return {"sucesso": True, "mensagem": "Carrinho e frete limpos"}
 
     async def _gerar_pix(self, args: Dict, telefone: str) -> Dict:
         """Gera pagamento PIX (mock por enquanto). Inclui frete confirmado no total."""
-        total_produtos = self.carrinho_service.calcular_total(telefone)
+        # Total e frete confirmado em paralelo
+        total_produtos, frete = await asyncio.gather(
+            asyncio.to_thread(self.carrinho_service.calcular_total, telefone),
+            asyncio.to_thread(self.carrinho_service.obter_frete, telefone),
+        )
         if total_produtos <= 0:
             return {"erro": "Carrinho vazio. Adicione produtos antes de gerar pagamento."}
 
-        # Buscar frete confirmado
-        frete = self.carrinho_service.obter_frete(telefone)
         valor_frete = frete["valor_frete"] if frete else 0
         total = total_produtos + valor_frete
 
@@ -250,12 +291,14 @@ class ToolExecutor:
 
     async def _gerar_pagamento(self, args: Dict, telefone: str) -> Dict:
         """Gera link de pagamento cartão (mock por enquanto). Inclui frete confirmado no total."""
-        total_produtos = self.carrinho_service.calcular_total(telefone)
+        # Total e frete confirmado em paralelo
+        total_produtos, frete = await asyncio.gather(
+            asyncio.to_thread(self.carrinho_service.calcular_total, telefone),
+            asyncio.to_thread(self.carrinho_service.obter_frete, telefone),
+        )
         if total_produtos <= 0:
             return {"erro": "Carrinho vazio. Adicione produtos antes de gerar pagamento."}
 
-        # Buscar frete confirmado
-        frete = self.carrinho_service.obter_frete(telefone)
         valor_frete = frete["valor_frete"] if frete else 0
         total = total_produtos + valor_frete
 
@@ -288,7 +331,7 @@ class ToolExecutor:
         if not produto_id:
             return {"erro": "produto_id obrigatorio"}
 
-        produto = self.produtos_service.buscar_produto_por_id(produto_id)
+        produto = await asyncio.to_thread(self.produtos_service.buscar_produto_por_id, produto_id)
         if not produto:
             return {"erro": "Produto nao encontrado"}
 
@@ -296,7 +339,8 @@ class ToolExecutor:
         if not imagem_url:
             return {"erro": "Produto sem imagem disponivel"}
 
-        result = self.zapi_client.send_image(
+        result = await asyncio.to_thread(
+            self.zapi_client.send_image,
             phone=telefone,
             image_url=imagem_url,
             caption=produto.get("nome", ""),
@@ -332,7 +376,8 @@ class ToolExecutor:
         prazo_entrega = args.get("prazo_entrega", "")
 
         # Persistir frete confirmado no banco
-        self.carrinho_service.salvar_frete(
+        await asyncio.to_thread(
+            self.carrinho_service.salvar_frete,
             telefone=telefone,
             tipo_frete=tipo_frete,
             valor_frete=valor_frete,
@@ -347,6 +392,41 @@ class ToolExecutor:
             "mensagem": f"Frete confirmado: {tipo_frete} - R$ {valor_frete:.2f} ({prazo_entrega}). Este valor sera adicionado ao total do pagamento automaticamente.",
         }
 
+    def _consultar(self, query: str, params: tuple, fetch: bool = True) -> Optional[List[Dict]]:
+        """
+        Executa a query com uma conexão do pool (bloqueante: chamar via
+        asyncio.to_thread). Com o pool esgotado (mais threads do executor que
+        conexões) ou indisponível, usa uma conexão direta, fechada no fim.
+
+        Returns:
+            Linhas (dicts) se fetch, [] para escrita, None sem banco configurado
+        """
+        if not self.database_url:
+            return None
+        conn = None
+        if self._pool is not None:
+            try:
+                conn = self._pool.getconn()
+            except pool.PoolError as e:
+                logger.warning(f"Pool do tool executor esgotado, usando conexao direta: {e}")
+        do_pool = conn is not None
+        if not do_pool:
+            conn = psycopg2.connect(self.database_url, sslmode="require")
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor if fetch else None) as cursor:
+                cursor.execute(query, params)
+                rows = cursor.fetchall() if fetch else []
+            conn.commit()
+            return rows
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            if do_pool:
+                self._pool.putconn(conn)
+            else:
+                conn.close()
+
     async def _salvar_endereco(self, args: Dict, telefone: str) -> Dict:
         endereco = args.get("endereco", "")
         if not endereco:
@@ -354,28 +434,12 @@ class ToolExecutor:
 
         # Salvar no banco de clientes
         try:
-            import psycopg2
-            from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
-
-            db_url = os.getenv("DIRECT_URL") or os.getenv("DATABASE_URL")
-            if db_url:
-                # Sanitizar
-                u = urlparse(db_url)
-                qs = dict(parse_qsl(u.query, keep_blank_values=True))
-                for k in list(qs.keys()):
-                    if k in {"pgbouncer", "connection_limit"}:
-                        qs.pop(k, None)
-                clean_url = urlunparse((u.scheme, u.netloc, u.path, u.params, urlencode(qs, doseq=True), u.fragment))
-
-                conn = psycopg2.connect(clean_url, sslmode="require")
-                cursor = conn.cursor()
-                cursor.execute(
-                    "UPDATE clientes SET endereco = %s WHERE telefone = %s",
-                    (endereco, telefone),
-                )
-                conn.commit()
-                cursor.close()
-                conn.close()
+            await asyncio.to_thread(
+                self._consultar,
+                "UPDATE clientes SET endereco = %s WHERE telefone = %s",
+                (endereco, telefone),
+                False,
+            )
         except Exception as e:
             logger.error(f"Erro ao salvar endereco: {e}")
 
@@ -385,39 +449,22 @@ class ToolExecutor:
         """Busca histórico de compras (simplificado)."""
         # TODO: Integrar com tabela de pedidos real
         try:
-            import psycopg2
-            from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
-
-            db_url = os.getenv("DIRECT_URL") or os.getenv("DATABASE_URL")
-            if db_url:
-                u = urlparse(db_url)
-                qs = dict(parse_qsl(u.query, keep_blank_values=True))
-                for k in list(qs.keys()):
-                    if k in {"pgbouncer", "connection_limit"}:
-                        qs.pop(k, None)
-                clean_url = urlunparse((u.scheme, u.netloc, u.path, u.params, urlencode(qs, doseq=True), u.fragment))
-
-                conn = psycopg2.connect(clean_url, sslmode="require")
-                cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-                cursor.execute(
-                    """
-                    SELECT DISTINCT produto_nome, preco_unitario, quantidade
-                    FROM historico_compras
-                    WHERE telefone = %s
-                    ORDER BY produto_nome
-                    LIMIT 10
-                    """,
-                    (telefone,),
-                )
-                rows = cursor.fetchall()
-                cursor.close()
-                conn.close()
-
-                if rows:
-                    return {
-                        "tem_historico": True,
-                        "produtos_anteriores": [dict(r) for r in rows],
-                    }
+            rows = await asyncio.to_thread(
+                self._consultar,
+                """
+                SELECT DISTINCT produto_nome, preco_unitario, quantidade
+                FROM historico_compras
+                WHERE telefone = %s
+                ORDER BY produto_nome
+                LIMIT 10
+                """,
+                (telefone,),
+            )
+            if rows:
+                return {
+                    "tem_historico": True,
+                    "produtos_anteriores": [dict(r) for r in rows],
+                }
         except Exception as e:
             logger.debug(f"Historico de compras nao disponivel: {e}")
 
@@ -454,7 +501,8 @@ class ToolExecutor:
         if resumo_conversa:
             msg_bianca += f"\n💬 *Resumo da conversa:*\n{resumo_conversa}\n"
 
-        self.zapi_client.send_text(
+        await asyncio.to_thread(
+            self.zapi_client.send_text,
             phone="5531984844384",
             message=msg_bianca,
         )
@@ -2,6 +2,10 @@
 API FastAPI principal do agente WhatsApp.
 Inicializa SessionManager, AIAgent e MediaProcessor.
 """
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 from fastapi import FastAPI, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
@@ -11,6 +15,7 @@ from loguru import logger
 from ..services.session_manager import SessionManager
 from ..services.zapi_client import get_zapi_client
 from ..services.media_processor import MediaProcessor
+from ..services.frete_service import close_frete_service
 from ..models.session import MessageSource, SessionMode
 from ..agent.ai_agent import AIAgent
 from . import zapi_webhook
@@ -31,6 +36,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Threads do executor padrão: chamadas bloqueantes (psycopg2, requests) das
+# tools e do histórico rodam via asyncio.to_thread
+THREADS_EXECUTOR = int(os.getenv("THREADS_EXECUTOR", "32"))
+
 # Singletons
 session_manager = SessionManager()
 
@@ -140,6 +149,10 @@ async def startup_event():
     """Inicialização da aplicação."""
     logger.info("Iniciando Agente WhatsApp API v2.0 (AI Agent)...")
 
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=THREADS_EXECUTOR)
+    )
+
     # AI Agent
     try:
         ai_agent = AIAgent()
@@ -174,3 +187,6 @@ async def startup_event():
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("Encerrando Agente WhatsApp API...")
+    await close_frete_service()
+    if zapi_webhook.ai_agent:
+        zapi_webhook.ai_agent.history_manager.close()
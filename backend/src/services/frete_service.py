@@ -16,6 +16,8 @@ import os
 import re
 import time
 import uuid
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from typing import Dict, Any, Optional, Tuple, List
 
 import httpx
@@ -35,6 +37,12 @@ CEP_ORIGEM = "30190922"
 # Correios - Código SEDEX
 SEDEX_CODE = "03220"
 
+# Cache em memória das cotações: o mesmo cliente recalcula o frete para o
+# mesmo endereço a cada ajuste no carrinho. Cotações reais mudam pouco em
+# alguns minutos.
+CACHE_FRETE_TTL = float(os.getenv("FRETE_CACHE_TTL", "600"))
+CACHE_FRETE_MAX = 4096
+
 # Dimensões padrão do pacote (cm)
 DEFAULT_COMPRIMENTO = 30
 DEFAULT_ALTURA = 10
@@ -66,6 +74,27 @@ BH_KEYWORDS = [
     "ibirite", "ribeirao das neves", "vespasiano",
 ]
 
+# BH_KEYWORDS separadas para o teste por palavras do endereço: palavras
+# soltas num frozenset (interseção com as palavras do endereço) e expressões
+# com espaço entre espaços (casam só palavras inteiras do texto normalizado)
+_BH_PALAVRAS = frozenset(kw for kw in BH_KEYWORDS if " " not in kw)
+_BH_EXPRESSOES = tuple(f" {kw} " for kw in BH_KEYWORDS if " " in kw)
+_RE_PALAVRA = re.compile(r"\w+")
+
+
+
+@asynccontextmanager
+async def _cliente_http(http: Optional[httpx.AsyncClient]):
+    """
+    Usa o AsyncClient compartilhado (conexões keep-alive reaproveitadas) ou,
+    sem ele, abre um cliente só para a chamada.
+    """
+    if http is not None:
+        yield http
+    else:
+        async with httpx.AsyncClient() as client:
+            yield client
+
 
 # ==================== Nominatim (Geocoding) ====================
 
@@ -75,6 +104,9 @@ class NominatimClient:
     BASE_URL = "https://nominatim.openstreetmap.org/search"
     USER_AGENT = "RocaCapital/1.0 (sac@rocacapital.com.br)"
 
+    def __init__(self, http: Optional[httpx.AsyncClient] = None):
+        self._http = http
+
     async def geocode(self, endereco: str) -> Optional[Tuple[str, str]]:
         """
         Converte endereço em coordenadas (lat, lng).
@@ -83,7 +115,7 @@ class NominatimClient:
             Tuple (lat, lng) como strings, ou None se falhar.
         """
         try:
-            async with httpx.AsyncClient(timeout=10) as client:
+            async with _cliente_http(self._http) as client:
                 response = await client.get(
                     self.BASE_URL,
                     params={
@@ -93,6 +125,7 @@ class NominatimClient:
                         "countrycodes": "br",
                     },
                     headers={"User-Agent": self.USER_AGENT},
+                    timeout=10,
                 )
                 response.raise_for_status()
                 data = response.json()
@@ -116,7 +149,8 @@ class NominatimClient:
 class LalamoveClient:
     """Cliente para API Lalamove (cotação de entrega)."""
 
-    def __init__(self):
+    def __init__(self, http: Optional[httpx.AsyncClient] = None):
+        self._http = http
         self.api_key = os.getenv("LALAMOVE_API_KEY", "")
         self.api_secret = os.getenv("LALAMOVE_API_SECRET", "")
         self.base_url = os.getenv("LALAMOVE_BASE_URL", "https://rest.sandbox.lalamove.com")
@@ -191,8 +225,10 @@ class LalamoveClient:
         url = f"{self.base_url}{path}"
 
         try:
-            async with httpx.AsyncClient(timeout=15) as client:
-                response = await client.post(url, content=body, headers=headers)
+            async with _cliente_http(self._http) as client:
+                response = await client.post(
+                    url, content=body, headers=headers, timeout=15
+                )
 
                 if response.status_code in (200, 201):
                     data = response.json()
@@ -228,7 +264,8 @@ class CorreiosClient:
     BASE_URL_PRECO = "https://api.correios.com.br/preco/v1/nacional"
     BASE_URL_PRAZO = "https://api.correios.com.br/prazo/v1/nacional"
 
-    def __init__(self):
+    def __init__(self, http: Optional[httpx.AsyncClient] = None):
+        self._http = http
         self.token = os.getenv("CORREIOS_TOKEN", "")
         self.cep_origem = os.getenv("CORREIOS_CEP_ORIGEM", CEP_ORIGEM)
 
@@ -279,10 +316,10 @@ class CorreiosClient:
         }
 
         try:
-            async with httpx.AsyncClient(timeout=15) as client:
+            async with _cliente_http(self._http) as client:
                 # Buscar preço
                 response = await client.get(
-                    url_preco, params=params_preco, headers=headers
+                    url_preco, params=params_preco, headers=headers, timeout=15
                 )
 
                 preco = 0.0
@@ -309,7 +346,7 @@ class CorreiosClient:
                         "cepDestino": cep_limpo,
                     }
                     resp_prazo = await client.get(
-                        url_prazo, params=params_prazo, headers=headers
+                        url_prazo, params=params_prazo, headers=headers, timeout=15
                     )
                     if resp_prazo.status_code == 200:
                         data_prazo = resp_prazo.json()
@@ -351,11 +388,35 @@ class FreteService:
     """
 
     def __init__(self):
-        self.nominatim = NominatimClient()
-        self.lalamove = LalamoveClient()
-        self.correios = CorreiosClient()
+        # Um único AsyncClient para as três APIs: o pool de conexões evita
+        # refazer o handshake TLS a cada cotação
+        self._http = httpx.AsyncClient(
+            timeout=15,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        )
+        self.nominatim = NominatimClient(self._http)
+        self.lalamove = LalamoveClient(self._http)
+        self.correios = CorreiosClient(self._http)
+
+        # (endereço normalizado, peso em décimos de kg) -> (expira_em, opções);
+        # OrderedDict para despejo LRU. Só o event loop acessa: sem lock
+        self._cache: "OrderedDict[Tuple[str, int], Tuple[float, tuple]]" = OrderedDict()
         logger.info("FreteService inicializado")
 
+    def limpar_cache(self):
+        """Descarta as cotações em cache"""
+        self._cache.clear()
+
+    async def aclose(self):
+        """Fecha as conexões HTTP do serviço."""
+        await self._http.aclose()
+
+    async def __aenter__(self) -> "FreteService":
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
     @staticmethod
     def _extrair_cep(endereco: str) -> Optional[str]:
         """Extrai CEP (8 dígitos) de um endereço."""
@@ -378,9 +439,13 @@ class FreteService:
                     return True
             return False
 
-        # Fallback: keywords
-        endereco_lower = endereco.lower()
-        return any(kw in endereco_lower for kw in BH_KEYWORDS)
+        # Fallback: keywords, comparadas por palavra inteira ("bh" não casa
+        # com "bhtrans")
+        palavras = _RE_PALAVRA.findall(endereco.lower())
+        if not _BH_PALAVRAS.isdisjoint(palavras):
+            return True
+        texto = f" {' '.join(palavras)} "
+        return any(expressao in texto for expressao in _BH_EXPRESSOES)
 
     async def calcular(
         self,
@@ -399,6 +464,46 @@ class FreteService:
         Returns:
             Dict com opcoes_frete, endereco, mensagem
         """
+        # Pesos na mesma faixa de 100 g compartilham a cotação
+        chave = (" ".join(endereco.lower().split()), round(peso_kg * 10))
+        agora = time.monotonic()
+        em_cache = self._cache.get(chave)
+        if em_cache and em_cache[0] > agora:
+            self._cache.move_to_end(chave)
+            logger.debug(f"Frete em cache para '{endereco[:50]}'")
+            return self._resultado(endereco, em_cache[1])
+
+        opcoes, falhou = await self._calcular_opcoes(endereco, peso_kg)
+
+        # Estimativa por falha de API não vai para o cache: a próxima chamada
+        # tenta a cotação real de novo
+        if not falhou:
+            self._cache[chave] = (agora + CACHE_FRETE_TTL, tuple(opcoes))
+            self._cache.move_to_end(chave)
+            while len(self._cache) > CACHE_FRETE_MAX:
+                self._cache.popitem(last=False)
+
+        return self._resultado(endereco, opcoes)
+
+    @staticmethod
+    def _resultado(endereco: str, opcoes) -> Dict[str, Any]:
+        """Resposta de calcular, com cópias das opções (as do cache não mudam)"""
+        return {
+            "endereco": endereco,
+            "opcoes_frete": [dict(op) for op in opcoes],
+            "mensagem": "Frete calculado com sucesso",
+        }
+
+    async def _calcular_opcoes(
+        self, endereco: str, peso_kg: float
+    ) -> Tuple[List[Dict[str, Any]], bool]:
+        """
+        Cota as opções de frete nas APIs.
+
+        Returns:
+            Tuple (opções, falhou); falhou=True se alguma API consultada não
+            respondeu e a opção saiu do fallback estimado
+        """
         cep = self._extrair_cep(endereco)
         eh_bh = self._eh_bh_metro(cep=cep, endereco=endereco)
         peso_gramas = int(peso_kg * 1000)
@@ -420,42 +525,29 @@ class FreteService:
                 opcoes.append(self._fallback_lalamove(peso_kg))
 
             # SEDEX (se tem CEP)
-            if cep:
-                sedex_result = await self._cotar_sedex(cep, peso_gramas)
-                if sedex_result:
-                    opcoes.append(sedex_result)
-                else:
-                    opcoes.append(self._fallback_sedex_bh(peso_kg))
+            sedex_result = await self._cotar_sedex(cep, peso_gramas) if cep else None
+            if sedex_result:
+                opcoes.append(sedex_result)
             else:
                 opcoes.append(self._fallback_sedex_bh(peso_kg))
+            falhou = not lalamove_result or bool(cep and not sedex_result)
 
         else:
             # Fora de BH: só SEDEX
-            if cep:
-                sedex_result = await self._cotar_sedex(cep, peso_gramas)
-                if sedex_result:
-                    # Verificar prazo > 3 dias
-                    if sedex_result.get("prazo_dias", 0) > 3:
-                        sedex_result["observacao"] = (
-                            "Atenção: prazo superior a 3 dias. "
-                            "Não enviamos queijo com prazo maior que 3 dias úteis."
-                        )
-                    opcoes.append(sedex_result)
-                else:
-                    opcoes.append(self._fallback_sedex_fora(peso_kg))
+            sedex_result = await self._cotar_sedex(cep, peso_gramas) if cep else None
+            if sedex_result:
+                # Verificar prazo > 3 dias
+                if sedex_result.get("prazo_dias", 0) > 3:
+                    sedex_result["observacao"] = (
+                        "Atenção: prazo superior a 3 dias. "
+                        "Não enviamos queijo com prazo maior que 3 dias úteis."
+                    )
+                opcoes.append(sedex_result)
             else:
                 opcoes.append(self._fallback_sedex_fora(peso_kg))
+            falhou = bool(cep and not sedex_result)
 
-        # Arredondar valores
-        for op in opcoes:
-            if "valor" in op:
-                op["valor"] = round(op["valor"], 2)
-
-        return {
-            "endereco": endereco,
-            "opcoes_frete": opcoes,
-            "mensagem": "Frete calculado com sucesso",
-        }
+        return opcoes, falhou
 
     async def _cotar_lalamove(self, endereco: str) -> Optional[Dict[str, Any]]:
         """Cota entrega Lalamove com geocoding."""
@@ -480,7 +572,7 @@ class FreteService:
         return {
             "tipo": "lalamove",
             "nome": "Motoboy (Lalamove)",
-            "valor": result["preco"],
+            "valor": round(result["preco"], 2),
             "prazo": "45 minutos a 1 hora",
             "observacao": "Entrega no mesmo dia para pedidos até 16h",
         }
@@ -501,7 +593,7 @@ class FreteService:
         opcao: Dict[str, Any] = {
             "tipo": "correios_sedex",
             "nome": "Correios SEDEX",
-            "valor": result["preco"],
+            "valor": round(result["preco"], 2),
             "prazo": prazo_texto,
             "prazo_dias": prazo_dias,
         }
@@ -561,3 +653,11 @@ def get_frete_service() -> FreteService:
     if _frete_service is None:
         _frete_service = FreteService()
     return _frete_service
+
+
+async def close_frete_service():
+    """Fecha o singleton (shutdown da aplicação), se tiver sido criado."""
+    global _frete_service
+    if _frete_service is not None:
+        await _frete_service.aclose()
+        _frete_service = None
@@ -3,29 +3,29 @@ Serviço para gerenciar carrinhos persistentes no Supabase
 Garante que carrinhos sobrevivem a redeploys
 """
 
-import os
 import json
 from typing import Dict, List, Optional, Any
 from decimal import Decimal
-from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
 import psycopg2
 from psycopg2 import pool
 from psycopg2.extras import RealDictCursor
 from loguru import logger
 
+from ..utils.db import get_database_url
 
-DROP_QS_KEYS = {"pgbouncer", "connection_limit"}
 
-
-def sanitize_pg_dsn(database_url: str) -> str:
-    """Remove parâmetros incompatíveis com psycopg2"""
-    u = urlparse(database_url)
-    qs = dict(parse_qsl(u.query, keep_blank_values=True))
-    for k in list(qs.keys()):
-        if k in DROP_QS_KEYS:
-            qs.pop(k, None)
-    new_query = urlencode(qs, doseq=True)
-    return urlunparse((u.scheme, u.netloc, u.path, u.params, new_query, u.fragment))
+# Item do carrinho cujo nome contém o termo (sem diferenciar maiúsculas);
+# nome exato primeiro, depois o mais antigo. strpos em vez de LIKE: o termo
+# vem do modelo e não precisa escapar % e _
+_CTE_ITEM_POR_NOME = """
+    alvo AS (
+        SELECT produto_id, produto_nome
+        FROM carrinhos
+        WHERE telefone = %(telefone)s
+          AND strpos(lower(produto_nome), lower(%(nome)s)) > 0
+        ORDER BY lower(produto_nome) = lower(%(nome)s) DESC, criado_em
+        LIMIT 1
+    )"""
 
 
 class SupabaseCarrinho:
@@ -33,17 +33,15 @@ class SupabaseCarrinho:
 
     def __init__(self):
         """Inicializa conexão com Supabase"""
-        self.db_url = os.getenv("DIRECT_URL") or os.getenv("DATABASE_URL")
+        self.db_url = get_database_url()
         self._pool = None
 
         if self.db_url:
             try:
-                sanitized_url = sanitize_pg_dsn(self.db_url)
-                self.db_url = sanitized_url
                 self._pool = pool.ThreadedConnectionPool(
                     minconn=1,
                     maxconn=5,
-                    dsn=sanitized_url,
+                    dsn=self.db_url,
                     sslmode="require",
                 )
                 logger.info("Connection pool Carrinho criado (1-5 conexoes)")
@@ -82,21 +80,33 @@ class SupabaseCarrinho:
         except Exception:
             pass
 
-    def _execute(self, query: str, params: tuple = None, fetch: bool = True) -> Optional[List[Dict]]:
-        """Executa query no banco com conexão do pool"""
+    def _execute(
+        self, query: str, params: tuple = None, fetch: bool = True, commit: bool = False
+    ) -> Optional[List[Dict]]:
+        """
+        Executa query no banco com conexão do pool.
+
+        commit=True confirma também consultas com fetch (escrita com RETURNING);
+        sem ele a transação de uma leitura é descartada ao devolver a conexão.
+        """
         conn = self._get_connection()
         if not conn:
             logger.error("Sem conexao disponivel para carrinho")
             return None
 
         try:
-            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            # Só leituras precisam de linhas como dict; escrita usa o cursor padrão
+            cursor_factory = RealDictCursor if fetch else None
+            with conn.cursor(cursor_factory=cursor_factory) as cursor:
                 cursor.execute(query, params)
 
                 if fetch:
+                    # RealDictRow já é um dict: sem cópia extra por linha
                     result = cursor.fetchall()
+                    if commit:
+                        conn.commit()
                     self._put_connection(conn)
-                    return [dict(row) for row in result] if result else []
+                    return result
                 else:
                     conn.commit()
                     self._put_connection(conn)
@@ -180,6 +190,76 @@ class SupabaseCarrinho:
             logger.error(f"❌ Erro ao adicionar item: {e}")
             return {"status": "error", "message": str(e)}
 
+    def adicionar_item_com_totais(
+        self,
+        telefone: str,
+        produto_id: str,
+        produto_nome: str,
+        preco_unitario: float,
+        quantidade: int
+    ) -> Dict[str, Any]:
+        """
+        Como adicionar_item seguido de calcular_total e contar_itens, numa
+        única ida ao banco (upsert + totais no mesmo comando).
+
+        Os CTEs enxergam o carrinho de antes do upsert: o total soma os outros
+        itens ao subtotal devolvido pelo RETURNING.
+
+        Returns:
+            Dict com status da operação, total e total_itens
+        """
+        try:
+            query = """
+                WITH item AS (
+                    INSERT INTO carrinhos
+                        (telefone, produto_id, produto_nome, preco_unitario, quantidade, subtotal)
+                    VALUES (%(telefone)s, %(produto_id)s::uuid, %(nome)s, %(preco)s,
+                            %(quantidade)s, %(preco)s * %(quantidade)s)
+                    ON CONFLICT (telefone, produto_id) DO UPDATE SET
+                        quantidade = carrinhos.quantidade + EXCLUDED.quantidade,
+                        subtotal = EXCLUDED.preco_unitario
+                                   * (carrinhos.quantidade + EXCLUDED.quantidade),
+                        atualizado_em = NOW()
+                    RETURNING quantidade, subtotal, xmax = 0 AS inserido
+                ), outros AS (
+                    SELECT COALESCE(SUM(subtotal), 0) AS total, COUNT(*) AS itens
+                    FROM carrinhos
+                    WHERE telefone = %(telefone)s AND produto_id <> %(produto_id)s::uuid
+                )
+                SELECT item.quantidade, item.inserido,
+                       outros.total + item.subtotal AS total,
+                       outros.itens + 1 AS total_itens
+                FROM item, outros
+            """
+            result = self._execute(query, {
+                "telefone": telefone,
+                "produto_id": produto_id,
+                "nome": produto_nome,
+                "preco": preco_unitario,
+                "quantidade": quantidade,
+            }, commit=True)
+
+            if not result:
+                return {"status": "error", "message": "Falha ao gravar item"}
+
+            row = result[0]
+            totais = {"total": float(row["total"]), "total_itens": row["total_itens"]}
+            if not row["inserido"]:
+                logger.info(f"✅ Quantidade atualizada: {produto_nome} -> {row['quantidade']} un")
+                return {
+                    "status": "updated",
+                    "quantidade_anterior": row["quantidade"] - quantidade,
+                    "quantidade_nova": row["quantidade"],
+                    **totais,
+                }
+
+            logger.info(f"✅ Item adicionado ao carrinho: {produto_nome}")
+            return {"status": "added", **totais}
+
+        except Exception as e:
+            logger.error(f"❌ Erro ao adicionar item: {e}")
+            return {"status": "error", "message": str(e)}
+
     def obter_carrinho(self, telefone: str) -> List[Dict[str, Any]]:
         """
         Obtém todos os itens do carrinho de um cliente.
@@ -276,6 +356,86 @@ class SupabaseCarrinho:
             logger.error(f"❌ Erro ao atualizar quantidade: {e}")
             return False
 
+    def remover_item_por_nome(self, telefone: str, nome: str) -> Optional[Dict[str, Any]]:
+        """
+        Remove o item cujo nome contém `nome` (sem diferenciar maiúsculas;
+        nome exato tem prioridade) e devolve o total restante, numa única ida
+        ao banco, sem trazer o carrinho inteiro.
+
+        Returns:
+            Dict com produto_nome e total, ou None se não achou (ou erro)
+        """
+        try:
+            query = f"""
+                WITH {_CTE_ITEM_POR_NOME},
+                removido AS (
+                    DELETE FROM carrinhos c
+                    USING alvo
+                    WHERE c.telefone = %(telefone)s AND c.produto_id = alvo.produto_id
+                )
+                SELECT alvo.produto_nome,
+                       (SELECT COALESCE(SUM(subtotal), 0)
+                        FROM carrinhos
+                        WHERE telefone = %(telefone)s
+                          AND produto_id <> alvo.produto_id) AS total
+                FROM alvo
+            """
+            result = self._execute(query, {"telefone": telefone, "nome": nome}, commit=True)
+            if not result:
+                return None
+            row = result[0]
+            logger.info(f"🗑️ Item removido do carrinho: {row['produto_nome']}")
+            return {"produto_nome": row["produto_nome"], "total": float(row["total"])}
+
+        except Exception as e:
+            logger.error(f"❌ Erro ao remover item: {e}")
+            return None
+
+    def atualizar_quantidade_por_nome(
+        self, telefone: str, nome: str, nova_quantidade: int
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Como remover_item_por_nome, mas atualiza a quantidade do item achado
+        e devolve o total atualizado do carrinho.
+
+        Returns:
+            Dict com produto_nome e total, ou None se não achou (ou erro)
+        """
+        try:
+            query = f"""
+                WITH {_CTE_ITEM_POR_NOME},
+                item AS (
+                    UPDATE carrinhos c
+                    SET quantidade = %(quantidade)s,
+                        subtotal = c.preco_unitario * %(quantidade)s,
+                        atualizado_em = NOW()
+                    FROM alvo
+                    WHERE c.telefone = %(telefone)s AND c.produto_id = alvo.produto_id
+                    RETURNING c.subtotal
+                )
+                SELECT alvo.produto_nome,
+                       (SELECT COALESCE(SUM(subtotal), 0)
+                        FROM carrinhos
+                        WHERE telefone = %(telefone)s
+                          AND produto_id <> alvo.produto_id)
+                       + (SELECT subtotal FROM item) AS total
+                FROM alvo
+            """
+            result = self._execute(query, {
+                "telefone": telefone,
+                "nome": nome,
+                "quantidade": nova_quantidade,
+            }, commit=True)
+            if not result:
+                return None
+            row = result[0]
+            logger.info(f"✏️ Quantidade atualizada: {row['produto_nome']} -> {nova_quantidade}")
+            return {"produto_nome": row["produto_nome"], "total": float(row["total"])}
+
+        except Exception as e:
+            logger.error(f"❌ Erro ao atualizar quantidade: {e}")
+            return None
+
     def contar_itens(self, telefone: str) -> int:
         """Conta número de tipos de itens diferentes no carrinho"""
         try:
@@ -3,26 +3,31 @@ Serviço de produtos do Supabase
 Substitui os mocks por dados reais da tabela produtos_site
 """
 import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
 import psycopg2
 from psycopg2 import pool
 from psycopg2.extras import RealDictCursor
 from typing import List, Dict, Optional
 from loguru import logger
-from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
 
+from ..utils.db import get_database_url
 
-DROP_QS_KEYS = {"pgbouncer", "connection_limit"}
 
+# Cache em memória das buscas: o catálogo muda só na sincronização com o Tiny,
+# então repetir a mesma busca dentro de alguns segundos dispensa o banco.
+CACHE_BUSCA_TTL = float(os.getenv("PRODUTOS_CACHE_TTL", "60"))
+CACHE_BUSCA_MAX = 1024
 
-def sanitize_pg_dsn(database_url: str) -> str:
-    """Remove parâmetros incompatíveis com psycopg2"""
-    u = urlparse(database_url)
-    qs = dict(parse_qsl(u.query, keep_blank_values=True))
-    for k in list(qs.keys()):
-        if k in DROP_QS_KEYS:
-            qs.pop(k, None)
-    new_query = urlencode(qs, doseq=True)
-    return urlunparse((u.scheme, u.netloc, u.path, u.params, new_query, u.fragment))
+
+def _normalizar_termo(termo: Optional[str]) -> str:
+    """Normaliza termo para chave de cache: sem acentos, minúsculo, espaços únicos"""
+    if not termo:
+        return ""
+    sem_acento = unicodedata.normalize("NFKD", termo).encode("ascii", "ignore").decode()
+    return " ".join(sem_acento.lower().split())
 
 
 class SupabaseProdutos:
@@ -30,13 +35,11 @@ class SupabaseProdutos:
 
     def __init__(self):
         """Inicializa conexão com Supabase"""
-        self.database_url = os.getenv("DIRECT_URL") or os.getenv("DATABASE_URL")
+        self.database_url = get_database_url()
         if not self.database_url:
             logger.warning("⚠️ DATABASE_URL não configurado - usando modo mock")
-            self.database_url = None
             self._pool = None
         else:
-            self.database_url = sanitize_pg_dsn(self.database_url)
             try:
                 self._pool = pool.ThreadedConnectionPool(
                     minconn=1,
@@ -49,6 +52,15 @@ class SupabaseProdutos:
                 logger.error(f"Erro ao criar pool produtos: {e}")
                 self._pool = None
 
+        # chave -> (expira_em, produtos); OrderedDict para despejo LRU
+        self._cache_busca: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def limpar_cache(self):
+        """Descarta buscas em cache (ex: após sincronizar o catálogo)"""
+        with self._cache_lock:
+            self._cache_busca.clear()
+
     def _get_connection(self):
         """Obtém conexão do pool, com fallback para conexão direta"""
         if self._pool:
@@ -103,11 +115,46 @@ class SupabaseProdutos:
             logger.warning("⚠️ Sem conexão com Supabase - retornando lista vazia")
             return []
 
+        chave = (
+            _normalizar_termo(termo),
+            (categoria or "").lower(),
+            limite,
+            apenas_disponiveis,
+        )
+        agora = time.monotonic()
+        with self._cache_lock:
+            em_cache = self._cache_busca.get(chave)
+            if em_cache and em_cache[0] > agora:
+                self._cache_busca.move_to_end(chave)
+                return list(em_cache[1])
+
+        produtos = self._consultar_produtos(termo, categoria, limite, apenas_disponiveis)
+        if produtos is None:
+            # Erro no banco: não guarda em cache
+            return []
+
+        with self._cache_lock:
+            self._cache_busca[chave] = (agora + CACHE_BUSCA_TTL, produtos)
+            self._cache_busca.move_to_end(chave)
+            while len(self._cache_busca) > CACHE_BUSCA_MAX:
+                self._cache_busca.popitem(last=False)
+
+        return list(produtos)
+
+    def _consultar_produtos(
+        self,
+        termo: Optional[str],
+        categoria: Optional[str],
+        limite: int,
+        apenas_disponiveis: bool
+    ) -> Optional[List[Dict]]:
+        """Executa a busca no banco (sem cache). Retorna None em caso de erro."""
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
                 logger.error("Sem conexao disponivel para buscar produtos")
-                return []
+                return None
             cursor = conn.cursor(cursor_factory=RealDictCursor)
 
             # Construir query SQL
@@ -144,7 +191,8 @@ class SupabaseProdutos:
                 params.append(categoria)
 
             # Filtro: termo de busca (nome, descrição, categoria, tags)
-            # Usa UNACCENT para ignorar acentos: "cafes" encontra "Café" ✅
+            # Usa f_unaccent para ignorar acentos: "cafes" encontra "Café" ✅
+            # (mesmas expressões dos índices trigram da migração 007)
             #
             # Strategy for multi-word terms:
             # 1. Try full phrase match first ("%doce de leite%")
@@ -159,10 +207,10 @@ class SupabaseProdutos:
                     termo_like = f"%{termo}%"
                     query += """
                         AND (
-                            unaccent(LOWER(nome)) LIKE unaccent(LOWER(%s))
-                            OR unaccent(LOWER(categoria)) LIKE unaccent(LOWER(%s))
-                            OR unaccent(LOWER(tags::text)) LIKE unaccent(LOWER(%s))
-                            OR unaccent(LOWER(descricao)) LIKE unaccent(LOWER(%s))
+                            f_unaccent(lower(nome)) LIKE f_unaccent(lower(%s))
+                            OR f_unaccent(lower(categoria)) LIKE f_unaccent(lower(%s))
+                            OR f_unaccent(lower(f_tags_texto(tags))) LIKE f_unaccent(lower(%s))
+                            OR f_unaccent(lower(descricao)) LIKE f_unaccent(lower(%s))
                         )
                     """
                     params.extend([termo_like, termo_like, termo_like, termo_like])
@@ -171,10 +219,10 @@ class SupabaseProdutos:
                     termo_like = f"%{termo}%"
                     query += """
                         AND (
-                            unaccent(LOWER(nome)) LIKE unaccent(LOWER(%s))
-                            OR unaccent(LOWER(categoria)) LIKE unaccent(LOWER(%s))
-                            OR unaccent(LOWER(tags::text)) LIKE unaccent(LOWER(%s))
-                            OR unaccent(LOWER(descricao)) LIKE unaccent(LOWER(%s))
+                            f_unaccent(lower(nome)) LIKE f_unaccent(lower(%s))
+                            OR f_unaccent(lower(categoria)) LIKE f_unaccent(lower(%s))
+                            OR f_unaccent(lower(f_tags_texto(tags))) LIKE f_unaccent(lower(%s))
+                            OR f_unaccent(lower(descricao)) LIKE f_unaccent(lower(%s))
                         )
                     """
                     params.extend([termo_like, termo_like, termo_like, termo_like])
@@ -187,9 +235,9 @@ class SupabaseProdutos:
                     termo_like = f"%{termo}%"
                     query += """
                         ORDER BY
-                            CASE WHEN unaccent(LOWER(nome)) LIKE unaccent(LOWER(%s)) THEN 0 ELSE 1 END,
-                            CASE WHEN unaccent(LOWER(categoria)) LIKE unaccent(LOWER(%s)) THEN 0 ELSE 1 END,
-                            CASE WHEN unaccent(LOWER(tags::text)) LIKE unaccent(LOWER(%s)) THEN 0 ELSE 1 END,
+                            CASE WHEN f_unaccent(lower(nome)) LIKE f_unaccent(lower(%s)) THEN 0 ELSE 1 END,
+                            CASE WHEN f_unaccent(lower(categoria)) LIKE f_unaccent(lower(%s)) THEN 0 ELSE 1 END,
+                            CASE WHEN f_unaccent(lower(f_tags_texto(tags))) LIKE f_unaccent(lower(%s)) THEN 0 ELSE 1 END,
                             nome ASC
                         LIMIT %s
                     """
@@ -198,9 +246,9 @@ class SupabaseProdutos:
                 else:
                     query += """
                         ORDER BY
-                            CASE WHEN unaccent(LOWER(nome)) LIKE unaccent(LOWER(%s)) THEN 0 ELSE 1 END,
-                            CASE WHEN unaccent(LOWER(categoria)) LIKE unaccent(LOWER(%s)) THEN 0 ELSE 1 END,
-                            CASE WHEN unaccent(LOWER(tags::text)) LIKE unaccent(LOWER(%s)) THEN 0 ELSE 1 END,
+                            CASE WHEN f_unaccent(lower(nome)) LIKE f_unaccent(lower(%s)) THEN 0 ELSE 1 END,
+                            CASE WHEN f_unaccent(lower(categoria)) LIKE f_unaccent(lower(%s)) THEN 0 ELSE 1 END,
+                            CASE WHEN f_unaccent(lower(f_tags_texto(tags))) LIKE f_unaccent(lower(%s)) THEN 0 ELSE 1 END,
                             nome ASC
                         LIMIT %s
                     """
@@ -208,16 +256,8 @@ class SupabaseProdutos:
                     params.extend([termo_like, termo_like, termo_like])
                     params.append(limite)
             else:
-                # Se não tem termo, usar valores neutros para ordenação
-                query += """
-                    ORDER BY
-                        CASE WHEN unaccent(LOWER(nome)) LIKE unaccent(LOWER(%s)) THEN 0 ELSE 1 END,
-                        CASE WHEN unaccent(LOWER(categoria)) LIKE unaccent(LOWER(%s)) THEN 0 ELSE 1 END,
-                        CASE WHEN unaccent(LOWER(tags::text)) LIKE unaccent(LOWER(%s)) THEN 0 ELSE 1 END,
-                        nome ASC
-                    LIMIT %s
-                """
-                params.extend(["%", "%", "%"])
+                # Sem termo não há relevância a calcular: só ordem alfabética
+                query += " ORDER BY nome ASC LIMIT %s"
                 params.append(limite)
 
             cursor.execute(query, params)
@@ -249,10 +289,10 @@ class SupabaseProdutos:
                         palavra_like = f"%{palavra}%"
                         query2 += """
                             AND (
-                                unaccent(LOWER(nome)) LIKE unaccent(LOWER(%s))
-                                OR unaccent(LOWER(categoria)) LIKE unaccent(LOWER(%s))
-                                OR unaccent(LOWER(tags::text)) LIKE unaccent(LOWER(%s))
-                                OR unaccent(LOWER(descricao)) LIKE unaccent(LOWER(%s))
+                                f_unaccent(lower(nome)) LIKE f_unaccent(lower(%s))
+                                OR f_unaccent(lower(categoria)) LIKE f_unaccent(lower(%s))
+                                OR f_unaccent(lower(f_tags_texto(tags))) LIKE f_unaccent(lower(%s))
+                                OR f_unaccent(lower(descricao)) LIKE f_unaccent(lower(%s))
                             )
                         """
                         params2.extend([palavra_like, palavra_like, palavra_like, palavra_like])
@@ -275,7 +315,7 @@ class SupabaseProdutos:
             logger.error(f"❌ Erro ao buscar produtos: {e}")
             if conn:
                 self._put_connection(conn)
-            return []
+            return None
 
     def buscar_produto_por_id(self, produto_id: str) -> Optional[Dict]:
         """
@@ -368,6 +408,73 @@ class SupabaseProdutos:
                 self._put_connection(conn)
             return []
 
+    def estatisticas_catalogo(self, limite_destaques: int = 5) -> Dict:
+        """
+        Estatísticas do catálogo em uma única consulta (CTEs + json_build_object)
+
+        Args:
+            limite_destaques: Número máximo de nomes de produtos em destaque
+
+        Returns:
+            Dict com:
+                contagens: categoria -> produtos disponíveis (None = sem categoria)
+                categorias: categorias de produtos ativos (mesmo critério de listar_categorias)
+                destaques: nomes dos produtos em destaque disponíveis
+        """
+        vazio = {"contagens": {}, "categorias": [], "destaques": []}
+        if not self.database_url:
+            return vazio
+
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+
+            cursor.execute("""
+                WITH disponiveis AS (
+                    SELECT categoria, COUNT(*) AS total
+                    FROM produtos_site
+                    WHERE ativo = TRUE AND estoque_disponivel = TRUE
+                    GROUP BY categoria
+                ),
+                categorias AS (
+                    SELECT DISTINCT categoria
+                    FROM produtos_site
+                    WHERE categoria IS NOT NULL
+                    AND categoria != ''
+                    AND ativo = TRUE
+                ),
+                destaques AS (
+                    SELECT nome
+                    FROM produtos_site
+                    WHERE ativo = TRUE
+                    AND estoque_disponivel = TRUE
+                    AND destaque = TRUE
+                    ORDER BY nome ASC
+                    LIMIT %s
+                )
+                SELECT json_build_object(
+                    'contagens', (SELECT COALESCE(json_agg(json_build_array(categoria, total)), '[]') FROM disponiveis),
+                    'categorias', (SELECT COALESCE(json_agg(categoria ORDER BY categoria), '[]') FROM categorias),
+                    'destaques', (SELECT COALESCE(json_agg(nome ORDER BY nome), '[]') FROM destaques)
+                )
+            """, (limite_destaques,))
+
+            (dados,) = cursor.fetchone()
+
+            cursor.close()
+            self._put_connection(conn)
+
+            # Pares [categoria, total]: json_object_agg não aceita chave NULL
+            dados["contagens"] = {categoria: total for categoria, total in dados["contagens"]}
+            return dados
+
+        except Exception as e:
+            logger.error(f"❌ Erro ao calcular estatísticas do catálogo: {e}")
+            if conn:
+                self._put_connection(conn)
+            return vazio
+
     def contar_por_termo(self, termo: str) -> int:
         """
         Conta quantos produtos disponíveis casam com um termo de busca.
@@ -392,10 +499,10 @@ class SupabaseProdutos:
                 WHERE ativo = TRUE
                 AND estoque_disponivel = TRUE
                 AND (
-                    unaccent(LOWER(nome)) LIKE unaccent(LOWER(%s))
-                    OR unaccent(LOWER(categoria)) LIKE unaccent(LOWER(%s))
-                    OR unaccent(LOWER(tags::text)) LIKE unaccent(LOWER(%s))
-                    OR unaccent(LOWER(descricao)) LIKE unaccent(LOWER(%s))
+                    f_unaccent(lower(nome)) LIKE f_unaccent(lower(%s))
+                    OR f_unaccent(lower(categoria)) LIKE f_unaccent(lower(%s))
+                    OR f_unaccent(lower(f_tags_texto(tags))) LIKE f_unaccent(lower(%s))
+                    OR f_unaccent(lower(descricao)) LIKE f_unaccent(lower(%s))
                 )
             """, (termo_like, termo_like, termo_like, termo_like))
 
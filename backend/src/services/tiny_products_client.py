@@ -10,12 +10,53 @@ Responsável por:
 
 import os
 import re
+import time
 import asyncio
+import hashlib
 import httpx
 from html import unescape
-from typing import Dict, List, Optional
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 from loguru import logger
 
+from src.utils.conversao import para_float
+
+
+class LimitadorTaxa:
+    """
+    Token bucket assíncrono: limita as chamadas a `taxa` por segundo,
+    permitindo rajadas curtas de até `rajada` chamadas.
+
+    Diferente de um sleep fixo após cada chamada, o tempo de resposta da
+    API já conta como espera, e chamadas concorrentes dividem a mesma cota.
+    """
+
+    def __init__(self, taxa: float, rajada: int = 1):
+        self.taxa = taxa
+        self.rajada = rajada
+        self._tokens = float(rajada)
+        self._atualizado = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def adquirir(self):
+        """Aguarda até haver cota para uma chamada (taxa <= 0 = sem limite)"""
+        if self.taxa <= 0:
+            return
+
+        async with self._lock:
+            while True:
+                agora = time.monotonic()
+                self._tokens = min(
+                    self.rajada, self._tokens + (agora - self._atualizado) * self.taxa
+                )
+                self._atualizado = agora
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self.taxa)
+
+
 class TinyProductsClient:
     """Cliente para API do Tiny ERP v3"""
 
@@ -31,6 +72,29 @@ class TinyProductsClient:
             logger.warning("⚠️ TINY_API_TOKEN ou TINY_TOKEN não configurado")
             logger.info("💡 Configure uma dessas variáveis com seu token da API v2 do Tiny")
 
+        # Cliente HTTP compartilhado (keep-alive): evita um handshake TLS por chamada
+        self._http: Optional[httpx.AsyncClient] = None
+
+        # Rate limit das chamadas à API (padrão: 1 req/s, metade do limite de 120 req/min)
+        self._limitador = LimitadorTaxa(
+            taxa=float(os.getenv("TINY_REQ_POR_SEGUNDO", "1")), rajada=5
+        )
+
+    def _get_http(self) -> httpx.AsyncClient:
+        """Retorna o cliente HTTP compartilhado, criando-o sob demanda"""
+        if self._http is None or self._http.is_closed:
+            self._http = httpx.AsyncClient(
+                timeout=30.0,
+                limits=httpx.Limits(max_keepalive_connections=20, keepalive_expiry=30)
+            )
+        return self._http
+
+    async def aclose(self):
+        """Fecha o cliente HTTP compartilhado"""
+        if self._http is not None and not self._http.is_closed:
+            await self._http.aclose()
+        self._http = None
+
     @staticmethod
     def _limpar_html(texto: str) -> str:
         """
@@ -83,35 +147,30 @@ class TinyProductsClient:
             if valor is None or valor == "":
                 continue
 
-            try:
-                # Se for string, substituir vírgula por ponto
-                if isinstance(valor, str):
-                    valor = valor.strip().replace(",", ".")
+            # Converter para float (aceita vírgula decimal)
+            estoque_float = para_float(valor, padrao=None)
 
-                # Converter para float
-                estoque_float = float(valor)
-
-                # Estoque negativo vira 0
-                if estoque_float < 0:
-                    logger.warning(
-                        f"⚠️ Estoque negativo detectado ({estoque_float}) para produto "
-                        f"{produto.get('id', '?')} - campo '{campo}'. Usando 0."
-                    )
-                    return 0.0
+            if estoque_float is None:
+                logger.debug(
+                    f"⚠️ Erro ao converter estoque do campo '{campo}': {valor}"
+                )
+                continue
 
-                # Sucesso!
-                if estoque_float > 0:
-                    logger.debug(
-                        f"✅ Estoque obtido do campo '{campo}': {estoque_float} "
-                        f"(produto {produto.get('id', '?')})"
-                    )
-                return estoque_float
+            # Estoque negativo vira 0
+            if estoque_float < 0:
+                logger.warning(
+                    f"⚠️ Estoque negativo detectado ({estoque_float}) para produto "
+                    f"{produto.get('id', '?')} - campo '{campo}'. Usando 0."
+                )
+                return 0.0
 
-            except (ValueError, TypeError) as e:
+            # Sucesso!
+            if estoque_float > 0:
                 logger.debug(
-                    f"⚠️ Erro ao converter estoque do campo '{campo}': {valor} - {e}"
+                    f"✅ Estoque obtido do campo '{campo}': {estoque_float} "
+                    f"(produto {produto.get('id', '?')})"
                 )
-                continue
+            return estoque_float
 
         # Nenhum campo funcionou
         logger.warning(
@@ -167,6 +226,7 @@ class TinyProductsClient:
         """
         for tentativa in range(max_tentativas):
             try:
+                await self._limitador.adquirir()
                 response = await client.post(url, data=data)
 
                 if response.status_code != 200:
@@ -227,11 +287,7 @@ class TinyProductsClient:
                 logger.debug(f"Produto {produto_id} indisponivel: {erro}")
                 return None
 
-        if client:
-            return await _fetch(client)
-        else:
-            async with httpx.AsyncClient(timeout=30.0) as c:
-                return await _fetch(c)
+        return await _fetch(client or self._get_http())
 
     async def obter_estoque(self, produto_id: str, client: Optional[httpx.AsyncClient] = None) -> Optional[float]:
         """
@@ -267,11 +323,7 @@ class TinyProductsClient:
                 logger.debug(f"Estoque {produto_id} indisponivel: {erro}")
                 return None
 
-        if client:
-            return await _fetch(client)
-        else:
-            async with httpx.AsyncClient(timeout=30.0) as c:
-                return await _fetch(c)
+        return await _fetch(client or self._get_http())
 
     async def obter_produto_completo(
         self,
@@ -297,26 +349,33 @@ class TinyProductsClient:
             if not produto:
                 return None
 
-            # Delay entre chamadas (usa metade do rate limit: 60 req/min = 1s entre chamadas)
-            await asyncio.sleep(1.0)
+            # Rate limiting: _chamar_api_com_retry aguarda o LimitadorTaxa
+            return await self._anexar_estoque(produto, produto_id, c)
 
-            # Buscar estoque
-            estoque = await self.obter_estoque(produto_id, client=c)
+        return await _fetch(client or self._get_http())
 
-            if estoque is not None:
-                produto["saldo"] = estoque
-                produto["estoque"] = estoque
-            else:
-                produto["saldo"] = 0
-                produto["estoque"] = 0
+    async def _anexar_estoque(
+        self,
+        produto: Dict,
+        produto_id: str,
+        client: httpx.AsyncClient
+    ) -> Dict:
+        """Busca o estoque atual e grava em produto["saldo"/"estoque"]"""
+        estoque = await self.obter_estoque(produto_id, client=client)
+
+        if estoque is not None:
+            produto["saldo"] = estoque
+            produto["estoque"] = estoque
+        else:
+            produto["saldo"] = 0
+            produto["estoque"] = 0
 
-            return produto
+        return produto
 
-        if client:
-            return await _fetch(client)
-        else:
-            async with httpx.AsyncClient(timeout=30.0) as c:
-                return await _fetch(c)
+    @staticmethod
+    def _assinatura_resumo(produto_resumo: Dict) -> str:
+        """Hash do item da listagem (produtos.pesquisa), usado pelo cache de detalhes"""
+        return hashlib.md5(repr(sorted(produto_resumo.items())).encode()).hexdigest()
 
     async def _buscar_pagina(self, client: httpx.AsyncClient, pagina: int) -> List[Dict]:
         """
@@ -360,118 +419,192 @@ class TinyProductsClient:
         self,
         limite: int = 0,
         filtrar_site: bool = True,
-        delay_entre_detalhes: float = 1.0
+        delay_entre_detalhes: float = 1.0,
+        concorrencia: int = 1
     ) -> List[Dict]:
         """
         Lista produtos do Tiny ERP com paginacao automatica
 
         A API v2 do Tiny retorna no maximo 20 produtos por pagina.
         Este metodo percorre todas as paginas automaticamente.
+        Para processar em fluxo (sem montar a lista), use iter_produtos.
 
         Args:
             limite: Maximo de produtos (0 = todos)
             filtrar_site: Se True, filtra apenas produtos com "site" nas obs
-            delay_entre_detalhes: Delay entre chamadas de detalhe (rate limiting)
+            delay_entre_detalhes: Intervalo médio entre chamadas à API (taxa =
+                1/delay req/s; 0 = taxa padrão do cliente)
+            concorrencia: Buscas de detalhe simultâneas (1 = sequencial)
 
         Returns:
             Lista de produtos normalizados
         """
-        modo = "apenas com 'site'" if filtrar_site else "TODOS"
-        logger.info(f"Buscando produtos do Tiny ERP ({modo})...")
-
         try:
-            todos_produtos_raw = []
-
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                # Buscar primeira pagina para saber total
-                primeira_pagina = await self._buscar_pagina(client, 1)
+            return [
+                produto async for produto in self.iter_produtos(
+                    limite=limite,
+                    filtrar_site=filtrar_site,
+                    delay_entre_detalhes=delay_entre_detalhes,
+                    concorrencia=concorrencia
+                )
+            ]
 
-                if not primeira_pagina:
-                    logger.warning("Nenhum produto encontrado no Tiny")
-                    return []
+        except Exception as e:
+            logger.error(f"Erro ao buscar produtos: {e}")
+            return []
 
-                todos_produtos_raw.extend(primeira_pagina)
+    async def iter_produtos(
+        self,
+        limite: int = 0,
+        filtrar_site: bool = True,
+        delay_entre_detalhes: float = 1.0,
+        concorrencia: int = 1,
+        cache_detalhes: Optional[Dict[str, Tuple[str, Dict]]] = None
+    ) -> AsyncIterator[Dict]:
+        """
+        Gera produtos normalizados conforme os detalhes ficam prontos
 
-                # Buscar paginas restantes
-                pagina = 2
-                while True:
-                    # Rate limiting entre paginas (usa metade do rate limit: 60 req/min)
-                    await asyncio.sleep(1.0)
+        Mesma busca de listar_produtos, mas entrega cada produto assim que
+        ele (e os anteriores) foi processado, na ordem da listagem do Tiny.
+        Permite gravar no banco enquanto as buscas de detalhe continuam.
 
-                    produtos_pagina = await self._buscar_pagina(client, pagina)
+        Args:
+            limite: Maximo de produtos (0 = todos)
+            filtrar_site: Se True, filtra apenas produtos com "site" nas obs
+            delay_entre_detalhes: Intervalo médio entre chamadas à API (taxa =
+                1/delay req/s; 0 = taxa padrão do cliente)
+            concorrencia: Buscas de detalhe simultâneas (1 = sequencial)
+            cache_detalhes: Cache {tiny_id: (assinatura, detalhes)} de execucoes
+                anteriores. Se o item da listagem não mudou (mesma assinatura),
+                reaproveita os detalhes e busca só o estoque. O dict é
+                atualizado com os detalhes buscados nesta execução.
+
+        Yields:
+            Produtos normalizados
+        """
+        modo = "apenas com 'site'" if filtrar_site else "TODOS"
+        logger.info(f"Buscando produtos do Tiny ERP ({modo})...")
 
-                    if not produtos_pagina:
-                        break
+        client = self._get_http()
+
+        # Processar cada produto (buscar detalhes + estoque)
+        # Reutiliza o httpx client compartilhado para todas as chamadas.
+        # Até `concorrencia` buscas simultâneas; o rate limit do Tiny é
+        # respeitado pelo LimitadorTaxa (compartilhado por todas as chamadas)
+        semaforo = asyncio.Semaphore(max(1, concorrencia))
+
+        async def _processar(idx: int, item: Dict):
+            produto_resumo = item.get("produto", {})
+            produto_id = produto_resumo.get("id")
+
+            if not produto_id:
+                return "ignorado", None
+
+            em_cache = None
+            if cache_detalhes is not None:
+                assinatura = self._assinatura_resumo(produto_resumo)
+                em_cache = cache_detalhes.get(str(produto_id))
+                if em_cache and em_cache[0] != assinatura:
+                    em_cache = None
+
+            async with semaforo:
+                # Log de progresso a cada 50 produtos
+                if idx % 50 == 0 or idx == 1:
+                    logger.info(f"Processando {idx}...")
+
+                if em_cache:
+                    # Item igual ao da última execução: só o estoque muda
+                    produto_completo = await self._anexar_estoque(
+                        dict(em_cache[1]), produto_id, client
+                    )
+                else:
+                    # Buscar detalhes completos (com observacoes + estoque)
+                    produto_completo = await self.obter_produto_completo(
+                        produto_id, client=client
+                    )
+                    if produto_completo and cache_detalhes is not None:
+                        cache_detalhes[str(produto_id)] = (assinatura, {
+                            k: v for k, v in produto_completo.items()
+                            if k not in ("saldo", "estoque")
+                        })
 
-                    todos_produtos_raw.extend(produtos_pagina)
-                    pagina += 1
+            if not produto_completo:
+                return "erro", None
 
-                    # Safety: maximo 100 paginas (2000 produtos)
-                    if pagina > 100:
-                        logger.warning("Limite de 100 paginas atingido")
-                        break
+            if filtrar_site and not await self._eh_produto_site_async(produto_completo):
+                return "ignorado", None
 
-            total_raw = len(todos_produtos_raw)
-            logger.info(f"Total bruto: {total_raw} produtos em {pagina - 1} paginas")
+            return "ok", self._normalizar_produto(produto_completo)
 
-            # Aplicar limite se especificado
-            if limite > 0:
-                todos_produtos_raw = todos_produtos_raw[:limite]
+        # Uma página por vez: os detalhes da página atual são buscados
+        # enquanto a próxima página já é pedida, e os produtos são entregues
+        # em ordem. Só a página atual fica em memória (não o catalogo todo).
+        pagina = 1
+        total_raw = 0
+        processados = 0
+        ignorados = 0
+        erros_api = 0
+        tarefas: List[asyncio.Task] = []
 
-            # Processar cada produto (buscar detalhes + estoque)
-            # Reutiliza httpx client para todas as chamadas
-            produtos_processados = []
-            ignorados = 0
-            erros_api = 0
+        # Taxa da sincronização: uma chamada a cada `delay_entre_detalhes` em média
+        taxa_padrao = self._limitador.taxa
+        if delay_entre_detalhes > 0:
+            self._limitador.taxa = 1 / delay_entre_detalhes
 
-            async with httpx.AsyncClient(timeout=30.0) as detail_client:
-                for idx, item in enumerate(todos_produtos_raw, 1):
-                    produto_resumo = item.get("produto", {})
-                    produto_id = produto_resumo.get("id")
-                    produto_nome = produto_resumo.get("descricao", produto_resumo.get("nome", "?"))
+        proxima: Optional[asyncio.Task] = asyncio.create_task(self._buscar_pagina(client, pagina))
 
-                    if not produto_id:
+        try:
+            while proxima:
+                produtos_pagina = await proxima
+                proxima = None
+
+                if not produtos_pagina:
+                    break
+
+                # Aplicar limite se especificado
+                if limite > 0:
+                    produtos_pagina = produtos_pagina[:limite - total_raw]
+
+                tarefas = [
+                    asyncio.create_task(_processar(idx, item))
+                    for idx, item in enumerate(produtos_pagina, total_raw + 1)
+                ]
+                total_raw += len(tarefas)
+
+                # Safety: maximo 100 paginas (2000 produtos)
+                if pagina >= 100:
+                    logger.warning("Limite de 100 paginas atingido")
+                elif not limite or total_raw < limite:
+                    proxima = asyncio.create_task(self._buscar_pagina(client, pagina + 1))
+
+                for tarefa in tarefas:
+                    status, produto = await tarefa
+                    if status == "ok":
+                        processados += 1
+                        yield produto
+                    elif status == "ignorado":
                         ignorados += 1
-                        continue
-
-                    # Log de progresso a cada 50 produtos
-                    if idx % 50 == 0 or idx == 1:
-                        logger.info(
-                            f"Processando {idx}/{len(todos_produtos_raw)} "
-                            f"({len(produtos_processados)} ok, {erros_api} erros)..."
-                        )
-
-                    # Buscar detalhes completos (com observacoes + estoque)
-                    produto_completo = await self.obter_produto_completo(
-                        produto_id, client=detail_client
-                    )
-
-                    if not produto_completo:
-                        erros_api += 1
-                        continue
-
-                    if filtrar_site:
-                        if await self._eh_produto_site_async(produto_completo):
-                            produtos_processados.append(self._normalizar_produto(produto_completo))
-                        else:
-                            ignorados += 1
                     else:
-                        produtos_processados.append(self._normalizar_produto(produto_completo))
-
-                    # Rate limiting entre chamadas de detalhe
-                    if delay_entre_detalhes > 0:
-                        await asyncio.sleep(delay_entre_detalhes)
-
-            logger.info(
-                f"Sincronizacao concluida: {len(produtos_processados)} produtos processados, "
-                f"{ignorados} sem filtro 'site', {erros_api} erros API, de {total_raw} total"
-            )
-
-            return produtos_processados
+                        erros_api += 1
 
-        except Exception as e:
-            logger.error(f"Erro ao buscar produtos: {e}")
-            return []
+                pagina += 1
+        finally:
+            # Consumidor parou antes do fim (erro/break): cancelar pendentes
+            for tarefa in tarefas:
+                tarefa.cancel()
+            if proxima:
+                proxima.cancel()
+            self._limitador.taxa = taxa_padrao
+
+        if not total_raw:
+            logger.warning("Nenhum produto encontrado no Tiny")
+            return
+
+        logger.info(
+            f"Sincronizacao concluida: {processados} produtos processados, "
+            f"{ignorados} sem filtro 'site', {erros_api} erros API, "
+            f"de {total_raw} total em {pagina - 1} paginas"
+        )
 
     async def _eh_produto_site_async(self, produto: Dict) -> bool:
         """
@@ -555,12 +688,12 @@ class TinyProductsClient:
             "nome": produto.get("nome", ""),
             "descricao": descricao_final,
             "observacoes": produto.get("obs", "") or produto.get("observacoes", "") or "",
-            "preco": float(produto.get("preco", 0) or 0),
-            "preco_custo": float(produto.get("preco_custo", 0) or 0),
-            "preco_promocional": float(produto.get("preco_promocional", 0) or 0),
+            "preco": para_float(produto.get("preco")),
+            "preco_custo": para_float(produto.get("preco_custo")),
+            "preco_promocional": para_float(produto.get("preco_promocional")),
             "unidade": produto.get("unidade", "UN"),
-            "peso_bruto": float(produto.get("peso_bruto", 0) or 0),
-            "peso_liquido": float(produto.get("peso_liquido", 0) or 0),
+            "peso_bruto": para_float(produto.get("peso_bruto")),
+            "peso_liquido": para_float(produto.get("peso_liquido")),
             "gtin": produto.get("gtin", ""),
             "categoria": produto.get("categoria", ""),
             "ncm": produto.get("ncm", ""),
@@ -572,6 +705,13 @@ class TinyProductsClient:
         }
 
 
+# Singleton
+_tiny_products_client: Optional[TinyProductsClient] = None
+
+
 def get_tiny_products_client() -> TinyProductsClient:
-    """Factory function para criar cliente Tiny"""
-    return TinyProductsClient()
+    """Retorna instância singleton do cliente Tiny"""
+    global _tiny_products_client
+    if _tiny_products_client is None:
+        _tiny_products_client = TinyProductsClient()
+    return _tiny_products_client
@@ -0,0 +1,30 @@
+"""
+Conversões numéricas para dados vindos de APIs externas (Tiny, etc.)
+"""
+from typing import Any, Optional
+
+
+def para_float(valor: Any, padrao: Optional[float] = 0.0) -> Optional[float]:
+    """
+    Converte números da API para float, aceitando vírgula decimal
+
+    Caminho rápido: float() direto (números e strings com ponto).
+    Só tenta trocar vírgula por ponto se a primeira conversão falhar.
+
+    Args:
+        valor: Número, string ("10,5", "10.5") ou None/""
+        padrao: Valor retornado quando não é possível converter
+
+    Returns:
+        Valor como float, ou `padrao` se vazio/inválido
+    """
+    if valor is None or valor == "":
+        return padrao
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return float(str(valor).strip().replace(",", "."))
+    except ValueError:
+        return padrao
@@ -0,0 +1,49 @@
+"""
+Configuração de conexão com o Postgres (Supabase) compartilhada pelos serviços
+"""
+import os
+from functools import lru_cache
+from typing import Optional
+from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
+
+# Parâmetros que psycopg2 não entende (Supabase específicos)
+DROP_QS_KEYS = frozenset({"pgbouncer", "connection_limit"})
+
+# Porta do pooler do Supabase em modo transação (sem prepared statements)
+PORTA_POOLER_TRANSACAO = "6543"
+
+
+@lru_cache(maxsize=4)
+def sanitize_pg_dsn(database_url: str) -> str:
+    """
+    Remove query params que psycopg2 não aceita
+    (ex: pgbouncer, connection_limit do Supabase)
+    """
+    u = urlparse(database_url)
+    qs = {
+        k: v for k, v in parse_qsl(u.query, keep_blank_values=True)
+        if k not in DROP_QS_KEYS
+    }
+    new_query = urlencode(qs, doseq=True)
+    return urlunparse((u.scheme, u.netloc, u.path, u.params, new_query, u.fragment))
+
+
+@lru_cache(maxsize=1)
+def get_database_url() -> Optional[str]:
+    """
+    DSN já sanitizada dos serviços: DIRECT_URL (preferida) ou DATABASE_URL.
+
+    Resolvida uma vez no primeiro uso (depois do load_dotenv da aplicação).
+
+    Returns:
+        DSN pronta para psycopg2, ou None se nenhuma variável estiver definida
+    """
+    database_url = os.getenv("DIRECT_URL") or os.getenv("DATABASE_URL")
+    if not database_url:
+        return None
+    return sanitize_pg_dsn(database_url)
+
+
+def usa_pooler_transacao(conn) -> bool:
+    """True se a conexão passa pelo pooler do Supabase em modo transação"""
+    return conn.get_dsn_parameters().get("port") == PORTA_POOLER_TRANSACAO
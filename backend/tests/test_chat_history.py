@@ -0,0 +1,183 @@
+"""
+Testes para o histórico de conversas (ChatHistoryManager)
+"""
+import struct
+from datetime import datetime, timedelta, timezone
+
+from src.agent.chat_history import ChatHistoryManager, _copy_binario
+
+sanitize = ChatHistoryManager._sanitize_messages
+
+
+def _assistant_tools(*ids, content=None):
+    return {
+        "role": "assistant",
+        "content": content,
+        "tool_calls": [
+            {"id": i, "type": "function", "function": {"name": "view_cart", "arguments": "{}"}}
+            for i in ids
+        ],
+    }
+
+
+def _tool(tool_call_id):
+    return {"role": "tool", "tool_call_id": tool_call_id, "content": "{}"}
+
+
+class TestSanitizeMessages:
+    """Testes de ChatHistoryManager._sanitize_messages"""
+
+    def test_historico_valido_inalterado(self):
+        """Testa que assistant com todas as respostas é mantido"""
+        messages = [
+            {"role": "user", "content": "oi"},
+            _assistant_tools("a", "b"),
+            _tool("a"),
+            _tool("b"),
+            {"role": "assistant", "content": "pronto"},
+        ]
+        assert sanitize(messages) == messages
+
+    def test_remove_tool_orfa(self):
+        """Testa tool sem assistant (cortada pelo LIMIT do histórico)"""
+        messages = [_tool("x"), {"role": "user", "content": "oi"}]
+        assert sanitize(messages) == [{"role": "user", "content": "oi"}]
+
+    def test_assistant_sem_todas_as_respostas(self):
+        """Testa que tool_calls incompletos viram assistant simples sem as tools"""
+        messages = [
+            {"role": "user", "content": "oi"},
+            _assistant_tools("a", "b", content="vou ver"),
+            _tool("a"),
+        ]
+        assert sanitize(messages) == [
+            {"role": "user", "content": "oi"},
+            {"role": "assistant", "content": "vou ver"},
+        ]
+
+
+class _CursorFalso:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.conn.consultas += 1
+
+    def fetchmany(self, size=None):
+        return list(self.conn.linhas)
+
+    def fetchone(self):
+        return self.conn.linhas[0] if self.conn.linhas else None
+
+
+class _ConexaoFalsa:
+    def __init__(self, linhas):
+        self.linhas = linhas
+        self.consultas = 0
+
+    def cursor(self, cursor_factory=None):
+        return _CursorFalso(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class TestCacheHistorico:
+    """Testes do cache de load_history com write-through em save_messages"""
+
+    def _manager(self, monkeypatch, conn):
+        manager = ChatHistoryManager()
+        monkeypatch.setattr(manager, "_get_connection", lambda: conn)
+        monkeypatch.setattr(manager, "_put_connection", lambda c: None)
+        return manager
+
+    def test_segunda_leitura_usa_cache_com_mensagens_gravadas(self, monkeypatch):
+        """Testa que a leitura seguinte não consulta o banco e inclui o turno gravado"""
+        monkeypatch.setattr("src.agent.chat_history.execute_values", lambda *a, **k: None)
+        conn = _ConexaoFalsa([("user", "oi", None, None, None, None)])
+        manager = self._manager(monkeypatch, conn)
+
+        assert manager.load_history("5531", limit=30) == [{"role": "user", "content": "oi"}]
+        manager.save_messages("5531", [
+            {"role": "user", "content": "quero queijo", "media_type": "text"},
+            {"role": "assistant", "content": "temos canastra"},
+        ])
+        consultas = conn.consultas
+
+        assert manager.load_history("5531", limit=2) == [
+            {"role": "user", "content": "quero queijo"},
+            {"role": "assistant", "content": "temos canastra"},
+        ]
+        assert conn.consultas == consultas
+
+    def test_filtro_de_telefones_confirma_ausencia_no_banco(self, monkeypatch):
+        """Testa que telefone fora do filtro (gravado por outra instância) é carregado"""
+        monkeypatch.setattr("src.agent.chat_history.FILTRO_TELEFONES", True)
+        conn = _ConexaoFalsa([("user", "oi", None, None, None, None)])
+        manager = self._manager(monkeypatch, conn)
+        manager._telefones_prontos = True
+
+        assert manager.load_history("5531", limit=30) == [{"role": "user", "content": "oi"}]
+        assert "5531" in manager._telefones_conhecidos
+
+    def test_gravador_em_background_junta_turnos(self, monkeypatch):
+        """Testa que turnos enfileirados são gravados num único INSERT"""
+        inserts = []
+        monkeypatch.setattr(
+            "src.agent.chat_history.execute_values",
+            lambda cursor, sql, linhas, **k: inserts.append(list(linhas)),
+        )
+        manager = self._manager(monkeypatch, _ConexaoFalsa([]))
+        monkeypatch.setattr("src.agent.chat_history.GRAVACAO_JANELA", 0.5)
+        manager._iniciar_gravador()
+
+        manager.save_messages("5531", [{"role": "user", "content": "oi"}])
+        manager.save_messages("5532", [{"role": "user", "content": "ola"}])
+        manager.close()
+
+        assert [[linha[:3] for linha in lote] for lote in inserts] == [
+            [("5531", "user", "oi"), ("5532", "user", "ola")]
+        ]
+
+
+class TestCopyBinario:
+    """Testes da codificação do COPY binário usada por bulk_load"""
+
+    def test_linha_codificada(self):
+        """Testa cabeçalho, campos (texto, NULL, jsonb, timestamptz) e trailer"""
+        linha = (
+            "5531", "assistant", None, [{"id": "a"}], None, None, "text", None,
+            datetime(2000, 1, 1, 0, 0, 1, tzinfo=timezone.utc),
+        )
+        dados = _copy_binario([linha]).getvalue()
+
+        assert dados.startswith(b"PGCOPY\n\xff\r\n\x00" + bytes(8))
+        assert dados.endswith(b"\xff\xff")
+        corpo = dados[19:-2]
+        assert struct.unpack(">h", corpo[:2]) == (9,)
+        assert corpo[2:10] == struct.pack(">i", 4) + b"5531"
+        assert struct.pack(">i", -1) in corpo
+        assert b"\x01" + b'[{"id":"a"}]' in corpo
+        assert corpo.endswith(struct.pack(">iq", 8, 1_000_000))
+
+
+class TestNovaConversa:
+    """Testes de is_new_conversation com last_time já carregado"""
+
+    def test_timeout(self):
+        """Testa limites de 30 minutos, com e sem fuso no timestamp"""
+        manager = ChatHistoryManager()
+        agora = datetime.now(timezone.utc)
+        assert not manager.is_new_conversation("5531", last_time=agora - timedelta(minutes=5))
+        assert manager.is_new_conversation("5531", last_time=agora - timedelta(minutes=31))
+        sem_fuso = (agora - timedelta(minutes=5)).replace(tzinfo=None)
+        assert not manager.is_new_conversation("5531", last_time=sem_fuso)
@@ -0,0 +1,26 @@
+"""
+Testes para as conversões numéricas de dados do Tiny
+"""
+from src.utils.conversao import para_float
+
+
+class TestParaFloat:
+    """Testes de para_float"""
+
+    def test_numeros_e_strings_com_ponto(self):
+        """Testa o caminho rápido (float direto)"""
+        assert para_float(10) == 10.0
+        assert para_float(10.5) == 10.5
+        assert para_float("10.5") == 10.5
+
+    def test_virgula_decimal(self):
+        """Testa strings com vírgula decimal vindas da API"""
+        assert para_float("10,5") == 10.5
+        assert para_float(" 3,25 ") == 3.25
+
+    def test_vazio_e_invalido_retornam_padrao(self):
+        """Testa que valores vazios ou inválidos retornam o padrão"""
+        assert para_float(None) == 0.0
+        assert para_float("") == 0.0
+        assert para_float("abc") == 0.0
+        assert para_float("abc", padrao=None) is None
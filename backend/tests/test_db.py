@@ -0,0 +1,41 @@
+"""
+Testes para a configuração de conexão com o Postgres
+"""
+from src.utils.db import get_database_url, sanitize_pg_dsn
+
+
+class TestSanitizePgDsn:
+    """Testes de sanitize_pg_dsn"""
+
+    def test_remove_parametros_do_supabase(self):
+        """Testa que pgbouncer e connection_limit são removidos"""
+        dsn = "postgresql://u:s@host:6543/db?pgbouncer=true&connection_limit=1&sslmode=require"
+        assert sanitize_pg_dsn(dsn) == "postgresql://u:s@host:6543/db?sslmode=require"
+
+    def test_dsn_sem_query_inalterada(self):
+        """Testa DSN sem parâmetros"""
+        assert sanitize_pg_dsn("postgresql://u:s@host:5432/db") == "postgresql://u:s@host:5432/db"
+
+
+class TestGetDatabaseUrl:
+    """Testes de get_database_url"""
+
+    def test_prefere_direct_url(self, monkeypatch):
+        """Testa que DIRECT_URL tem prioridade e vem sanitizada"""
+        monkeypatch.setenv("DIRECT_URL", "postgresql://u@direto:5432/db?pgbouncer=true")
+        monkeypatch.setenv("DATABASE_URL", "postgresql://u@pooler:6543/db")
+        get_database_url.cache_clear()
+        try:
+            assert get_database_url() == "postgresql://u@direto:5432/db"
+        finally:
+            get_database_url.cache_clear()
+
+    def test_sem_variaveis_retorna_none(self, monkeypatch):
+        """Testa ausência de DIRECT_URL e DATABASE_URL"""
+        monkeypatch.delenv("DIRECT_URL", raising=False)
+        monkeypatch.delenv("DATABASE_URL", raising=False)
+        get_database_url.cache_clear()
+        try:
+            assert get_database_url() is None
+        finally:
+            get_database_url.cache_clear()
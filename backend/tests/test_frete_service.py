@@ -0,0 +1,65 @@
+"""
+Testes para a detecção de região e o cache do FreteService
+"""
+import asyncio
+from collections import OrderedDict
+
+from src.services.frete_service import FreteService
+
+
+class TestEhBhMetro:
+    """Testes de FreteService._eh_bh_metro"""
+
+    def test_cep_tem_prioridade(self):
+        """Testa que o CEP decide mesmo com bairro de BH no texto"""
+        assert FreteService._eh_bh_metro(cep="30140071", endereco="Sao Paulo")
+        assert not FreteService._eh_bh_metro(cep="01310100", endereco="Savassi")
+
+    def test_palavra_e_expressao_do_endereco(self):
+        """Testa keywords de uma palavra e de várias, sem diferenciar maiúsculas"""
+        assert FreteService._eh_bh_metro(endereco="Rua Pernambuco, 100 - SAVASSI")
+        assert FreteService._eh_bh_metro(endereco="Rua A,  Nova   Lima/MG")
+        assert not FreteService._eh_bh_metro(endereco="Av. Paulista, 1000 - Sao Paulo")
+
+    def test_keyword_so_como_palavra_inteira(self):
+        """Testa que keywords não casam dentro de outras palavras"""
+        assert not FreteService._eh_bh_metro(endereco="Rua Serrana, Petropolis")
+        assert not FreteService._eh_bh_metro(endereco="Avenida Novalima, Recife")
+
+
+class TestCacheFrete:
+    """Testes do cache de cotações de FreteService.calcular"""
+
+    def _service(self, monkeypatch, resposta_sedex):
+        service = FreteService.__new__(FreteService)
+        service._cache = OrderedDict()
+        chamadas = []
+
+        async def cotar_sedex(cep, peso_gramas):
+            chamadas.append((cep, peso_gramas))
+            return dict(resposta_sedex) if resposta_sedex else None
+
+        monkeypatch.setattr(service, "_cotar_sedex", cotar_sedex)
+        return service, chamadas
+
+    def test_repete_endereco_sem_consultar_api(self, monkeypatch):
+        """Testa que a mesma cotação (endereço e faixa de peso) vem do cache"""
+        sedex = {"tipo": "correios_sedex", "valor": 40.0, "prazo_dias": 2}
+        service, chamadas = self._service(monkeypatch, sedex)
+
+        primeiro = asyncio.run(service.calcular("Rua A, 01310-100", peso_kg=1.0))
+        primeiro["opcoes_frete"][0]["valor"] = 0
+        segundo = asyncio.run(service.calcular("rua a,  01310-100", peso_kg=1.04))
+
+        assert len(chamadas) == 1
+        assert segundo["opcoes_frete"][0]["valor"] == 40.0
+        assert segundo["endereco"] == "rua a,  01310-100"
+
+    def test_falha_da_api_nao_entra_no_cache(self, monkeypatch):
+        """Testa que o fallback por falha da API é recalculado"""
+        service, chamadas = self._service(monkeypatch, None)
+
+        asyncio.run(service.calcular("Rua A, 01310-100"))
+        asyncio.run(service.calcular("Rua A, 01310-100"))
+
+        assert len(chamadas) == 2